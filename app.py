@@ -1,32 +1,81 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
 import uuid
 import os
 import shutil
 from pathlib import Path
 import logging
 from datetime import datetime
+from contextlib import asynccontextmanager
 
 # Import des fonctions de scan OCR
 from scan import (
-    scan_contravention, 
-    scan_certificat_immatriculation, 
-    scan_permis_conduire, 
-    scan_justificatif_domicile,
-    validate_documents_data
+    scan_contravention_async,
+    scan_certificat_immatriculation_async,
+    scan_permis_conduire_async,
+    scan_justificatif_domicile_async,
+    validate_documents_data_async,
+    scan_documents_batched_async,
+    reextract_fields_async,
+    get_scan_stats,
+    get_routing_stats,
+    close_async_client,
+    SCAN_MODE
 )
 from form_filler import fill_website_form
 # from your_modules.image_analysis import detect_clear_driver
-from generate_letter import generate_final_pdf
+from generate_letter import LATEX_PREAMBLE, render_letter_document, renderer_registry
+from latex_service import latex_service
+from extraction_cache import get_extraction_cache
+from preprocess import get_preprocessing_stats
+from field_checks import assess_extraction
+from local_ocr import get_local_ocr_stats
+from validation_rules import get_validation_stats
+from resilience import anthropic_circuit, get_resilience_stats
+from rate_limiter import PRIORITIES, DEFAULT_PRIORITY, priority_class, get_rate_limit_stats
+from task_store import create_task_store, MemoryTaskStore, TASK_STORE_URL, FINISHED_STATUSES
+from task_events import TaskEventBroker
+from job_queue import JobQueue, QueueFullError
+from browser_pool import BROWSER_POOL_ENABLED, browser_pool
+from scripted_form import get_form_stats
+from result_store import create_result_store, RESULT_STORE_URL
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialisation et arrêt propre des ressources partagées"""
+    if job_queue.mode == "process" and isinstance(task_store, MemoryTaskStore):
+        logger.warning("JOB_WORKER_MODE=process avec un stockage en mémoire: le statut des tâches ne sera pas visible")
+    await job_queue.start()
+    # Navigateurs lancés d'avance pour le remplissage du formulaire (les workers en processus séparés lancent les leurs)
+    if BROWSER_POOL_ENABLED and job_queue.mode == "inprocess":
+        await browser_pool.start()
+    # Moteurs de rendu des lettres vérifiés une fois au démarrage (pdflatex, ReportLab)
+    await asyncio.to_thread(renderer_registry.refresh)
+    if renderer_registry.status()["backend"] == "latex":
+        # Préambule des lettres précompilé avant la première tâche
+        await asyncio.to_thread(latex_service.prepare_format, LATEX_PREAMBLE)
+    yield
+    # Arrêt progressif: les traitements en cours sont terminés avant l'arrêt
+    for task_id in await job_queue.drain():
+        await update_task_status_async(task_id, "FAILED", error="Traitement interrompu par l'arrêt du service")
+    await browser_pool.close()
+    # Fermeture du pool de connexions du client Anthropic asynchrone
+    await close_async_client()
 
 # Configuration
 app = FastAPI(
     title="API Traitement Contraventions",
     description="API pour le traitement automatisé des contraventions",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configuration CORS
@@ -51,8 +100,28 @@ RESULTS_DIR = Path("results")
 for directory in [UPLOAD_DIR, TEMP_DIR, RESULTS_DIR]:
     directory.mkdir(exist_ok=True)
 
-# Stockage des tâches en mémoire (en production, utiliser Redis ou une BDD)
-tasks_storage: Dict[str, dict] = {}
+# Limites de taille des fichiers uploadés (par fichier et pour l'ensemble d'une demande)
+MAX_UPLOAD_FILE_BYTES = int(os.getenv("MAX_UPLOAD_FILE_BYTES", str(20 * 1024 * 1024)))
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv("MAX_UPLOAD_REQUEST_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Documents dont l'échec d'extraction fait échouer la tâche immédiatement.
+# Les autres documents sont ignorés en cas d'erreur (mode dégradé).
+REQUIRED_DOCUMENTS = set(
+    os.getenv("SCAN_REQUIRED_DOCUMENTS", "contravention,certificat,permis,domicile").split(",")
+)
+
+# Stockage des tâches (SQLite par défaut, Redis pour plusieurs machines, cf. TASK_STORE_URL)
+task_store = create_task_store(TASK_STORE_URL)
+
+# Stockage des lettres générées (répertoire local par défaut, S3 possible, cf. RESULT_STORE_URL)
+result_store = create_result_store(RESULT_STORE_URL)
+
+# Diffusion des changements de statut aux flux SSE de ce processus
+task_events = TaskEventBroker()
+
+# Intervalle de relecture du stockage par les flux SSE (mises à jour faites par d'autres processus)
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "1"))
 
 # Modèles Pydantic
 class TaskStatus(BaseModel):
@@ -64,24 +133,30 @@ class TaskStatus(BaseModel):
     created_at: datetime
     updated_at: datetime
     error: Optional[str] = None
+    documents: Optional[Dict[str, str]] = None
+    queue_position: Optional[int] = None
 
 class TaskResponse(BaseModel):
     task_id: str
     status: str
     message: str
+    queue_position: Optional[int] = None
+
+class ReextractRequest(BaseModel):
+    fields: Optional[List[str]] = None
+    crop: Optional[Tuple[float, float, float, float]] = None
+    fast: bool = False
 
 class HealthResponse(BaseModel):
     status: str
     timestamp: datetime
     version: str
+    pdf_backend: Optional[str] = None
 
 # États possibles des tâches avec plus de détails
 TASK_STATUS = {
     "UPLOADED": {"progress": 5, "message": "Documents reçus et vérifiés"},
-    "SCANNING_CONTRAVENTION": {"progress": 15, "message": "Extraction OCR de l'avis de contravention"},
-    "SCANNING_CERTIFICAT": {"progress": 25, "message": "Extraction OCR du certificat d'immatriculation"},
-    "SCANNING_PERMIS": {"progress": 35, "message": "Extraction OCR du permis de conduire"},
-    "SCANNING_DOMICILE": {"progress": 45, "message": "Extraction OCR du justificatif de domicile"},
+    "SCANNING_DOCUMENTS": {"progress": 10, "message": "Extraction OCR des documents en parallèle"},
     "VALIDATING": {"progress": 55, "message": "Validation croisée des données extraites"},
     "FILLING_FORM": {"progress": 65, "message": "Demande automatique d'image radar"},
     "RETRIEVING_RADAR_IMAGE": {"progress": 75, "message": "Récupération de l'image du radar"},
@@ -92,9 +167,9 @@ TASK_STATUS = {
 }
 
 # Fonctions de gestion des tâches
-def create_task(task_id: str, user_files: dict) -> None:
+def create_task(task_id: str, user_files: dict, file_hashes: dict = None) -> None:
     """Crée une nouvelle tâche de traitement"""
-    tasks_storage[task_id] = {
+    task_store.create({
         "task_id": task_id,
         "status": "UPLOADED",
         "progress": 0,
@@ -103,50 +178,111 @@ def create_task(task_id: str, user_files: dict) -> None:
         "created_at": datetime.now(),
         "updated_at": datetime.now(),
         "files": user_files,
+        "file_hashes": file_hashes or {},
         "error": None,
-        "result_file": None
-    }
+        "result_file": None,
+        "result": None,
+        "documents": None
+    })
     logger.info(f"Tâche {task_id} créée")
 
-def update_task_status(task_id: str, status: str, message: str = None, error: str = None) -> None:
+def update_task_status(task_id: str, status: str, message: str = None, error: str = None,
+                       progress: int = None) -> None:
     """Met à jour le statut d'une tâche"""
-    if task_id not in tasks_storage:
+    task = task_store.get(task_id)
+    if task is None:
         return
     
-    task = tasks_storage[task_id]
-    task["status"] = status
-    task["current_step"] = status
-    task["progress"] = TASK_STATUS.get(status, {}).get("progress", task["progress"])
-    task["message"] = message or TASK_STATUS.get(status, {}).get("message", "")
-    task["updated_at"] = datetime.now()
+    fields = {
+        "status": status,
+        "current_step": status,
+        "progress": progress if progress is not None else TASK_STATUS.get(status, {}).get("progress", task["progress"]),
+        "message": message or TASK_STATUS.get(status, {}).get("message", ""),
+        "updated_at": datetime.now()
+    }
     
     if error:
-        task["error"] = error
-        task["status"] = "FAILED"
-        task["progress"] = -1
+        fields["error"] = error
+        fields["status"] = "FAILED"
+        fields["progress"] = -1
+    
+    task = task_store.update(task_id, fields)
+    if task is not None:
+        task_events.publish(task)
     
     logger.info(f"Tâche {task_id} mise à jour: {status}")
 
 def get_task_status(task_id: str) -> Optional[dict]:
     """Récupère le statut actuel d'une tâche"""
-    return tasks_storage.get(task_id)
+    return task_store.get(task_id)
+
+async def update_task_status_async(task_id: str, status: str, message: str = None, error: str = None,
+                                   progress: int = None) -> None:
+    """Variante de update_task_status pour la boucle d'événements : le stockage SQLite
+    peut attendre son verrou d'écriture, l'appel part donc dans un thread"""
+    await asyncio.to_thread(update_task_status, task_id, status, message, error, progress)
+
+async def get_task_status_async(task_id: str) -> Optional[dict]:
+    """Variante de get_task_status pour la boucle d'événements"""
+    return await asyncio.to_thread(task_store.get, task_id)
 
-async def save_uploaded_files(task_id: str, files: dict) -> dict:
-    """Sauvegarde les fichiers uploadés et retourne leurs chemins"""
+def build_task_status(task: dict) -> TaskStatus:
+    """Construit la réponse de statut exposée par l'API à partir d'une tâche"""
+    # Ajouter des informations supplémentaires selon l'état
+    status_response = TaskStatus(**task)
+    status_response.queue_position = job_queue.position(task["task_id"])
+    
+    # Enrichir avec des détails selon l'état
+    if task["status"] == "COMPLETED" and "validation_result" in task:
+        validation = task["validation_result"]
+        status_response.message += f" - Validation: {validation.get('validation_status', 'UNKNOWN')}"
+    
+    return status_response
+
+def raise_file_too_large(detail: str) -> None:
+    """Refuse une demande dont les fichiers dépassent les limites de taille"""
+    raise HTTPException(status_code=413, detail=detail)
+
+async def save_uploaded_files(task_id: str, files: dict) -> tuple:
+    """
+    Sauvegarde les fichiers uploadés par blocs, sans bloquer la boucle d'événements,
+    en calculant leur empreinte SHA-256 pendant la copie.
+    Retourne (chemins, empreintes); lève une erreur 413 si une limite de taille est dépassée.
+    """
     file_paths = {}
+    file_hashes = {}
     task_dir = UPLOAD_DIR / task_id
     task_dir.mkdir(exist_ok=True)
+    request_bytes = 0
     
     for file_type, file in files.items():
         if file:
-            file_path = task_dir / f"{file_type}_{file.filename}"
-            with open(file_path, "wb") as buffer:
-                content = await file.read()
-                buffer.write(content)
+            # Refus immédiat quand la taille est connue d'avance
+            if file.size is not None and file.size > MAX_UPLOAD_FILE_BYTES:
+                raise_file_too_large(f"Fichier {file_type} trop volumineux (maximum {MAX_UPLOAD_FILE_BYTES} octets)")
+            
+            file_path = task_dir / f"{file_type}_{Path(file.filename).name}"
+            digest = hashlib.sha256()
+            file_bytes = 0
+            buffer = await asyncio.to_thread(open, file_path, "wb")
+            try:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    file_bytes += len(chunk)
+                    request_bytes += len(chunk)
+                    if file_bytes > MAX_UPLOAD_FILE_BYTES:
+                        raise_file_too_large(f"Fichier {file_type} trop volumineux (maximum {MAX_UPLOAD_FILE_BYTES} octets)")
+                    if request_bytes > MAX_UPLOAD_REQUEST_BYTES:
+                        raise_file_too_large(f"Documents trop volumineux (maximum {MAX_UPLOAD_REQUEST_BYTES} octets au total)")
+                    digest.update(chunk)
+                    await asyncio.to_thread(buffer.write, chunk)
+            finally:
+                await asyncio.to_thread(buffer.close)
+            
             file_paths[file_type] = str(file_path)
-            logger.info(f"Fichier {file_type} sauvegardé: {file_path}")
+            file_hashes[file_type] = digest.hexdigest()
+            logger.info(f"Fichier {file_type} sauvegardé: {file_path} ({file_bytes} octets)")
     
-    return file_paths
+    return file_paths, file_hashes
 
 def cleanup_files(task_id: str) -> None:
     """Nettoie les fichiers temporaires d'une tâche"""
@@ -155,152 +291,254 @@ def cleanup_files(task_id: str) -> None:
         shutil.rmtree(task_dir)
         logger.info(f"Fichiers temporaires de la tâche {task_id} supprimés")
 
+# Scans OCR: type de document -> (message de progression, fonction de scan, libellé pour les erreurs)
+SCAN_STEPS = {
+    "contravention": ("Extraction OCR de l'avis de contravention", scan_contravention_async, "de la contravention"),
+    "certificat": ("Extraction OCR du certificat d'immatriculation", scan_certificat_immatriculation_async, "du certificat"),
+    "permis": ("Extraction OCR du permis de conduire", scan_permis_conduire_async, "du permis"),
+    "domicile": ("Extraction OCR du justificatif de domicile", scan_justificatif_domicile_async, "du justificatif"),
+}
+
+async def extract_documents(task_id: str, file_paths: dict, file_hashes: dict = None) -> Optional[dict]:
+    """
+    Lance les scans OCR de tous les documents en parallèle.
+    La progression est mise à jour à chaque document terminé. Retourne None si un
+    document obligatoire n'a pas pu être extrait (la tâche est alors marquée en échec).
+    Les empreintes calculées à l'upload évitent de relire les fichiers pour le cache d'extraction.
+    """
+    file_hashes = file_hashes or {}
+    documents = [doc_type for doc_type in SCAN_STEPS if doc_type in file_paths]
+    document_states = {doc_type: "PENDING" for doc_type in documents}
+    scan_errors = {}
+    await asyncio.to_thread(task_store.update, task_id, {"documents": document_states})
+    await update_task_status_async(task_id, "SCANNING_DOCUMENTS", f"Extraction des données de {len(documents)} documents en parallèle...")
+    
+    pending = {
+        asyncio.create_task(SCAN_STEPS[doc_type][1](file_paths[doc_type], file_hashes.get(doc_type))): doc_type
+        for doc_type in documents
+    }
+    extracted_data = {}
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for scan_task in done:
+                doc_type = pending.pop(scan_task)
+                step_message, _, label = SCAN_STEPS[doc_type]
+                try:
+                    extracted_data[doc_type] = scan_task.result()
+                    document_states[doc_type] = "COMPLETED"
+                    message = f"{step_message} terminée"
+                    logger.info(f"Document {doc_type} scanné avec succès pour la tâche {task_id}")
+                except Exception as e:
+                    logger.error(f"Erreur scan {doc_type} {task_id}: {str(e)}")
+                    document_states[doc_type] = "FAILED"
+                    if doc_type in REQUIRED_DOCUMENTS:
+                        await update_task_status_async(task_id, "FAILED", error=f"Erreur lors de l'extraction {label}: {str(e)}")
+                        return None
+                    scan_errors[doc_type] = str(e)
+                    message = f"Extraction {label} impossible, document ignoré"
+                
+                completed = len(documents) - len(pending)
+                await asyncio.to_thread(task_store.update, task_id, {"documents": document_states, "scan_errors": scan_errors})
+                await update_task_status_async(
+                    task_id, "SCANNING_DOCUMENTS",
+                    f"{message} ({completed}/{len(documents)})",
+                    progress=5 + 40 * completed // len(documents)
+                )
+    finally:
+        # Échec rapide: les scans encore en cours sont abandonnés
+        if pending:
+            for scan_task, doc_type in pending.items():
+                scan_task.cancel()
+                document_states[doc_type] = "CANCELLED"
+            await asyncio.to_thread(task_store.update, task_id, {"documents": document_states})
+    
+    return extracted_data
+
+async def extract_documents_batched(task_id: str, file_paths: dict, file_hashes: dict = None) -> Optional[dict]:
+    """
+    Extraction de tous les documents et vérification de leur cohérence en un seul appel (SCAN_MODE=batched).
+    Les documents absents de la réponse, ou tous les documents si l'appel échoue, sont
+    extraits document par document. Le résultat contient "validation_result" si la
+    vérification a été faite dans le même appel.
+    """
+    documents = [doc_type for doc_type in SCAN_STEPS if doc_type in file_paths]
+    document_states = {doc_type: "RUNNING" for doc_type in documents}
+    await asyncio.to_thread(task_store.update, task_id, {"documents": document_states})
+    await update_task_status_async(task_id, "SCANNING_DOCUMENTS", f"Extraction des données de {len(documents)} documents en un seul appel...")
+    
+    try:
+        extracted_data = await scan_documents_batched_async(
+            {doc_type: file_paths[doc_type] for doc_type in documents}, file_hashes
+        )
+    except Exception as e:
+        logger.warning(f"Extraction groupée impossible pour la tâche {task_id}, extraction document par document: {str(e)}")
+        return await extract_documents(task_id, file_paths, file_hashes)
+    
+    missing = [doc_type for doc_type in documents if doc_type not in extracted_data]
+    for doc_type in documents:
+        if doc_type not in missing:
+            document_states[doc_type] = "COMPLETED"
+    await asyncio.to_thread(task_store.update, task_id, {"documents": document_states})
+    
+    if missing:
+        logger.warning(f"Documents absents de la réponse groupée pour la tâche {task_id}: {', '.join(missing)}")
+        fallback_data = await extract_documents(task_id, {doc_type: file_paths[doc_type] for doc_type in missing}, file_hashes)
+        if fallback_data is None:
+            return None
+        await asyncio.to_thread(task_store.update, task_id, {}, merge={
+            "documents": {doc_type: state for doc_type, state in document_states.items() if doc_type not in missing}
+        })
+        extracted_data.update(fallback_data)
+        # Validation à refaire sur l'ensemble des documents
+        extracted_data.pop("validation_result", None)
+    
+    await update_task_status_async(task_id, "SCANNING_DOCUMENTS", f"Extraction de {len(documents)} documents terminée", progress=45)
+    return extracted_data
+
 # Fonction principale de traitement asynchrone
-async def process_documents_async(task_id: str, file_paths: dict) -> None:
-    """Fonction asynchrone principale de traitement"""
+async def process_documents_async(task_id: str, file_paths: dict, file_hashes: dict = None,
+                                  priority: str = DEFAULT_PRIORITY) -> None:
+    """Fonction asynchrone principale de traitement, avec la priorité d'accès au modèle de la demande"""
+    with priority_class(priority):
+        await run_pipeline(task_id, file_paths, file_hashes)
+
+async def run_pipeline(task_id: str, file_paths: dict, file_hashes: dict = None) -> None:
+    """Enchaînement des étapes de traitement d'une tâche"""
     try:
         logger.info(f"Début du traitement de la tâche {task_id}")
         
         # =========================================================================
-        # ÉTAPE 1: EXTRACTION DES DONNÉES PAR OCR DE TOUS LES DOCUMENTS
+        # ÉTAPE 1: EXTRACTION DES DONNÉES PAR OCR DE TOUS LES DOCUMENTS (EN PARALLÈLE)
         # =========================================================================
-        extracted_data = {}
-        
-        # --- 1.1: SCAN DE L'AVIS DE CONTRAVENTION ---
-        if "contravention" in file_paths:
-            update_task_status(task_id, "SCANNING_CONTRAVENTION", "Extraction des données de l'avis de contravention...")
-            import asyncio
-            await asyncio.sleep(0.2)  # Délai pour permettre au frontend de voir cette étape
-            try:
-                extracted_data["contravention"] = scan_contravention(file_paths["contravention"])
-                logger.info(f"Contravention scannée avec succès pour la tâche {task_id}")
-            except Exception as e:
-                logger.error(f"Erreur scan contravention {task_id}: {str(e)}")
-                update_task_status(task_id, "FAILED", error=f"Erreur lors de l'extraction de la contravention: {str(e)}")
-                return
-        
-        # --- 1.2: SCAN DU CERTIFICAT D'IMMATRICULATION ---
-        if "certificat" in file_paths:
-            update_task_status(task_id, "SCANNING_CERTIFICAT", "Extraction des données du certificat d'immatriculation...")
-            await asyncio.sleep(0.2)  # Délai pour permettre au frontend de voir cette étape
-            try:
-                extracted_data["certificat"] = scan_certificat_immatriculation(file_paths["certificat"])
-                logger.info(f"Certificat scanné avec succès pour la tâche {task_id}")
-            except Exception as e:
-                logger.error(f"Erreur scan certificat {task_id}: {str(e)}")
-                update_task_status(task_id, "FAILED", error=f"Erreur lors de l'extraction du certificat: {str(e)}")
-                return
-        
-        # --- 1.3: SCAN DU PERMIS DE CONDUIRE ---
-        if "permis" in file_paths:
-            update_task_status(task_id, "SCANNING_PERMIS", "Extraction des données du permis de conduire...")
-            await asyncio.sleep(0.2)  # Délai pour permettre au frontend de voir cette étape
-            try:
-                extracted_data["permis"] = scan_permis_conduire(file_paths["permis"])
-                logger.info(f"Permis scanné avec succès pour la tâche {task_id}")
-            except Exception as e:
-                logger.error(f"Erreur scan permis {task_id}: {str(e)}")
-                update_task_status(task_id, "FAILED", error=f"Erreur lors de l'extraction du permis: {str(e)}")
-                return
+        if SCAN_MODE == "batched":
+            extracted_data = await extract_documents_batched(task_id, file_paths, file_hashes)
+        else:
+            extracted_data = await extract_documents(task_id, file_paths, file_hashes)
+        if extracted_data is None:
+            return
         
-        # --- 1.4: SCAN DU JUSTIFICATIF DE DOMICILE ---
-        if "domicile" in file_paths:
-            update_task_status(task_id, "SCANNING_DOMICILE", "Extraction des données du justificatif de domicile...")
-            await asyncio.sleep(0.2)  # Délai pour permettre au frontend de voir cette étape
-            try:
-                extracted_data["domicile"] = scan_justificatif_domicile(file_paths["domicile"])
-                logger.info(f"Justificatif de domicile scanné avec succès pour la tâche {task_id}")
-            except Exception as e:
-                logger.error(f"Erreur scan domicile {task_id}: {str(e)}")
-                update_task_status(task_id, "FAILED", error=f"Erreur lors de l'extraction du justificatif: {str(e)}")
-                return
+        # Contrôle champ par champ (format de plaque, vitesses, dates...), pour une ré-extraction ciblée
+        documents_data = {doc_type: data for doc_type, data in extracted_data.items() if doc_type in SCAN_STEPS}
+        field_checks = {doc_type: assess_extraction(doc_type, data) for doc_type, data in documents_data.items()}
+        for doc_type, checks in field_checks.items():
+            if checks["failing"]:
+                logger.info(f"Champs à vérifier ({doc_type}) pour la tâche {task_id}: {', '.join(checks['failing'])}")
+        await asyncio.to_thread(task_store.update, task_id, {"extracted_data": documents_data, "field_checks": field_checks})
         
         # =========================================================================
         # ÉTAPE 2: VALIDATION ET VÉRIFICATION DE LA COHÉRENCE DES DONNÉES
         # =========================================================================
-        update_task_status(task_id, "VALIDATING", "Validation de la cohérence des données extraites...")
-        await asyncio.sleep(2)  # Délai pour permettre au frontend de voir cette étape
+        await update_task_status_async(task_id, "VALIDATING", "Validation de la cohérence des données extraites...")
         try:
-            validation_result = validate_documents_data(
-                contravention_data=extracted_data.get("contravention"),
-                permis_data=extracted_data.get("permis"),
-                certificat_data=extracted_data.get("certificat"),
-                justificatif_data=extracted_data.get("domicile")
-            )
+            # En mode groupé, la vérification a déjà été faite par l'appel d'extraction
+            validation_result = extracted_data.pop("validation_result", None)
+            if validation_result is None:
+                validation_result = await validate_documents_data_async(
+                    contravention_data=extracted_data.get("contravention"),
+                    permis_data=extracted_data.get("permis"),
+                    certificat_data=extracted_data.get("certificat"),
+                    justificatif_data=extracted_data.get("domicile")
+                )
             logger.info(f"Validation terminée pour la tâche {task_id}: {validation_result.get('validation_status')}")
             
             # Stocker les résultats de validation
-            tasks_storage[task_id]["validation_result"] = validation_result
-            tasks_storage[task_id]["extracted_data"] = extracted_data
+            await asyncio.to_thread(task_store.update, task_id, {
+                "validation_result": validation_result,
+                "extracted_data": extracted_data
+            })
             
         except Exception as e:
             logger.error(f"Erreur validation {task_id}: {str(e)}")
-            update_task_status(task_id, "FAILED", error=f"Erreur lors de la validation: {str(e)}")
+            await update_task_status_async(task_id, "FAILED", error=f"Erreur lors de la validation: {str(e)}")
             return
         
         # =========================================================================
         # ÉTAPE 3: REMPLISSAGE AUTOMATIQUE DU FORMULAIRE WEB GOUVERNEMENTAL
         # =========================================================================
-        update_task_status(task_id, "FILLING_FORM", "Remplissage automatique du formulaire web...")
+        await update_task_status_async(task_id, "FILLING_FORM", "Remplissage automatique du formulaire web...")
         try:
-            form_result = fill_website_form(extracted_data)
+            form_result = await fill_website_form(extracted_data)
             logger.info(f"Formulaire rempli avec succès pour la tâche {task_id}")
-            tasks_storage[task_id]["form_result"] = form_result
+            await asyncio.to_thread(task_store.update, task_id, {"form_result": form_result})
         except Exception as e:
             logger.error(f"Erreur remplissage formulaire {task_id}: {str(e)}")
-            update_task_status(task_id, "FAILED", error=f"Erreur lors du remplissage du formulaire: {str(e)}")
+            await update_task_status_async(task_id, "FAILED", error=f"Erreur lors du remplissage du formulaire: {str(e)}")
             return
 
         # =========================================================================
         # ÉTAPE 4: RÉCUPÉRATION DE L'IMAGE DU RADAR DEPUIS LES EMAILS
         # =========================================================================
-        update_task_status(task_id, "RETRIEVING_RADAR_IMAGE", "Récupération de l'image du radar depuis les emails...")
+        await update_task_status_async(task_id, "RETRIEVING_RADAR_IMAGE", "Récupération de l'image du radar depuis les emails...")
         
         # Simulation de récupération de l'image radar
-        await asyncio.sleep(0.2)  # Simuler le temps de récupération
-        tasks_storage[task_id]["radar_photo"] = "simulation_radar_image.jpg"
+        await asyncio.to_thread(task_store.update, task_id, {"radar_photo": "simulation_radar_image.jpg"})
         logger.info(f"Image radar simulée pour la tâche {task_id}")
         
         # =========================================================================
         # ÉTAPE 5: ANALYSE INTELLIGENTE DE LA PHOTO DU RADAR
         # =========================================================================
-        update_task_status(task_id, "ANALYZING_PHOTO", "Analyse de la visibilité du conducteur...")
-        await asyncio.sleep(2)  # Délai pour permettre au frontend de voir cette étape
+        await update_task_status_async(task_id, "ANALYZING_PHOTO", "Analyse de la visibilité du conducteur...")
         try:
             # TODO: Remplacer par la vraie fonction d'analyse IA
             # driver_visible = detect_clear_driver(form_result.get("photo_path"))
             driver_visible = False  # Simulation pour la démo
-            tasks_storage[task_id]["driver_visible"] = driver_visible
+            await asyncio.to_thread(task_store.update, task_id, {"driver_visible": driver_visible})
             logger.info(f"Analyse photo terminée pour la tâche {task_id}: conducteur visible = {driver_visible}")
         except Exception as e:
             logger.error(f"Erreur analyse photo {task_id}: {str(e)}")
-            update_task_status(task_id, "FAILED", error=f"Erreur lors de l'analyse de la photo: {str(e)}")
+            await update_task_status_async(task_id, "FAILED", error=f"Erreur lors de l'analyse de la photo: {str(e)}")
             return
 
         # =========================================================================
         # ÉTAPE 6: GÉNÉRATION DU DOCUMENT FINAL DE CONTESTATION
         # =========================================================================
-        update_task_status(task_id, "GENERATING_PDF", "Génération du document de contestation...")
-        await asyncio.sleep(2)  # Délai pour permettre au frontend de voir cette étape
+        await update_task_status_async(task_id, "GENERATING_PDF", "Génération du document de contestation...")
         try:
-            pdf_path = generate_final_pdf(extracted_data, driver_visible, task_id)
-            tasks_storage[task_id]["result_file"] = pdf_path
-            logger.info(f"PDF généré avec succès pour la tâche {task_id}: {pdf_path}")
+            # Dans un thread: la compilation ne bloque pas la boucle d'événements (latex_service borne les compilations simultanées)
+            document = await asyncio.to_thread(render_letter_document, extracted_data, driver_visible, task_id)
+            # Lettre rendue en mémoire et écrite une seule fois dans le stockage des résultats
+            result = await asyncio.to_thread(
+                result_store.put, f"contestation_{task_id}.{document.extension}", document.data, document.media_type
+            )
+            await asyncio.to_thread(task_store.update, task_id, {"result": result})
+            logger.info(f"PDF généré avec succès pour la tâche {task_id}: {result['key']} ({result['size']} octets)")
         except Exception as e:
             logger.error(f"Erreur génération PDF {task_id}: {str(e)}")
-            update_task_status(task_id, "FAILED", error=f"Erreur lors de la génération du PDF: {str(e)}")
+            await update_task_status_async(task_id, "FAILED", error=f"Erreur lors de la génération du PDF: {str(e)}")
             return
         
         # =========================================================================
         # FINALISATION: MARQUAGE DE LA TÂCHE COMME TERMINÉE
         # =========================================================================
-        update_task_status(task_id, "COMPLETED", "Traitement terminé avec succès")
+        await update_task_status_async(task_id, "COMPLETED", "Traitement terminé avec succès")
         logger.info(f"Traitement de la tâche {task_id} terminé avec succès")
         
     except Exception as e:
         error_msg = f"Erreur inattendue lors du traitement: {str(e)}"
         logger.error(f"Erreur critique tâche {task_id}: {error_msg}")
-        update_task_status(task_id, "FAILED", error=error_msg)
+        await update_task_status_async(task_id, "FAILED", error=error_msg)
+
+# File d'attente bornée des traitements (cf. JOB_WORKERS, JOB_QUEUE_MAX_SIZE, JOB_WORKER_MODE)
+job_queue = JobQueue(process_documents_async)
+
+def raise_queue_full() -> None:
+    """Refuse une nouvelle demande lorsque la file de traitement est saturée"""
+    stats = job_queue.stats()
+    raise HTTPException(
+        status_code=429,
+        detail=f"Service saturé: {stats['waiting']} traitements en attente. Veuillez réessayer plus tard.",
+        headers={"Retry-After": "30"}
+    )
+
+def raise_upstream_unavailable() -> None:
+    """Refuse une nouvelle demande tant que l'API d'extraction est considérée indisponible"""
+    retry_in = max(1, round(anthropic_circuit.retry_in()))
+    raise HTTPException(
+        status_code=503,
+        detail="Service d'extraction temporairement indisponible. Veuillez réessayer plus tard.",
+        headers={"Retry-After": str(retry_in)}
+    )
 
 # Endpoints
 
@@ -310,19 +548,43 @@ async def health_check():
     return HealthResponse(
         status="healthy",
         timestamp=datetime.now(),
-        version="1.0.0"
+        version="1.0.0",
+        pdf_backend=renderer_registry.status()["backend"]
     )
 
+@app.get("/api/v1/stats")
+async def get_stats():
+    """Endpoint des statistiques d'extraction (prétraitement, cache, OCR local, appels au modèle, routage des modèles, validations locales, reprises, limiteur de débit, pool de navigateurs, remplissage du formulaire, moteurs de rendu, compilation LaTeX) pour le réglage du service"""
+    cache = get_extraction_cache()
+    return {
+        "preprocessing": get_preprocessing_stats(),
+        "extraction_cache": cache.stats() if cache is not None else None,
+        "scan_mode": SCAN_MODE,
+        "model_calls": get_scan_stats(),
+        "model_routing": get_routing_stats(),
+        "local_ocr": get_local_ocr_stats(),
+        "validation": get_validation_stats(),
+        "llm_resilience": get_resilience_stats(),
+        "rate_limiter": get_rate_limit_stats(),
+        "browser_pool": browser_pool.stats(),
+        "form_filler": get_form_stats(),
+        "renderers": renderer_registry.status(),
+        "latex": latex_service.stats()
+    }
+
 @app.post("/api/v1/process-documents", response_model=TaskResponse)
 async def process_documents(
-    background_tasks: BackgroundTasks,
     contravention: UploadFile = File(..., description="Avis de contravention"),
     certificat: UploadFile = File(..., description="Certificat d'immatriculation"),
     permis: UploadFile = File(..., description="Permis de conduire"),
-    domicile: UploadFile = File(..., description="Justificatif de domicile")
+    domicile: UploadFile = File(..., description="Justificatif de domicile"),
+    priority: str = Query(DEFAULT_PRIORITY, description="Priorité d'accès au modèle: interactive ou bulk (retraitements)")
 ):
     """Endpoint principal pour traiter les documents"""
     
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Priorité inconnue: {priority}")
+    
     # Validation des types de fichiers
     allowed_types = ["image/jpeg", "image/png", "application/pdf"]
     files = {"contravention": contravention, "certificat": certificat, "permis": permis, "domicile": domicile}
@@ -334,25 +596,41 @@ async def process_documents(
                 detail=f"Type de fichier non supporté pour {file_type}: {file.content_type}"
             )
     
+    # Contrôle d'admission: inutile de sauvegarder les fichiers si la file est saturée
+    if job_queue.is_full():
+        raise_queue_full()
+    # Délestage: inutile d'accepter des documents que l'API d'extraction ne pourra pas traiter
+    if anthropic_circuit.is_open():
+        raise_upstream_unavailable()
+    
     # Création de la tâche
     task_id = str(uuid.uuid4())
     
     try:
         # Sauvegarde des fichiers
-        file_paths = await save_uploaded_files(task_id, files)
+        file_paths, file_hashes = await save_uploaded_files(task_id, files)
         
         # Création de la tâche
-        create_task(task_id, file_paths)
+        await asyncio.to_thread(create_task, task_id, file_paths, file_hashes)
         
-        # Lancement du traitement en arrière-plan
-        background_tasks.add_task(process_documents_async, task_id, file_paths)
+        # Mise en file du traitement
+        try:
+            queue_position = job_queue.submit(task_id, task_id, file_paths, file_hashes, priority)
+        except QueueFullError:
+            await asyncio.to_thread(task_store.delete, task_id)
+            cleanup_files(task_id)
+            raise_queue_full()
         
         return TaskResponse(
             task_id=task_id,
             status="processing",
-            message="Documents reçus et traitement démarré"
+            message="Documents reçus et traitement démarré",
+            queue_position=queue_position
         )
         
+    except HTTPException:
+        cleanup_files(task_id)
+        raise
     except Exception as e:
         logger.error(f"Erreur lors de la création de la tâche: {str(e)}")
         raise HTTPException(status_code=500, detail="Erreur interne du serveur")
@@ -360,25 +638,56 @@ async def process_documents(
 @app.get("/api/v1/task/{task_id}/status", response_model=TaskStatus)
 async def get_task_status_endpoint(task_id: str):
     """Endpoint de suivi de l'avancement d'une tâche"""
-    task = get_task_status(task_id)
+    task = await get_task_status_async(task_id)
     
     if not task:
         raise HTTPException(status_code=404, detail="Tâche non trouvée")
     
-    # Ajouter des informations supplémentaires selon l'état
-    status_response = TaskStatus(**task)
+    return build_task_status(task)
+
+@app.get("/api/v1/task/{task_id}/events")
+async def task_events_endpoint(task_id: str, request: Request):
+    """Flux Server-Sent Events émettant chaque changement de statut d'une tâche"""
+    if not await get_task_status_async(task_id):
+        raise HTTPException(status_code=404, detail="Tâche non trouvée")
     
-    # Enrichir avec des détails selon l'état
-    if task["status"] == "COMPLETED" and "validation_result" in task:
-        validation = task["validation_result"]
-        status_response.message += f" - Validation: {validation.get('validation_status', 'UNKNOWN')}"
+    async def event_stream():
+        with task_events.subscribe(task_id) as updates:
+            task = await get_task_status_async(task_id)
+            last_sent = None
+            while task is not None:
+                status_response = build_task_status(task)
+                state = (status_response.status, status_response.progress, status_response.message,
+                         status_response.queue_position)
+                if state != last_sent:
+                    last_sent = state
+                    data = json.dumps(jsonable_encoder(status_response), ensure_ascii=False)
+                    yield f"event: status\ndata: {data}\n\n"
+                if task["status"] in FINISHED_STATUSES:
+                    return
+                
+                try:
+                    task = await asyncio.wait_for(updates.get(), timeout=EVENTS_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    # Mises à jour éventuelles d'un autre processus + maintien de la connexion
+                    yield ": keep-alive\n\n"
+                    task = await get_task_status_async(task_id)
     
-    return status_response
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/api/v1/task/{task_id}/result")
-async def get_task_result(task_id: str):
-    """Endpoint de récupération du résultat final"""
-    task = get_task_status(task_id)
+async def get_task_result(task_id: str, request: Request):
+    """
+    Endpoint de récupération du résultat final, lu par morceaux dans le stockage des
+    résultats (ETag / If-None-Match, plages d'octets Range / If-Range)
+    """
+    task = await get_task_status_async(task_id)
     
     if not task:
         raise HTTPException(status_code=404, detail="Tâche non trouvée")
@@ -389,29 +698,150 @@ async def get_task_result(task_id: str):
             detail=f"Tâche pas encore terminée. Statut actuel: {task['status']}"
         )
     
-    result_file = task.get("result_file")
-    if not result_file or not os.path.exists(result_file):
+    result = task.get("result")
+    if not result:
+        # Tâches antérieures au stockage des résultats: chemin du fichier généré
+        result_file = task.get("result_file")
+        if not result_file or not os.path.exists(result_file):
+            raise HTTPException(status_code=404, detail="Fichier résultat non trouvé")
+        return FileResponse(
+            path=result_file,
+            filename=f"contravention_result_{task_id}.pdf",
+            media_type="application/pdf"
+        )
+    
+    headers = {
+        "ETag": result["etag"],
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="contravention_result_{task_id}.{result["key"].rsplit(".", 1)[-1]}"',
+    }
+    # Lettre déjà téléchargée et inchangée
+    if result["etag"] in [tag.strip() for tag in (request.headers.get("if-none-match") or "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    size = result["size"]
+    byte_range = parse_range(request.headers.get("range"), size)
+    # If-Range: la plage ne vaut que pour la version de la lettre déjà partiellement reçue
+    if byte_range and request.headers.get("if-range", result["etag"]) != result["etag"]:
+        byte_range = None
+    if not await asyncio.to_thread(result_store.exists, result["key"]):
         raise HTTPException(status_code=404, detail="Fichier résultat non trouvé")
     
-    return FileResponse(
-        path=result_file,
-        filename=f"contravention_result_{task_id}.pdf",
-        media_type="application/pdf"
-    )
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(iterate_in_threadpool(result_store.iter_range(result["key"])),
+                                 media_type=result["content_type"], headers=headers)
+    start, end = byte_range
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(iterate_in_threadpool(result_store.iter_range(result["key"], start, end)),
+                             status_code=206, media_type=result["content_type"], headers=headers)
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Plage d'octets demandée par l'en-tête Range (bytes=a-b, bytes=a-, bytes=-n), bornes incluses.
+
+    Returns:
+        tuple | None: (début, fin), ou None sans en-tête Range ou pour plusieurs plages (réponse complète)
+
+    Raises:
+        HTTPException: 416 si la plage est invalide ou hors du fichier
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(size - int(last), 0), size - 1
+    except ValueError:
+        start, end = size, -1
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Plage d'octets non satisfaisable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+@app.get("/api/v1/task/{task_id}/fields")
+async def get_task_fields(task_id: str):
+    """Données extraites et contrôle champ par champ (statut, confiance, motif) de chaque document"""
+    task = await get_task_status_async(task_id)
+    
+    if not task:
+        raise HTTPException(status_code=404, detail="Tâche non trouvée")
+    
+    return {
+        "task_id": task_id,
+        "extracted_data": task.get("extracted_data") or {},
+        "field_checks": task.get("field_checks") or {}
+    }
+
+@app.post("/api/v1/task/{task_id}/documents/{doc_type}/reextract")
+async def reextract_document_fields(task_id: str, doc_type: str, body: ReextractRequest):
+    """
+    Ré-extraction ciblée de quelques champs d'un document (par défaut les champs invalides
+    ou manquants), sur une zone recadrée ou avec le modèle moins coûteux, au lieu de
+    relancer tout le traitement. La lettre déjà générée n'est pas modifiée.
+    """
+    task = await get_task_status_async(task_id)
+    
+    if not task:
+        raise HTTPException(status_code=404, detail="Tâche non trouvée")
+    if doc_type not in SCAN_STEPS:
+        raise HTTPException(status_code=404, detail=f"Type de document inconnu: {doc_type}")
+    if task["status"] not in FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Tâche en cours de traitement. Statut actuel: {task['status']}")
+    
+    extracted_data = task.get("extracted_data") or {}
+    file_path = (task.get("files") or {}).get(doc_type)
+    if doc_type not in extracted_data or not file_path or not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail=f"Document {doc_type} non extrait pour cette tâche")
+    if anthropic_circuit.is_open():
+        raise_upstream_unavailable()
+    
+    try:
+        result = await reextract_fields_async(
+            doc_type, file_path, extracted_data[doc_type],
+            fields=body.fields, crop=body.crop, fast=body.fast,
+            content_hash=(task.get("file_hashes") or {}).get(doc_type)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Erreur ré-extraction {doc_type} {task_id}: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"Erreur lors de la ré-extraction: {str(e)}")
+    
+    # Fusion faite par le stockage dans sa section atomique : une ré-extraction
+    # concurrente d'un autre document n'écrase pas celle-ci
+    task = await asyncio.to_thread(task_store.update, task_id, {"updated_at": datetime.now()}, merge={
+        "extracted_data": {doc_type: result["data"]},
+        "field_checks": {doc_type: result["field_checks"]}
+    })
+    if task is None:
+        raise HTTPException(status_code=404, detail="Tâche supprimée pendant la ré-extraction")
+    logger.info(f"Ré-extraction {doc_type} pour la tâche {task_id}: {len(result['reextracted'])} champ(s) corrigé(s)")
+    
+    return {"task_id": task_id, "doc_type": doc_type, **result}
 
 @app.delete("/api/v1/task/{task_id}")
 async def delete_task(task_id: str):
     """Endpoint pour supprimer/annuler une tâche"""
-    task = get_task_status(task_id)
+    task = await get_task_status_async(task_id)
     
     if not task:
         raise HTTPException(status_code=404, detail="Tâche non trouvée")
     
     # Nettoyage des fichiers
     cleanup_files(task_id)
+    if task.get("result"):
+        await asyncio.to_thread(result_store.delete, task["result"]["key"])
     
     # Suppression de la tâche
-    del tasks_storage[task_id]
+    await asyncio.to_thread(task_store.delete, task_id)
     
     return {"message": f"Tâche {task_id} supprimée avec succès"}
 
@@ -421,13 +851,14 @@ async def list_tasks():
     return {
         "tasks": [
             {
-                "task_id": task_id,
+                "task_id": task["task_id"],
                 "status": task["status"],
                 "progress": task["progress"],
                 "created_at": task["created_at"]
             }
-            for task_id, task in tasks_storage.items()
-        ]
+            for task in await asyncio.to_thread(task_store.list)
+        ],
+        "queue": job_queue.stats()
     }
 
 # Point d'entrée pour lancer l'application
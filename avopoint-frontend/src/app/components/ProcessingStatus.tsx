@@ -26,10 +26,7 @@ interface TaskStatus {
 
 const STEP_MESSAGES = {
   'UPLOADED': 'Documents reçus et vérifiés',
-  'SCANNING_CONTRAVENTION': 'Extraction OCR de l\'avis de contravention',
-  'SCANNING_CERTIFICAT': 'Extraction OCR du certificat d\'immatriculation',
-  'SCANNING_PERMIS': 'Extraction OCR du permis de conduire',
-  'SCANNING_DOMICILE': 'Extraction OCR du justificatif de domicile',
+  'SCANNING_DOCUMENTS': 'Extraction OCR des documents en parallèle',
   'VALIDATING': 'Validation croisée des données extraites',
   'FILLING_FORM': 'Demande automatique d\'image radar',
   'RETRIEVING_RADAR_IMAGE': 'Récupération de l\'image du radar',
@@ -39,17 +36,107 @@ const STEP_MESSAGES = {
   'FAILED': 'Erreur lors du traitement'
 }
 
+// Minimum time each processing step stays visible when updates arrive in quick succession
+const MIN_STEP_DISPLAY_MS = 400
+
 export default function ProcessingStatus({ taskId, onComplete, onReset, onStatusUpdate }: ProcessingStatusProps) {
   const [status, setStatus] = useState<TaskStatus | null>(null)
   const [error, setError] = useState<string | null>(null)
 
   useEffect(() => {
-    let interval: NodeJS.Timeout | null = null
     let isActive = true
+    let isFinished = false
+    let source: EventSource | null = null
+    let interval: NodeJS.Timeout | null = null
+    let displayTimer: NodeJS.Timeout | null = null
+    let lastShownAt = 0
+    let lastQueuedKey = ''
+    // Latest intermediate step not shown yet (older ones are skipped, not queued)
+    let pending: TaskStatus | null = null
 
-    const pollStatus = async () => {
+    const showStatus = (statusData: TaskStatus) => {
+      setStatus(statusData)
+      
+      // Notify parent component of status update
+      if (onStatusUpdate) {
+        onStatusUpdate(statusData)
+      }
+      
+      if (statusData.status === 'COMPLETED') {
+        console.log('[ProcessingStatus] Task completed, calling onComplete')
+        onComplete()
+      } else if (statusData.status === 'FAILED') {
+        console.log('[ProcessingStatus] Task failed:', statusData.error)
+        setError(statusData.error || 'Une erreur est survenue lors du traitement')
+      }
+    }
+
+    const clearDisplayTimer = () => {
+      if (displayTimer) {
+        clearTimeout(displayTimer)
+        displayTimer = null
+      }
+    }
+
+    // The backend runs at full speed: intermediate steps stay on screen at least
+    // MIN_STEP_DISPLAY_MS, and only the latest one is shown when several arrive meanwhile
+    const scheduleDisplay = (statusData: TaskStatus) => {
+      const wait = lastShownAt + MIN_STEP_DISPLAY_MS - Date.now()
+      if (wait <= 0 && !displayTimer) {
+        lastShownAt = Date.now()
+        showStatus(statusData)
+        return
+      }
+      pending = statusData
+      if (displayTimer) return
+      displayTimer = setTimeout(() => {
+        displayTimer = null
+        if (!isActive || !pending) return
+        const next = pending
+        pending = null
+        lastShownAt = Date.now()
+        showStatus(next)
+      }, Math.max(0, wait))
+    }
+
+    const stopUpdates = () => {
+      if (source) {
+        source.close()
+        source = null
+      }
+      if (interval) {
+        clearInterval(interval)
+        interval = null
+      }
+    }
+
+    const handleStatus = (statusData: TaskStatus) => {
+      console.log('[ProcessingStatus] Status received:', statusData)
       if (!isActive) return
       
+      if (statusData.status === 'COMPLETED' || statusData.status === 'FAILED') {
+        isFinished = true
+        stopUpdates()
+      }
+      
+      // Polling may return the same state several times
+      const key = `${statusData.status}|${statusData.progress}|${statusData.message}`
+      if (key === lastQueuedKey) return
+      lastQueuedKey = key
+      
+      if (isFinished) {
+        // Final state: shown at once, steps still waiting for display are dropped
+        pending = null
+        clearDisplayTimer()
+        showStatus(statusData)
+        return
+      }
+      scheduleDisplay(statusData)
+    }
+
+    const pollStatus = async () => {
+      if (!isActive || isFinished) return
+      
       try {
         console.log(`[ProcessingStatus] Polling status for task: ${taskId}`)
         const response = await fetch(`http://localhost:8000/api/v1/task/${taskId}/status`)
@@ -58,45 +145,40 @@ export default function ProcessingStatus({ taskId, onComplete, onReset, onStatus
         }
         
         const statusData: TaskStatus = await response.json()
-        console.log('[ProcessingStatus] Status received:', statusData)
-        
-        if (!isActive) return // Check again before updating state
-        
-        setStatus(statusData)
-        
-        // Notify parent component of status update
-        if (onStatusUpdate) {
-          onStatusUpdate(statusData)
-        }
-        
-        if (statusData.status === 'COMPLETED') {
-          console.log('[ProcessingStatus] Task completed, calling onComplete')
-          onComplete()
-          return // Stop polling
-        } else if (statusData.status === 'FAILED') {
-          console.log('[ProcessingStatus] Task failed:', statusData.error)
-          setError(statusData.error || 'Une erreur est survenue lors du traitement')
-          return // Stop polling
-        }
+        handleStatus(statusData)
       } catch (err) {
         console.error('[ProcessingStatus] Polling error:', err)
         if (!isActive) return
+        stopUpdates()
         setError(err instanceof Error ? err.message : 'Erreur de connexion')
-        return // Stop polling on error
       }
     }
 
-    // Initial call
-    pollStatus()
-    
-    // Set up interval only if not already completed/failed
-    interval = setInterval(pollStatus, 1000)
+    const startPolling = () => {
+      pollStatus()
+      interval = setInterval(pollStatus, 1000)
+    }
+
+    if (typeof EventSource !== 'undefined') {
+      // Push-based updates: every status transition is streamed by the backend
+      source = new EventSource(`http://localhost:8000/api/v1/task/${taskId}/events`)
+      source.addEventListener('status', (event) => {
+        handleStatus(JSON.parse((event as MessageEvent).data))
+      })
+      source.onerror = () => {
+        if (!isActive || isFinished) return
+        console.warn('[ProcessingStatus] Event stream unavailable, falling back to polling')
+        stopUpdates()
+        startPolling()
+      }
+    } else {
+      startPolling()
+    }
 
     return () => {
       isActive = false
-      if (interval) {
-        clearInterval(interval)
-      }
+      stopUpdates()
+      clearDisplayTimer()
     }
   }, [taskId, onComplete, onStatusUpdate])
 
@@ -0,0 +1,211 @@
+"""
+Pool de navigateurs headless réutilisés par le remplissage de formulaire
+
+Lancer un Chromium par tâche coûte plusieurs secondes et beaucoup de mémoire. Le pool
+garde BROWSER_POOL_SIZE sessions browser-use lancées d'avance (headless, sans
+ralentissement artificiel) et les prête une à une: chaque tâche a la sienne pendant
+tout le remplissage, ses cookies sont effacés et ses onglets refermés au retour. Une
+session qui ne répond plus au contrôle de santé est remplacée, et chaque session est
+recyclée (relancée) après BROWSER_MAX_USES utilisations pour éviter les fuites de
+mémoire du navigateur. La taille du pool borne le nombre de formulaires remplis en
+parallèle sur la machine.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+BROWSER_POOL_ENABLED = os.getenv("BROWSER_POOL_ENABLED", "1") == "1"
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+BROWSER_MAX_USES = int(os.getenv("BROWSER_MAX_USES", "20"))
+BROWSER_ACQUIRE_TIMEOUT = float(os.getenv("BROWSER_ACQUIRE_TIMEOUT", "120"))
+BROWSER_HEALTH_TIMEOUT = float(os.getenv("BROWSER_HEALTH_TIMEOUT", "5"))
+# Lancement des navigateurs au démarrage du service plutôt qu'à la première tâche
+BROWSER_POOL_PREWARM = os.getenv("BROWSER_POOL_PREWARM", "1") == "1"
+# BROWSER_HEADLESS=0 et BROWSER_WAIT_BETWEEN_ACTIONS=1 pour suivre l'agent à l'écran en développement
+BROWSER_HEADLESS = os.getenv("BROWSER_HEADLESS", "1") == "1"
+BROWSER_WAIT_BETWEEN_ACTIONS = float(os.getenv("BROWSER_WAIT_BETWEEN_ACTIONS", "0.1"))
+
+class BrowserPoolTimeout(Exception):
+    """Exception levée lorsqu'aucun navigateur ne s'est libéré à temps"""
+    pass
+
+def create_browser_session():
+    """Crée une session browser-use headless, conservée entre les tâches (keep_alive)"""
+    from browser_use.browser.profile import BrowserProfile
+    from browser_use.browser.session import BrowserSession
+
+    return BrowserSession(browser_profile=BrowserProfile(
+        headless=BROWSER_HEADLESS,
+        keep_alive=True,
+        viewport={"width": 1200, "height": 800},
+        wait_between_actions=BROWSER_WAIT_BETWEEN_ACTIONS,
+        highlight_elements=False,
+    ))
+
+class _PooledBrowser:
+    """Session du pool et son nombre d'utilisations"""
+
+    def __init__(self, session: Any):
+        self.session = session
+        self.uses = 0
+        self.started_at = time.monotonic()
+
+class BrowserPool:
+    """Pool borné de sessions de navigateur, prêtées une par tâche"""
+
+    def __init__(self, size: int = BROWSER_POOL_SIZE, max_uses: int = BROWSER_MAX_USES,
+                 factory: Callable[[], Any] = create_browser_session):
+        self.size = size
+        self.max_uses = max_uses
+        self.factory = factory
+        self._idle: List[_PooledBrowser] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._in_use = 0
+        self._stats = {"leases": 0, "launches": 0, "recycled": 0, "unhealthy": 0, "launch_failures": 0, "timeouts": 0}
+
+    async def start(self, prewarm: bool = BROWSER_POOL_PREWARM) -> None:
+        """Initialise le pool et, si demandé, lance les navigateurs d'avance"""
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.size)
+        if prewarm:
+            launched = await asyncio.gather(*(self._launch() for _ in range(self.size)), return_exceptions=True)
+            self._idle.extend(browser for browser in launched if isinstance(browser, _PooledBrowser))
+        logger.info(f"Pool de navigateurs démarré: {len(self._idle)}/{self.size} navigateurs prêts")
+
+    def is_usable(self) -> bool:
+        """Indique si le pool est démarré dans la boucle d'événements courante"""
+        try:
+            return self._slots is not None and asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    async def _launch(self) -> _PooledBrowser:
+        session = self.factory()
+        try:
+            await session.start()
+        except Exception as e:
+            self._stats["launch_failures"] += 1
+            logger.error(f"Lancement du navigateur impossible: {str(e)}")
+            raise
+        self._stats["launches"] += 1
+        return _PooledBrowser(session)
+
+    async def _discard(self, browser: _PooledBrowser) -> None:
+        try:
+            await browser.session.kill()
+        except Exception as e:
+            logger.warning(f"Arrêt du navigateur incomplet: {str(e)}")
+
+    async def _is_healthy(self, browser: _PooledBrowser) -> bool:
+        """Contrôle de santé: connexion CDP ouverte et page courante lisible"""
+        if not getattr(browser.session, "is_cdp_connected", True):
+            return False
+        try:
+            await asyncio.wait_for(browser.session.get_current_page_url(), timeout=BROWSER_HEALTH_TIMEOUT)
+            return True
+        except Exception:
+            return False
+
+    async def _reset(self, browser: _PooledBrowser) -> None:
+        """Isolation entre tâches: cookies effacés, onglets supplémentaires fermés, page vierge"""
+        session = browser.session
+        await session.clear_cookies()
+        tabs = await session.get_tabs()
+        for tab in tabs[1:]:
+            await session.close_page(tab.target_id)
+        await session.navigate_to("about:blank")
+
+    async def _checkout(self) -> _PooledBrowser:
+        while self._idle:
+            browser = self._idle.pop()
+            if await self._is_healthy(browser):
+                return browser
+            self._stats["unhealthy"] += 1
+            logger.warning("Navigateur du pool hors service, remplacement")
+            await self._discard(browser)
+        return await self._launch()
+
+    async def _checkin(self, browser: _PooledBrowser, failed: bool) -> None:
+        browser.uses += 1
+        if browser.uses >= self.max_uses:
+            self._stats["recycled"] += 1
+            logger.info(f"Navigateur recyclé après {browser.uses} utilisations")
+            await self._discard(browser)
+            return
+        try:
+            await self._reset(browser)
+        except Exception as e:
+            logger.warning(f"Réinitialisation du navigateur impossible, abandon de la session: {str(e)}")
+            await self._discard(browser)
+            return
+        if failed and not await self._is_healthy(browser):
+            self._stats["unhealthy"] += 1
+            await self._discard(browser)
+            return
+        self._idle.append(browser)
+
+    @asynccontextmanager
+    async def acquire(self, timeout: float = BROWSER_ACQUIRE_TIMEOUT):
+        """
+        Prête une session de navigateur pour la durée du bloc.
+        Lève BrowserPoolTimeout si aucun navigateur ne se libère dans le délai.
+        """
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            raise BrowserPoolTimeout(f"Aucun navigateur disponible après {timeout:.0f}s ({self.size} en service)")
+
+        self._in_use += 1
+        failed = True
+        browser = None
+        try:
+            browser = await self._checkout()
+            self._stats["leases"] += 1
+            yield browser.session
+            failed = False
+        finally:
+            try:
+                if browser is not None:
+                    await asyncio.shield(self._checkin(browser, failed))
+            finally:
+                self._in_use -= 1
+                self._slots.release()
+
+    async def close(self) -> None:
+        """Arrête tous les navigateurs inactifs"""
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(self._discard(browser) for browser in idle))
+        logger.info(f"Pool de navigateurs arrêté ({len(idle)} navigateurs fermés)")
+
+    def stats(self) -> dict:
+        """Taille, navigateurs prêts ou prêtés, et compteurs de lancements, recyclages et pannes"""
+        return {"size": self.size, "idle": len(self._idle), "in_use": self._in_use, "max_uses": self.max_uses, **self._stats}
+
+browser_pool = BrowserPool()
+
+@asynccontextmanager
+async def browser_session():
+    """
+    Session de navigateur pour une tâche: prêtée par le pool partagé quand il est démarré
+    dans cette boucle d'événements, sinon lancée pour la tâche et arrêtée ensuite (par
+    exemple dans un worker en processus séparé).
+    """
+    if BROWSER_POOL_ENABLED and browser_pool.is_usable():
+        async with browser_pool.acquire() as session:
+            yield session
+        return
+
+    session = create_browser_session()
+    await session.start()
+    try:
+        yield session
+    finally:
+        await session.kill()
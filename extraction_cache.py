@@ -0,0 +1,152 @@
+"""
+Content-addressed cache of document extraction results.
+
+Results are keyed by the SHA-256 of the uploaded file, the document type and the
+prompt version, so re-uploading the same carte grise, permis or justificatif returns
+the previous extraction without a model call. Entries are stored in SQLite and
+evicted by TTL and by least-recent use once the size limit is reached.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "1") == "1"
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", "cache/extractions.db")
+EXTRACTION_CACHE_TTL = int(os.getenv("EXTRACTION_CACHE_TTL", str(30 * 24 * 3600)))
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "10000"))
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hash_file(file_path):
+    """
+    Compute the SHA-256 digest of a file without loading it fully in memory.
+
+    Args:
+        file_path (str): Path to the file
+
+    Returns:
+        str: Hexadecimal digest
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ExtractionCache:
+    """SQLite-backed extraction cache with TTL and size-based (LRU) eviction."""
+
+    def __init__(self, path=EXTRACTION_CACHE_PATH, ttl_seconds=EXTRACTION_CACHE_TTL,
+                 max_entries=EXTRACTION_CACHE_MAX_ENTRIES):
+        self.path = str(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS extractions (
+                    content_hash TEXT NOT NULL,
+                    doc_type TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (content_hash, doc_type, prompt_version)
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS extractions_last_access ON extractions (last_access)"
+            )
+
+    def get(self, content_hash, doc_type, prompt_version):
+        """
+        Return the cached extraction, or None if absent or expired.
+
+        Args:
+            content_hash (str): SHA-256 of the document content
+            doc_type (str): Document type (contravention, certificat, permis, domicile)
+            prompt_version (str): Version of the prompt used for the extraction
+
+        Returns:
+            dict | None: The cached extraction result
+        """
+        now = time.time()
+        key = (content_hash, doc_type, prompt_version)
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT data, created_at FROM extractions "
+                "WHERE content_hash = ? AND doc_type = ? AND prompt_version = ?",
+                key,
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE extractions SET last_access = ? "
+                "WHERE content_hash = ? AND doc_type = ? AND prompt_version = ?",
+                (now, *key),
+            )
+            self.hits += 1
+        logger.info(f"Extraction cache hit for {doc_type} ({content_hash[:12]})")
+        return json.loads(row[0])
+
+    def set(self, content_hash, doc_type, prompt_version, data):
+        """Store an extraction result, then evict expired and least recently used entries."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions "
+                "(content_hash, doc_type, prompt_version, data, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (content_hash, doc_type, prompt_version, json.dumps(data, ensure_ascii=False), now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM extractions WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+            self._conn.execute(
+                "DELETE FROM extractions WHERE rowid IN ("
+                "SELECT rowid FROM extractions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        """Remove every cached extraction."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM extractions")
+
+    def stats(self):
+        """Return hit/miss counters and the current number of entries."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+_cache = None
+
+def get_extraction_cache():
+    """
+    Return the process-wide extraction cache, or None when EXTRACTION_CACHE_ENABLED is off.
+
+    Returns:
+        ExtractionCache | None: The shared cache instance
+    """
+    global _cache
+    if not EXTRACTION_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = ExtractionCache()
+    return _cache
@@ -0,0 +1,142 @@
+"""
+Per-field validity and confidence of an extraction.
+
+Every field of an extracted document gets a status, checked with deterministic rules
+where the expected format is known (plates, speeds, dates, postal codes, licence
+categories):
+
+- "valid": the value passes its format rule (confidence 1.0)
+- "present": a value was found but there is no rule to check it (confidence 0.8)
+- "invalid": the value breaks its format rule (confidence 0.2)
+- "missing": "NONE" or empty (confidence 0.0)
+
+Invalid and missing fields are the candidates for a targeted re-extraction
+(scan.reextract_fields) instead of a full rescan.
+"""
+
+import re
+
+from validation_rules import parse_french_date
+
+CONFIDENCE = {"valid": 1.0, "present": 0.8, "invalid": 0.2, "missing": 0.0}
+FAILING_STATUSES = ("invalid", "missing")
+
+# SIV format (AB-123-CD) and the older FNI format (123 ABC 75)
+PLATE_SIV = re.compile(r"^[A-Z]{2}-\d{3}-[A-Z]{2}$")
+PLATE_FNI = re.compile(r"^\d{1,4}-[A-Z]{1,3}-(\d{2}|2A|2B|97\d)$")
+POSTAL_CODE = re.compile(r"^\d{5}$")
+LICENCE_CATEGORIES = {"AM", "A1", "A2", "A", "B1", "B", "BE", "C1", "C1E", "C", "CE", "D1", "D1E", "D", "DE"}
+MAX_PLAUSIBLE_SPEED = 400
+
+def _is_missing(value):
+    return value is None or value == [] or (isinstance(value, str) and value.strip().upper() in ("", "NONE"))
+
+def check_plate(value):
+    """Plate in the SIV (AB-123-CD) or FNI (123 ABC 75) format."""
+    plate = re.sub(r"[\s-]+", "-", str(value).strip().upper())
+    if PLATE_SIV.match(plate) or PLATE_FNI.match(plate):
+        return None
+    return "Format d'immatriculation attendu: XX-123-XX"
+
+def check_speed(value):
+    """Speed in km/h, as a number within plausible bounds."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return "Vitesse non numérique"
+    if not 0 < value <= MAX_PLAUSIBLE_SPEED:
+        return f"Vitesse invraisemblable: {value} km/h"
+    return None
+
+def check_date(value):
+    """Date in a usual French format."""
+    return None if parse_french_date(str(value)) else "Date illisible"
+
+def check_postal_code(value):
+    return None if POSTAL_CODE.match(str(value).strip()) else "Code postal attendu sur 5 chiffres"
+
+def check_categories(value):
+    if not isinstance(value, list):
+        return "Liste de catégories attendue"
+    unknown = [category for category in value if str(category).strip().upper() not in LICENCE_CATEGORIES]
+    return f"Catégories inconnues: {', '.join(map(str, unknown))}" if unknown else None
+
+# Format rule per document type and field path
+FIELD_RULES = {
+    "contravention": {
+        "infraction.date_heure": check_date,
+        "infraction.exces_vitesse_kmh": check_speed,
+        "infraction.vitesse_maximale_autorisee": check_speed,
+        "infraction.vitesse_mesuree": check_speed,
+        "identification_vehicule.immatriculation": check_plate,
+        "appareil_controle.date_derniere_verification": check_date,
+        "réglements.date_15j": check_date,
+    },
+    "permis": {
+        "identite.date_naissance": check_date,
+        "permis.date_delivrance": check_date,
+        "permis.date_expiration": check_date,
+        "permis.categories": check_categories,
+        "adresse.code_postal": check_postal_code,
+    },
+    "certificat": {
+        "vehicule.immatriculation": check_plate,
+    },
+    "domicile": {
+        "domicile.date_justificatif": check_date,
+    },
+}
+
+def _leaves(data, prefix=""):
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _leaves(value, f"{path}.")
+        else:
+            yield path, value
+
+def _check_speed_excess(data, fields):
+    """The excess must be the measured speed minus the speed limit."""
+    infraction = data.get("infraction", {})
+    measured, limit, excess = (infraction.get(key) for key in ("vitesse_mesuree", "vitesse_maximale_autorisee", "exces_vitesse_kmh"))
+    if all(fields.get(f"infraction.{key}", {}).get("status") == "valid"
+           for key in ("vitesse_mesuree", "vitesse_maximale_autorisee", "exces_vitesse_kmh")):
+        if abs(measured - limit - excess) > 1:
+            fields["infraction.exces_vitesse_kmh"] = {
+                "status": "invalid", "confidence": CONFIDENCE["invalid"],
+                "reason": f"Excès ({excess}) différent de vitesse mesurée - vitesse autorisée ({measured} - {limit})"
+            }
+
+def assess_extraction(doc_type, data):
+    """
+    Check every field of an extracted document.
+
+    Args:
+        doc_type (str): contravention, permis, certificat or domicile
+        data (dict): Extracted data (same keys as the extraction prompts)
+
+    Returns:
+        dict: {
+            "fields": {path: {"status", "confidence", "reason"}},
+            "failing": [paths of invalid or missing fields],
+            "confidence": mean confidence of the fields
+        }
+    """
+    rules = FIELD_RULES.get(doc_type, {})
+    fields = {}
+    for path, value in _leaves(data or {}):
+        if _is_missing(value):
+            status, reason = "missing", "Information non trouvée"
+        elif path in rules:
+            reason = rules[path](value)
+            status = "invalid" if reason else "valid"
+        else:
+            status, reason = "present", None
+        fields[path] = {"status": status, "confidence": CONFIDENCE[status], "reason": reason}
+
+    if doc_type == "contravention":
+        _check_speed_excess(data or {}, fields)
+
+    return {
+        "fields": fields,
+        "failing": [path for path, field in fields.items() if field["status"] in FAILING_STATUSES],
+        "confidence": round(sum(field["confidence"] for field in fields.values()) / len(fields), 2) if fields else 0.0,
+    }
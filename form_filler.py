@@ -1,17 +1,58 @@
 import asyncio
 import json
+import logging
 import os
+import time
 from browser_use import Agent
 from browser_use.llm import ChatAnthropic
 import dotenv
 
+from browser_pool import browser_session
+from rate_limiter import CHARS_PER_TOKEN, IMAGE_TOKENS_ESTIMATE, get_rate_limiter
+from scripted_form import (FORM_TEST_MODE, SCRIPTED_FORM_ENABLED, STANDIN_FORM_URL, ScriptedFormError,
+                           fill_form_scripted, record_form_fill)
+
 # Charger les variables d'environnement depuis .env
 dotenv.load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+def estimate_agent_tokens(messages) -> int:
+    """Estimation des tokens d'entrée d'un appel de l'agent (texte et captures d'écran)"""
+    chars, tokens = 0, 0
+    for message in messages:
+        content = message.content
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content or []:
+            if getattr(part, "type", None) == "image_url":
+                tokens += IMAGE_TOKENS_ESTIMATE
+            else:
+                chars += len(getattr(part, "text", "") or "")
+    return tokens + int(chars / CHARS_PER_TOKEN)
+
+class RateLimitedChatAnthropic(ChatAnthropic):
+    """ChatAnthropic dont chaque appel passe par le limiteur de débit partagé avec les scans"""
+
+    async def ainvoke(self, messages, output_format=None, **kwargs):
+        limiter = get_rate_limiter()
+        if limiter is None:
+            return await super().ainvoke(messages, output_format, **kwargs)
+        tokens = estimate_agent_tokens(messages)
+        await limiter.acquire_async(tokens)
+        result = await super().ainvoke(messages, output_format, **kwargs)
+        if result.usage is not None:
+            limiter.settle(tokens, result.usage.prompt_tokens - (result.usage.prompt_cached_tokens or 0))
+        return result
+
 async def fill_website_form(validated_data: dict) -> dict:
     """
     Remplit le formulaire sur le site web via browser-use
     L'objectif est d'envoyer l'image du radar par email à l'avocat
+
+    Le formulaire est d'abord rempli par script (sélecteurs connus, sans appel au
+    modèle); l'agent browser-use ne prend la main que si le script échoue avant l'envoi.
     
     Args:
         validated_data (dict): Dictionnaire contenant toutes les données à saisir
@@ -25,7 +66,31 @@ async def fill_website_form(validated_data: dict) -> dict:
     
     # URL du formulaire (exemple - vous devrez adapter selon le site réel)
     url_formulaire = "https://contacts-demarches.interieur.gouv.fr/saisine-par-voie-electronique/demande-de-cliche-de-controle-automatise/"
-    
+    if FORM_TEST_MODE:
+        # Réplique locale du formulaire (form_standin.html), pour les tests hors ligne
+        url_formulaire = STANDIN_FORM_URL
+
+    if SCRIPTED_FORM_ENABLED:
+        try:
+            return await fill_form_scripted(validated_data, email_avocat, url_formulaire)
+        except ScriptedFormError as e:
+            if e.submitted:
+                # Le formulaire est parti: le relancer avec l'agent ferait une demande en double
+                record_form_fill("errors")
+                return {
+                    "status": "error",
+                    "mode": "scripted",
+                    "error": f"Erreur lors du remplissage automatique: {str(e)}",
+                    "formulaire_rempli": False,
+                    "email_avocat": email_avocat,
+                    "message": "Échec du remplissage du formulaire"
+                }
+            logger.warning(f"Remplissage scripté impossible, repli sur l'agent: {str(e)}")
+            record_form_fill("fallbacks", reason=str(e).split(":")[0])
+        except Exception as e:
+            logger.warning(f"Remplissage scripté impossible, repli sur l'agent: {str(e)}")
+            record_form_fill("fallbacks", reason=type(e).__name__)
+
     # Créer la tâche pour l'agent browser-use
     task = f"""
     Aller sur le site {url_formulaire} et remplir le formulaire avec ces données :
@@ -47,41 +112,41 @@ async def fill_website_form(validated_data: dict) -> dict:
     Ne pas télécharger ou sauvegarder l'image localement - juste s'assurer qu'elle est envoyée par email.
     """
     
-    # Configurer l'agent browser-use
-    agent = Agent(
-        task=task,
-        llm=ChatAnthropic(
-            model="claude-sonnet-4-20250514",
-            api_key=os.getenv("ANTHROPIC_API_KEY"),
-            max_tokens=2000,
-            temperature=0
-        ),
-        browser_config={
-            "headless": False,  # Voir le processus
-            "viewport": {"width": 1200, "height": 800},
-            "timeout": 30000,
-            "slow_mo": 1000  # Ralentir pour voir les actions
-        },
-        use_vision=True,  # Activer la vision pour mieux analyser les pages
-    )
-    
+    started_at = time.monotonic()
     try:
-        # Exécution réelle de l'agent browser-use
-        print("Démarrage de l'agent browser-use...")
-        result = await agent.run()
+        # Navigateur headless prêté par le pool partagé (isolé des autres tâches)
+        async with browser_session() as session:
+            agent = Agent(
+                task=task,
+                llm=RateLimitedChatAnthropic(
+                    model="claude-sonnet-4-20250514",
+                    api_key=os.getenv("ANTHROPIC_API_KEY"),
+                    max_tokens=2000,
+                    temperature=0
+                ),
+                browser_session=session,
+                use_vision=True,  # Activer la vision pour mieux analyser les pages
+            )
+            
+            # Exécution réelle de l'agent browser-use
+            logger.info("Démarrage de l'agent browser-use...")
+            result = await agent.run()
         
         # Retour avec les détails de l'exécution
         return {
             "status": "success",
+            "mode": "agent",
             "formulaire_rempli": True,
             "email_avocat": email_avocat,
             "message": "Formulaire rempli et image du radar envoyée par email à l'avocat",
-            "result_details": str(result)
+            "result_details": str(result),
+            "duration_s": time.monotonic() - started_at
         }
         
     except Exception as e:
         return {
             "status": "error",
+            "mode": "agent",
             "error": f"Erreur lors du remplissage automatique: {str(e)}",
             "formulaire_rempli": False,
             "email_avocat": email_avocat,
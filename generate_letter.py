@@ -3,29 +3,197 @@ Module amélioré de génération de lettres de contestation de contraventions
 Inclut de meilleurs fallbacks et une gestion d'erreurs robuste
 """
 
+import importlib.util
+import io
+import os
+import shutil
 import subprocess
-import tempfile
+import threading
+import time
 from pathlib import Path
-from datetime import datetime
+from typing import NamedTuple
 import logging
 
+from latex_service import latex_service
+from letter_templates import date_lettre, get_template, render_motifs
+
 logger = logging.getLogger(__name__)
 
+# Délai (en secondes) au-delà duquel les moteurs de rendu disponibles sont vérifiés à nouveau
+RENDERER_PROBE_INTERVAL = float(os.getenv("RENDERER_PROBE_INTERVAL", "3600"))
+RENDERER_PROBE_TIMEOUT = float(os.getenv("RENDERER_PROBE_TIMEOUT", "10"))
+# Moteurs de rendu par ordre de préférence
+RENDERER_ORDER = ("latex", "reportlab", "html")
+
+# Préambule statique des lettres LaTeX (précompilé une fois par latex_service)
+LATEX_PREAMBLE = r"""\documentclass[12pt,a4paper]{article}
+% Encodage et langue
+\usepackage[utf8]{inputenc}
+\usepackage[T1]{fontenc}
+\usepackage[french]{babel}
+% Mise en page
+\usepackage[a4paper,top=2.5cm,bottom=2.5cm,left=2.5cm,right=2.5cm]{geometry}
+\usepackage{setspace}
+\setstretch{1.3} % Interligne principal
+% Police Times New Roman
+\usepackage{newtxtext,newtxmath}
+% Suppression de l'indentation et justification
+\setlength{\parindent}{0pt}
+\setlength{\parskip}{0.6em} % Espace entre paragraphes
+\usepackage{ragged2e}
+\justifying
+% Date automatique au format français personnalisé
+\usepackage[french]{datetime2}
+\renewcommand{\DTMdisplaydate}[4]{\number##3~\DTMfrenchmonthname{##2}~##1}
+% Gestion des images
+\usepackage{graphicx}
+"""
+
 class PDFGenerationError(Exception):
     """Exception personnalisée pour les erreurs de génération PDF"""
     pass
 
+class LetterDocument(NamedTuple):
+    """Lettre rendue en mémoire"""
+    data: bytes
+    media_type: str
+    extension: str
+
+def probe_latex() -> bool:
+    """Vérifie si pdflatex est installé et s'exécute"""
+    if shutil.which("pdflatex") is None:
+        return False
+    try:
+        result = subprocess.run(['pdflatex', '--version'], capture_output=True, text=True,
+                                timeout=RENDERER_PROBE_TIMEOUT)
+        return result.returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+def probe_reportlab() -> bool:
+    """Vérifie si ReportLab est installé (sans l'importer)"""
+    return importlib.util.find_spec("reportlab") is not None
+
+class RendererRegistry:
+    """
+    Moteurs de rendu disponibles, vérifiés une fois (au démarrage du service) puis
+    gardés en mémoire: la génération d'une lettre ne lance plus de sous-processus
+    "pdflatex --version". Les vérifications sont refaites après RENDERER_PROBE_INTERVAL
+    secondes. Un moteur qui échoue est écarté seul (les autres ne sont pas revérifiés) et
+    n'est revérifié qu'une fois l'intervalle écoulé depuis son échec.
+    """
+
+    def __init__(self, probes: dict = None, interval: float = RENDERER_PROBE_INTERVAL):
+        self.probes = probes or {"latex": probe_latex, "reportlab": probe_reportlab, "html": lambda: True}
+        self.interval = interval
+        self._available = None
+        self._checked_at = 0.0
+        self._failed_at = {}  # moteur -> instant de son dernier échec
+        self._lock = threading.Lock()
+        self._stats = {"probes": 0, "failures": {}}
+
+    def refresh(self) -> dict:
+        """Vérifie à nouveau chaque moteur et retourne leur disponibilité"""
+        available = {name: bool(probe()) for name, probe in self.probes.items()}
+        with self._lock:
+            self._available = available
+            self._checked_at = time.monotonic()
+            # Les moteurs écartés depuis plus de l'intervalle viennent d'être vérifiés à nouveau
+            self._failed_at = {name: failed_at for name, failed_at in self._failed_at.items()
+                               if self._checked_at - failed_at <= self.interval}
+            self._stats["probes"] += 1
+        logger.info(f"Moteurs de rendu disponibles: {', '.join(name for name in RENDERER_ORDER if available.get(name)) or 'aucun'}")
+        return available
+
+    def _reprobe(self, backend: str) -> None:
+        """Nouvelle vérification d'un moteur écarté après un échec"""
+        ok = bool(self.probes[backend]())
+        with self._lock:
+            self._available = {**(self._available or {}), backend: ok}
+            self._failed_at.pop(backend, None)
+            self._stats["probes"] += 1
+        logger.info(f"Moteur de rendu {backend} vérifié à nouveau après un échec: {'disponible' if ok else 'indisponible'}")
+
+    def capabilities(self) -> dict:
+        """
+        Disponibilité de chaque moteur, vérifiée seulement si elle est inconnue ou trop
+        ancienne; un moteur en échec depuis moins de l'intervalle est indisponible
+        """
+        with self._lock:
+            stale = self._available is None or time.monotonic() - self._checked_at > self.interval
+        if stale:
+            self.refresh()
+        with self._lock:
+            now = time.monotonic()
+            expired = [name for name, failed_at in self._failed_at.items() if now - failed_at > self.interval]
+        for name in expired:
+            self._reprobe(name)
+        with self._lock:
+            return {name: ok and name not in self._failed_at for name, ok in self._available.items()}
+
+    def backends(self) -> list:
+        """Moteurs disponibles, par ordre de préférence"""
+        available = self.capabilities()
+        return [name for name in RENDERER_ORDER if available.get(name)]
+
+    def backend(self):
+        """Moteur utilisé pour la prochaine lettre, ou None si aucun n'est disponible"""
+        backends = self.backends()
+        return backends[0] if backends else None
+
+    def report_failure(self, backend: str) -> None:
+        """Un moteur a échoué: il est écarté jusqu'à sa prochaine vérification (après l'intervalle)"""
+        with self._lock:
+            self._stats["failures"][backend] = self._stats["failures"].get(backend, 0) + 1
+            self._failed_at[backend] = time.monotonic()
+
+    def status(self) -> dict:
+        """Dernier état connu (sans nouvelle vérification), pour /health et /stats"""
+        with self._lock:
+            available = ({name: ok and name not in self._failed_at for name, ok in self._available.items()}
+                         if self._available is not None else None)
+            age = time.monotonic() - self._checked_at if self._checked_at else None
+            failures = dict(self._stats["failures"])
+            suspended = sorted(self._failed_at)
+            probes = self._stats["probes"]
+        backend = next((name for name in RENDERER_ORDER if available and available.get(name)), None)
+        return {"backend": backend, "available": available, "checked_seconds_ago": age,
+                "probes": probes, "failures": failures, "suspended": suspended}
+
+renderer_registry = RendererRegistry()
+
 class LetterGenerator:
     """Classe principale pour générer les lettres de contestation"""
     
-    def __init__(self):
+    def __init__(self, registry: RendererRegistry = None):
         self.results_dir = Path("results")
         self.results_dir.mkdir(exist_ok=True)
+        self.registry = registry or renderer_registry
         
+    def render_document(self, validated_data: dict, driver_visible: bool, task_id: str) -> LetterDocument:
+        """
+        Rend la lettre en mémoire, sans fichier intermédiaire, avec les mêmes fallbacks
+        (le résultat est écrit directement dans le stockage des résultats, cf. result_store)
+        """
+        renderers = {
+            "latex": self._render_with_latex,
+            "reportlab": self._render_with_reportlab,
+            "html": self._render_with_html,
+        }
+        return self._render_with_fallbacks(renderers, validated_data, driver_visible, task_id)
+
     def generate_final_pdf(self, validated_data: dict, driver_visible: bool, task_id: str) -> str:
         """
         Génère un PDF de lettre de contestation avec fallbacks robustes
         """
+        renderers = {
+            "latex": self._generate_with_latex,
+            "reportlab": self._generate_with_reportlab,
+            "html": self._generate_with_html,
+        }
+        return self._render_with_fallbacks(renderers, validated_data, driver_visible, task_id)
+
+    def _render_with_fallbacks(self, renderers: dict, validated_data: dict, driver_visible: bool, task_id: str):
         try:
             logger.info(f"Génération du PDF pour la tâche {task_id}")
             
@@ -35,33 +203,61 @@ class LetterGenerator:
             permis_data = validated_data.get("permis", {})
             domicile_data = validated_data.get("domicile", {})
             
-            # Essayer LaTeX en premier
-            if self._check_latex_availability():
-                logger.info("Utilisation de LaTeX pour la génération")
-                return self._generate_with_latex(
-                    contravention_data, certificat_data, permis_data, 
-                    domicile_data, driver_visible, task_id
-                )
-            
-            # Fallback vers ReportLab
-            if self._check_reportlab_availability():
-                logger.info("Utilisation de ReportLab pour la génération")
-                return self._generate_with_reportlab(
-                    contravention_data, certificat_data, permis_data, 
-                    domicile_data, driver_visible, task_id
-                )
-            
-            # Fallback vers HTML/CSS
-            logger.info("Utilisation du fallback HTML pour la génération")
-            return self._generate_with_html(
-                contravention_data, certificat_data, permis_data, 
-                domicile_data, driver_visible, task_id
-            )
+            # Moteurs disponibles d'après le registre (sans nouvelle vérification à chaque lettre);
+            # en cas d'échec, le moteur suivant prend le relais
+            errors = []
+            for backend in self.registry.backends():
+                logger.info(f"Utilisation de {backend} pour la génération")
+                try:
+                    return renderers[backend](
+                        contravention_data, certificat_data, permis_data,
+                        domicile_data, driver_visible, task_id
+                    )
+                except Exception as e:
+                    logger.warning(f"Échec de la génération avec {backend}: {str(e)}")
+                    self.registry.report_failure(backend)
+                    errors.append(f"{backend}: {str(e)}")
+            raise PDFGenerationError("; ".join(errors) or "Aucun moteur de rendu disponible")
             
+        except PDFGenerationError:
+            raise
         except Exception as e:
             logger.error(f"Erreur lors de la génération du PDF: {str(e)}")
             raise PDFGenerationError(f"Impossible de générer le document: {str(e)}")
 
+    def _write_document(self, document: LetterDocument, task_id: str) -> str:
+        path = self.results_dir / f"contestation_{task_id}.{document.extension}"
+        path.write_bytes(document.data)
+        return str(path)
+
+    def _render_with_latex(self, contravention_data, certificat_data, permis_data,
+                           domicile_data, driver_visible, task_id) -> LetterDocument:
+        """Rendu LaTeX en mémoire"""
+        latex_content = self._generate_latex_content(
+            contravention_data, certificat_data, permis_data,
+            domicile_data, driver_visible
+        )
+        pdf = latex_service.compile(latex_content, f"contestation_{task_id}", preamble=LATEX_PREAMBLE)
+        return LetterDocument(pdf, "application/pdf", "pdf")
+
+    def _render_with_reportlab(self, contravention_data, certificat_data, permis_data,
+                               domicile_data, driver_visible, task_id) -> LetterDocument:
+        """Rendu ReportLab en mémoire (io.BytesIO)"""
+        from letter_reportlab import render_letter
+
+        buffer = io.BytesIO()
+        render_letter(self._letter_fields(contravention_data, certificat_data, permis_data, domicile_data), buffer)
+        return LetterDocument(buffer.getvalue(), "application/pdf", "pdf")
+
+    def _render_with_html(self, contravention_data, certificat_data, permis_data,
+                          domicile_data, driver_visible, task_id) -> LetterDocument:
+        """Rendu HTML en mémoire (dernier fallback)"""
+        html_content = self._generate_html_content(
+            contravention_data, certificat_data, permis_data,
+            domicile_data, driver_visible
+        )
+        return LetterDocument(html_content.encode("utf-8"), "text/html; charset=utf-8", "html")
+
     def _generate_with_latex(self, contravention_data, certificat_data, permis_data, 
                            domicile_data, driver_visible, task_id):
         """Génération avec LaTeX (méthode originale améliorée)"""
@@ -107,146 +303,31 @@ class LetterGenerator:
             return domicile_data["domicile"].get("adresse", "N/A")
         return "N/A"
 
+    def _letter_fields(self, contravention_data, certificat_data, permis_data, domicile_data):
+        """Champs variables de la lettre (cf. letter_templates.LETTER_FIELDS), "N/A" s'ils sont inconnus"""
+        infraction = (contravention_data or {}).get("infraction") or {}
+
+        def known(value):
+            return "N/A" if value in (None, "", "NONE") else str(value)
+
+        return {
+            "nom_client": self._extract_nom_prenom(permis_data, domicile_data, certificat_data),
+            "adresse_client": known(self._extract_adresse(domicile_data)),
+            "numero_avis": known(infraction.get("numero_avis")),
+            "date_infraction": known(infraction.get("date_heure")),
+            "date_lettre": date_lettre(),
+        }
+
     def _generate_with_reportlab(self, contravention_data, certificat_data, permis_data, 
                                domicile_data, driver_visible, task_id):
-        """Génération avec ReportLab (améliorée)"""
+        """Génération avec ReportLab (styles, polices et blocs statiques préparés une fois, cf. letter_reportlab)"""
         
         try:
-            from reportlab.lib.pagesizes import A4
-            from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-            from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-            from reportlab.lib.units import cm
-            from reportlab.lib import colors
-            from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
-            
-            pdf_path = self.results_dir / f"contestation_{task_id}.pdf"
-            
-            # Configuration du document
-            doc = SimpleDocTemplate(
-                str(pdf_path), 
-                pagesize=A4,
-                leftMargin=2.5*cm, rightMargin=2.5*cm,
-                topMargin=2.5*cm, bottomMargin=2.5*cm
-            )
-            
-            styles = getSampleStyleSheet()
-            
-            # Styles personnalisés
-            header_style = ParagraphStyle(
-                'HeaderStyle',
-                parent=styles['Normal'],
-                alignment=TA_LEFT,
-                spaceAfter=12,
-                fontName='Helvetica-Bold'
-            )
-            
-            date_right_style = ParagraphStyle(
-                'DateRightStyle',
-                parent=styles['Normal'],
-                alignment=TA_RIGHT,
-                spaceAfter=12,
-                fontName='Helvetica-Bold'
-            )
-            
-            bold_style = ParagraphStyle(
-                'BoldStyle',
-                parent=styles['Normal'],
-                fontName='Helvetica-Bold',
-                spaceAfter=6
-            )
-            
-            # Construction du document
-            story = []
-            
-            # Extraction des données avec les nouvelles méthodes robustes
-            nom_prenom = self._extract_nom_prenom(permis_data, domicile_data, certificat_data)
-            adresse = self._extract_adresse(domicile_data)
-            
-            # Extraction des autres champs nécessaires
-            numero_contravention = "N/A"
-            if contravention_data and "infraction" in contravention_data:
-                numero_contravention = contravention_data["infraction"].get("numero_avis", "N/A")
-            
-            date_contravention = "N/A"
-            if contravention_data and "infraction" in contravention_data:
-                date_contravention = contravention_data["infraction"].get("date_heure", "N/A")
-            
-            lieu_contravention = "N/A"
-            if contravention_data and "infraction" in contravention_data:
-                lieu_contravention = contravention_data["infraction"].get("route", "N/A")
-            
-            date_lettre = datetime.now().strftime("%d %B %Y")
-            
-            # En-tête avocat (aligné à gauche comme dans LaTeX)
-            avocat_header = """
-            <b>Maître Yoann LEROUGE</b><br/>
-            Cabinet YSL<br/>
-            74 rue du Faubourg Saint-Denis<br/>
-            75010 PARIS
-            """
-            story.append(Paragraph(avocat_header, header_style))
-            story.append(Spacer(1, 0.6*cm))
-            
-            # Destinataire et date (alignés à droite)
-            destinataire_date = f"""
-            <b>L'Officier du Ministère Public</b><br/>
-            CONTESTATION VITESSE<br/>
-            CS41101<br/>
-            35911 RENNES CEDEX 9<br/><br/>
-            <b>Paris,</b> le {date_lettre}
-            """
-            story.append(Paragraph(destinataire_date, date_right_style))
-            story.append(Spacer(1, 0.6*cm))
-            
-            # Objet
-            objet_text = f"""
-            <b>Objet : Contestation d'un procès-verbal pour excès de vitesse</b><br/>
-            <i>Avis de contravention n° {numero_contravention}</i>
-            """
-            story.append(Paragraph(objet_text, styles['Normal']))
-            story.append(Spacer(1, 0.3*cm))
-            
-            # Corps de la lettre (même texte que LaTeX)
-            story.append(Paragraph("Madame, Monsieur l'Officier du Ministère Public,", styles['Normal']))
-            story.append(Spacer(1, 0.3*cm))
-            
-            corps_text = f"""
-            En qualité de représentant de {nom_prenom}, domicilié au {adresse}, j'ai été mandaté pour
-            contester l'avis de contravention n° {numero_contravention} reçu en date du {date_contravention},
-            concernant un excès de vitesse supposé commis à cette occasion.
-            """
-            story.append(Paragraph(corps_text, styles['Normal']))
-            story.append(Spacer(1, 0.3*cm))
-            
-            corps_text2 = """
-            En tant que propriétaire du véhicule responsable de l'infraction, mon client a été présumé en
-            être le conducteur au moment des faits. Toutefois, mon client conteste être le conducteur au
-            moment de la réalisation de l'infraction. De plus, la photographie prise (ci-jointe) ne permet pas
-            d'identifier le conducteur.
-            """
-            story.append(Paragraph(corps_text2, styles['Normal']))
-            story.append(Spacer(1, 0.3*cm))
-            
-            corps_text3 = """
-            En conséquence, je sollicite l'annulation de ce procès-verbal pour les raisons évoquées.
-            """
-            story.append(Paragraph(corps_text3, styles['Normal']))
-            story.append(Spacer(1, 0.3*cm))
-            
-            corps_text4 = """
-            Dans l'attente de votre retour, je vous remercie pour l'examen attentif de la demande.
-            """
-            story.append(Paragraph(corps_text4, styles['Normal']))
-            story.append(Spacer(1, 1.2*cm))
-            
-            # Signature (alignée à droite)
-            signature_text = "<b>Maître Yoann LEROUGE</b>"
-            story.append(Paragraph(signature_text, date_right_style))
-            
-            # Génération du PDF
-            doc.build(story)
+            document = self._render_with_reportlab(contravention_data, certificat_data, permis_data,
+                                                   domicile_data, driver_visible, task_id)
+            pdf_path = self._write_document(document, task_id)
             logger.info(f"PDF généré avec ReportLab: {pdf_path}")
-            return str(pdf_path)
+            return pdf_path
             
         except Exception as e:
             logger.error(f"Erreur avec ReportLab: {str(e)}")
@@ -256,343 +337,43 @@ class LetterGenerator:
                           domicile_data, driver_visible, task_id):
         """Génération avec HTML/CSS comme dernier fallback"""
         
-        html_content = self._generate_html_content(
-            contravention_data, certificat_data, permis_data, 
-            domicile_data, driver_visible
-        )
-        
-        html_path = self.results_dir / f"contestation_{task_id}.html"
-        
-        with open(html_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        
+        document = self._render_with_html(contravention_data, certificat_data, permis_data,
+                                          domicile_data, driver_visible, task_id)
+        html_path = self._write_document(document, task_id)
         logger.info(f"Document HTML généré: {html_path}")
-        return str(html_path)
+        return html_path
 
     def _generate_html_content(self, contravention_data, certificat_data, permis_data, 
                              domicile_data, driver_visible):
-        """Génère le contenu HTML de la lettre"""
-        
-        # Extraction robuste des données
-        nom_prenom = self._extract_nom_prenom(permis_data, domicile_data, certificat_data)
-        adresse = self._extract_adresse(domicile_data)
-        
-        numero_contravention = "N/A"
-        if contravention_data and "infraction" in contravention_data:
-            numero_contravention = contravention_data["infraction"].get("numero_avis", "N/A")
-        
-        date_contravention = "N/A"
-        if contravention_data and "infraction" in contravention_data:
-            date_contravention = contravention_data["infraction"].get("date_heure", "N/A")
-        
-        date_lettre = datetime.now().strftime("%d %B %Y")
-        
-        html_content = f"""
-<!DOCTYPE html>
-<html lang="fr">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Contestation de Contravention</title>
-    <style>
-        @media print {{
-            body {{ margin: 0; }}
-            .page-break {{ page-break-before: always; }}
-        }}
-        
-        body {{
-            font-family: 'Times New Roman', serif;
-            font-size: 12pt;
-            line-height: 1.6;
-            max-width: 21cm;
-            margin: 2.5cm auto;
-            padding: 0 2.5cm;
-            color: #000;
-        }}
-        
-        .header-avocat {{
-            text-align: left;
-            margin-bottom: 0.6cm;
-        }}
-        
-        .destinataire-date {{
-            text-align: right;
-            margin-bottom: 0.6cm;
-        }}
-        
-        .objet {{
-            margin-bottom: 0.3cm;
-        }}
-        
-        .corps {{
-            text-align: justify;
-            margin-bottom: 0.3cm;
-        }}
-        
-        .signature {{
-            text-align: right;
-            margin-top: 1.2cm;
-        }}
-        
-        .bold {{
-            font-weight: bold;
-        }}
-    </style>
-</head>
-<body>
-    <div class="header-avocat">
-        <strong>Maître Yoann LEROUGE</strong><br>
-        Cabinet YSL<br>
-        74 rue du Faubourg Saint-Denis<br>
-        75010 PARIS
-    </div>
-    
-    <div class="destinataire-date">
-        <strong>L'Officier du Ministère Public</strong><br>
-        CONTESTATION VITESSE<br>
-        CS41101<br>
-        35911 RENNES CEDEX 9<br><br>
-        <strong>Paris,</strong> le {date_lettre}
-    </div>
-    
-    <div class="objet">
-        <strong>Objet : Contestation d'un procès-verbal pour excès de vitesse</strong><br>
-        <em>Avis de contravention n° {numero_contravention}</em>
-    </div>
-    
-    <p class="corps">Madame, Monsieur l'Officier du Ministère Public,</p>
-    
-    <p class="corps">En qualité de représentant de {nom_prenom}, domicilié au {adresse}, j'ai été mandaté pour
-    contester l'avis de contravention n° {numero_contravention} reçu en date du {date_contravention},
-    concernant un excès de vitesse supposé commis à cette occasion.</p>
-    
-    <p class="corps">En tant que propriétaire du véhicule responsable de l'infraction, mon client a été présumé en
-    être le conducteur au moment des faits. Toutefois, mon client conteste être le conducteur au
-    moment de la réalisation de l'infraction. De plus, la photographie prise (ci-jointe) ne permet pas
-    d'identifier le conducteur.</p>
-    
-    <p class="corps">En conséquence, je sollicite l'annulation de ce procès-verbal pour les raisons évoquées.</p>
-    
-    <p class="corps">Dans l'attente de votre retour, je vous remercie pour l'examen attentif de la demande.</p>
-    
-    <div class="signature">
-        <strong>Maître Yoann LEROUGE</strong>
-    </div>
-</body>
-</html>
-        """
-        
-        return html_content
-
-    def _get_motifs_text(self, driver_visible):
-        """Retourne les motifs de contestation sous forme de liste"""
-        if driver_visible:
-            return [
-                "<b>Défaut de signalisation :</b> La signalisation du contrôle radar n'était pas conforme aux dispositions réglementaires en vigueur.",
-                "<b>Conditions de circulation :</b> Les conditions de circulation au moment des faits ne permettaient pas le respect de la limitation de vitesse en toute sécurité.",
-                "<b>Calibrage de l'appareil :</b> Je conteste la fiabilité de l'appareil de contrôle et demande la production du certificat de vérification périodique.",
-                "<b>Erreur sur la personne :</b> Je n'étais pas le conducteur du véhicule au moment des faits reprochés.",
-                "<b>Vice de procédure :</b> La procédure de constatation de l'infraction présente des irrégularités substantielles."
-            ]
-        else:
-            return [
-                "<b>Impossibilité d'identification du conducteur :</b> La photographie jointe à l'avis de contravention ne permet pas d'identifier clairement le conducteur du véhicule au moment des faits.",
-                "<b>Défaut de preuve :</b> En application de l'article 529-2 du Code de procédure pénale, l'administration doit apporter la preuve de l'infraction. La photo fournie ne constitue pas une preuve suffisante de mon implication personnelle.",
-                "<b>Principe de la présomption d'innocence :</b> Conformément à l'article 9 de la Déclaration des droits de l'homme et du citoyen, toute personne est présumée innocente jusqu'à ce que sa culpabilité soit établie.",
-                "<b>Qualité de la photographie :</b> La qualité de l'image ne permet pas une identification formelle et certaine du conducteur, rendant impossible l'établissement de ma responsabilité.",
-                "<b>Usage possible du véhicule par un tiers :</b> Le véhicule aurait pu être utilisé par une tierce personne autorisée au moment des faits reprochés."
-            ]
-
-    def _get_motifs_html(self, driver_visible):
-        """Retourne les motifs formatés en HTML"""
-        motifs_list = self._get_motifs_text(driver_visible)
-        html_motifs = "<ol>"
-        for motif in motifs_list:
-            html_motifs += f"<li>{motif}</li>"
-        html_motifs += "</ol>"
-        return html_motifs
+        """Génère le contenu HTML de la lettre (gabarit compilé, champs échappés pour HTML)"""
+        fields = self._letter_fields(contravention_data, certificat_data, permis_data, domicile_data)
+        return get_template("html").render(fields)
+
+    def _get_motifs(self, driver_visible, backend="html"):
+        """Retourne les motifs de contestation mis en forme pour un moteur (latex, html ou reportlab)"""
+        return render_motifs(backend, driver_visible)
 
     def _generate_latex_content(self, contravention_data, certificat_data, permis_data, domicile_data, driver_visible):
-        """Génération du contenu LaTeX pour la lettre"""
-        
-        # Extraction robuste des données
-        nom_prenom = self._extract_nom_prenom(permis_data, domicile_data, certificat_data)
-        adresse = self._extract_adresse(domicile_data)
-        
-        numero_contravention = "N/A"
-        if contravention_data and "infraction" in contravention_data:
-            numero_contravention = contravention_data["infraction"].get("numero_avis", "N/A")
-        
-        date_contravention = "N/A"
-        if contravention_data and "infraction" in contravention_data:
-            date_contravention = contravention_data["infraction"].get("date_heure", "N/A")
-        
-        lieu_contravention = "N/A"
-        if contravention_data and "infraction" in contravention_data:
-            lieu_contravention = contravention_data["infraction"].get("route", "N/A")
-        
-        immatriculation = "N/A"
-        if certificat_data and "vehicule" in certificat_data:
-            immatriculation = certificat_data["vehicule"].get("immatriculation", "N/A")
-            
-        marque_vehicule = "N/A"
-        if certificat_data and "vehicule" in certificat_data:
-            marque_vehicule = certificat_data["vehicule"].get("marque", "N/A")
-        
-        # Génération du contenu LaTeX avec la mise en forme professionnelle
-        latex_content = f"""\\documentclass[12pt,a4paper]{{article}}
-% Encodage et langue
-\\usepackage[utf8]{{inputenc}}
-\\usepackage[T1]{{fontenc}}
-\\usepackage[french]{{babel}}
-% Mise en page
-\\usepackage[a4paper,top=2.5cm,bottom=2.5cm,left=2.5cm,right=2.5cm]{{geometry}}
-\\usepackage{{setspace}}
-\\setstretch{{1.3}} % Interligne principal
-% Police Times New Roman
-\\usepackage{{newtxtext,newtxmath}}
-% Suppression de l'indentation et justification
-\\setlength{{\\parindent}}{{0pt}}
-\\setlength{{\\parskip}}{{0.6em}} % Espace entre paragraphes
-\\usepackage{{ragged2e}}
-\\justifying
-% Date automatique au format français personnalisé
-\\usepackage[french]{{datetime2}}
-\\renewcommand{{\\DTMdisplaydate}}[4]{{\\number##3~\\DTMfrenchmonthname{{##2}}~##1}}
-% Gestion des images
-\\usepackage{{graphicx}}
-% --- Variables client ---
-\\newcommand{{\\nomclient}}{{{nom_prenom}}}
-\\newcommand{{\\adresseclient}}{{{adresse}}}
-\\newcommand{{\\numcontravention}}{{{numero_contravention}}}
-\\newcommand{{\\dateinfraction}}{{{date_contravention}}}
-% --- Variables avocat ---
-\\newcommand{{\\nomavocat}}{{Maître Yoann LEROUGE}}
-\\newcommand{{\\signaturefile}}{{signature.png}} % Nom du fichier image de signature
-% --- Variables destinataire ---
-\\newcommand{{\\adresseofficier}}{{CONTESTATION VITESSE\\\\CS41101\\\\35911 RENNES CEDEX 9}}
-% ----------------------------
-\\begin{{document}}
-% En-tête avocat
-\\noindent
-\\textbf{{\\nomavocat}} \\\\
-Cabinet YSL \\\\
-74 rue du Faubourg Saint-Denis \\\\
-75010 PARIS
-\\vspace{{0.6cm}}
-% Bloc destinataire + date dans un seul bloc décalé de 10 cm
-\\noindent
-
-\\hspace*{{10cm}}%
-\\begin{{minipage}}{{7cm}}
-\\textbf{{L'Officier du Ministère Public}} \\\\
-\\normalsize \\adresseofficier \\\\
-\\vspace{{0.4cm}} \\\\
-\\textbf{{Paris,}} le \\DTMdisplaydate{{\\year}}{{\\month}}{{\\day}}{{-1}}
-\\end{{minipage}}
-\\vspace{{0.6cm}}
-% Objet
-\\noindent
-\\textbf{{Objet : Contestation d'un procès-verbal pour excès de vitesse}} \\\\
-\\vspace{{0.15cm}}
-\\textit{{Avis de contravention n° \\numcontravention}} \\\\[0.3cm]
-Madame, Monsieur l'Officier du Ministère Public, \\\\
-En qualité de représentant de \\nomclient, domicilié au \\adresseclient, j'ai été mandaté pour
-contester l'avis de contravention n° \\numcontravention \\ reçu en date du \\dateinfraction,
-concernant un excès de vitesse supposé commis à cette occasion.
-En tant que propriétaire du véhicule responsable de l'infraction, mon client a été présumé en
-être le conducteur au moment des faits. Toutefois, mon client conteste être le conducteur au
-moment de la réalisation de l'infraction. De plus, la photographie prise (ci-jointe) ne permet pas
-d'identifier le conducteur.
-En conséquence, je sollicite l'annulation de ce procès-verbal pour les raisons évoquées.
-Dans l'attente de votre retour, je vous remercie pour l'examen attentif de la demande.
-\\vspace{{1.2cm}}
-% Bloc nom avocat + signature décalé de 10 cm
-\\noindent
-\\hspace*{{10cm}}%
-\\begin{{minipage}}{{7cm}}
-\\textbf{{\\nomavocat}} \\\\
-% Note: Si signature.png n'existe pas, cette ligne sera ignorée
-% \\includegraphics[width=2.5cm]{{\\signaturefile}} % Taille de la signature réduite
-\\end{{minipage}}
-\\end{{document}}"""
-        
-        return latex_content
-
-    def _get_motifs_latex(self, driver_visible):
-        """Retourne les motifs formatés pour LaTeX"""
-        if driver_visible:
-            return [
-                "Défaut de signalisation : La signalisation du contrôle radar n'était pas conforme aux dispositions réglementaires.",
-                "Conditions de circulation : Les conditions ne permettaient pas le respect de la limitation en sécurité.",
-                "Calibrage de l'appareil : Je conteste la fiabilité de l'appareil de contrôle.",
-                "Erreur sur la personne : Je n'étais pas le conducteur au moment des faits.",
-                "Vice de procédure : La procédure présente des irrégularités substantielles."
-            ]
-        else:
-            return [
-                "Impossibilité d'identification du conducteur : La photographie ne permet pas d'identifier clairement le conducteur.",
-                "Défaut de preuve : L'administration doit apporter la preuve de l'infraction selon l'article 529-2 du Code de procédure pénale.",
-                "Principe de présomption d'innocence : Toute personne est présumée innocente jusqu'à établissement de sa culpabilité.",
-                "Qualité de la photographie : La qualité ne permet pas une identification formelle et certaine.",
-                "Usage possible par un tiers : Le véhicule aurait pu être utilisé par une tierce personne autorisée."
-            ]
+        """Génération du contenu LaTeX pour la lettre (préambule statique et corps du gabarit compilé)"""
+        fields = self._letter_fields(contravention_data, certificat_data, permis_data, domicile_data)
+        return LATEX_PREAMBLE + get_template("latex").render(fields)
 
     def _compile_latex_to_pdf(self, latex_content, task_id):
-        """Compilation du LaTeX en PDF"""
+        """Compilation du LaTeX en PDF (préambule précompilé, compilations en parallèle bornées)"""
         
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Créer le fichier .tex
-            tex_file = Path(temp_dir) / f"contestation_{task_id}.tex"
-            
-            with open(tex_file, 'w', encoding='utf-8') as f:
-                f.write(latex_content)
-            
-            # Compiler avec pdflatex
-            try:
-                result = subprocess.run([
-                    'pdflatex', 
-                    '-output-directory', temp_dir,
-                    '-interaction=nonstopmode',
-                    str(tex_file)
-                ], capture_output=True, text=True, timeout=30)
-                
-                if result.returncode != 0:
-                    raise Exception(f"Erreur de compilation LaTeX: {result.stderr}")
-                
-                # Copier le PDF vers le répertoire de résultats
-                pdf_source = Path(temp_dir) / f"contestation_{task_id}.pdf"
-                pdf_destination = self.results_dir / f"contestation_{task_id}.pdf"
-                
-                if pdf_source.exists():
-                    import shutil
-                    shutil.copy2(pdf_source, pdf_destination)
-                    logger.info(f"PDF généré avec LaTeX: {pdf_destination}")
-                    return str(pdf_destination)
-                else:
-                    raise Exception("Le fichier PDF n'a pas été généré")
-                    
-            except subprocess.TimeoutExpired:
-                raise Exception("Timeout lors de la compilation LaTeX")
-            except FileNotFoundError:
-                raise Exception("pdflatex non trouvé sur le système")
+        pdf_destination = self.results_dir / f"contestation_{task_id}.pdf"
+        pdf = latex_service.compile(latex_content, f"contestation_{task_id}", preamble=LATEX_PREAMBLE)
+        pdf_destination.write_bytes(pdf)
+        logger.info(f"PDF généré avec LaTeX: {pdf_destination}")
+        return str(pdf_destination)
 
     def _check_latex_availability(self):
-        """Vérifie si pdflatex est disponible"""
-        try:
-            result = subprocess.run(['pdflatex', '--version'], 
-                                  capture_output=True, text=True)
-            return result.returncode == 0
-        except FileNotFoundError:
-            return False
+        """Vérifie si pdflatex est disponible (d'après le registre des moteurs)"""
+        return self.registry.capabilities().get("latex", False)
 
     def _check_reportlab_availability(self):
-        """Vérifie si ReportLab est disponible"""
-        try:
-            from reportlab.lib.pagesizes import A4
-            return True
-        except ImportError:
-            return False
+        """Vérifie si ReportLab est disponible (d'après le registre des moteurs)"""
+        return self.registry.capabilities().get("reportlab", False)
 
 
 # Usage simplifié
@@ -601,6 +382,10 @@ def generate_final_pdf(validated_data: dict, driver_visible: bool, task_id: str)
     generator = LetterGenerator()
     return generator.generate_final_pdf(validated_data, driver_visible, task_id)
 
+def render_letter_document(validated_data: dict, driver_visible: bool, task_id: str) -> LetterDocument:
+    """Lettre rendue en mémoire (données, type MIME, extension), sans fichier"""
+    return LetterGenerator().render_document(validated_data, driver_visible, task_id)
+
 
 if __name__ == "__main__":
     # Test de la fonction
@@ -0,0 +1,138 @@
+"""
+File d'attente bornée des traitements de documents
+
+Remplace les BackgroundTasks de FastAPI: un nombre fixe de workers consomme une file
+de taille limitée, ce qui plafonne le nombre de pipelines (appels LLM, navigateurs,
+génération PDF) exécutés simultanément. Les workers tournent soit dans le processus
+du serveur (mode "inprocess"), soit dans des processus séparés (mode "process",
+qui nécessite un stockage de tâches partagé: SQLite ou Redis).
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX_SIZE = int(os.getenv("JOB_QUEUE_MAX_SIZE", "100"))
+JOB_WORKER_MODE = os.getenv("JOB_WORKER_MODE", "inprocess")
+JOB_DRAIN_TIMEOUT = float(os.getenv("JOB_DRAIN_TIMEOUT", "60"))
+
+class QueueFullError(Exception):
+    """Exception levée lorsque la file d'attente n'accepte plus de nouveaux traitements"""
+    pass
+
+def _run_in_process(handler: Callable, args: tuple) -> None:
+    """Point d'entrée d'un traitement exécuté dans un processus séparé"""
+    asyncio.run(handler(*args))
+
+class JobQueue:
+    """File d'attente bornée consommée par un nombre fixe de workers"""
+
+    def __init__(self, handler: Callable, workers: int = JOB_WORKERS,
+                 max_queue_size: int = JOB_QUEUE_MAX_SIZE, mode: str = JOB_WORKER_MODE):
+        if mode not in ("inprocess", "process"):
+            raise ValueError(f"Mode de worker inconnu: {mode}")
+        self.handler = handler
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.mode = mode
+        self._queue: Optional[asyncio.Queue] = None
+        self._waiting: List[str] = []
+        self._running: List[str] = []
+        self._worker_tasks: List[asyncio.Task] = []
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._accepting = False
+
+    async def start(self) -> None:
+        """Démarre les workers"""
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        if self.mode == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._accepting = True
+        logger.info(f"File de traitement démarrée: {self.workers} workers ({self.mode}), capacité {self.max_queue_size}")
+
+    def submit(self, job_id: str, *args) -> int:
+        """
+        Ajoute un traitement à la file et retourne sa position (1 = prochain à démarrer).
+        Lève QueueFullError si la file est saturée ou en cours d'arrêt.
+        """
+        if not self._accepting:
+            raise QueueFullError("Le service est en cours d'arrêt")
+        try:
+            self._queue.put_nowait((job_id, args))
+        except asyncio.QueueFull:
+            raise QueueFullError(f"File d'attente saturée ({self.max_queue_size} traitements en attente)")
+        self._waiting.append(job_id)
+        return len(self._waiting)
+
+    def is_full(self) -> bool:
+        """Indique si un nouveau traitement serait refusé"""
+        return not self._accepting or self._queue.full()
+
+    def position(self, job_id: str) -> Optional[int]:
+        """Position d'un traitement dans la file (0 s'il est en cours, None s'il est inconnu)"""
+        if job_id in self._running:
+            return 0
+        if job_id in self._waiting:
+            return self._waiting.index(job_id) + 1
+        return None
+
+    def stats(self) -> dict:
+        """État courant de la file"""
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "running": len(self._running),
+            "waiting": len(self._waiting),
+            "capacity": self.max_queue_size,
+            "accepting": self._accepting
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            job_id, args = await self._queue.get()
+            self._waiting.remove(job_id)
+            self._running.append(job_id)
+            try:
+                if self._executor is not None:
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(self._executor, _run_in_process, self.handler, args)
+                else:
+                    await self.handler(*args)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erreur inattendue du worker pour le traitement {job_id}: {str(e)}")
+            finally:
+                self._running.remove(job_id)
+                self._queue.task_done()
+
+    async def drain(self, timeout: float = JOB_DRAIN_TIMEOUT) -> List[str]:
+        """
+        Arrêt progressif: refuse les nouveaux traitements, attend la fin de ceux en cours
+        et en attente (au plus `timeout` secondes), puis arrête les workers.
+        Retourne les identifiants des traitements interrompus ou jamais démarrés.
+        """
+        self._accepting = False
+        if self._queue is None:
+            return []
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Arrêt de la file après {timeout}s: {len(self._running) + len(self._waiting)} traitements non terminés")
+
+        unfinished = self._running + self._waiting
+        for worker_task in self._worker_tasks:
+            worker_task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        return unfinished
@@ -0,0 +1,231 @@
+"""
+Service de compilation LaTeX des lettres
+
+Un pdflatex lancé à froid recharge le format LaTeX et tous les paquets du préambule
+(babel, newtx, datetime2...) à chaque lettre, ce qui prend l'essentiel des quelques
+secondes de compilation. Le préambule des lettres ne change pas: il est compilé une
+fois pour toutes dans un format (pdflatex -ini ... \\dump), gardé dans
+LATEX_FORMAT_DIR et rechargé avec -fmt, si bien que chaque lettre ne compile plus
+que son corps. Le nom du format dépend du contenu du préambule et de la version de
+pdflatex: modifier l'un ou mettre TeX à jour produit un nouveau format. Si une
+compilation avec le format échoue alors que la compilation complète réussit, le format
+est supprimé et n'est plus utilisé.
+
+pdflatex ne sait compiler qu'un document par processus: il n'y a pas de compilateur
+gardé en mémoire entre deux lettres, c'est le format précompilé qui évite le
+démarrage à froid. Les compilations passent par une file bornée: au plus
+LATEX_WORKERS pdflatex en parallèle, au plus LATEX_QUEUE_MAX_SIZE lettres en attente.
+Si le format ne peut pas être construit (paquet manquant...), les lettres sont
+compilées en entier comme avant.
+"""
+
+import hashlib
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+LATEX_WORKERS = int(os.getenv("LATEX_WORKERS", "2"))
+LATEX_QUEUE_MAX_SIZE = int(os.getenv("LATEX_QUEUE_MAX_SIZE", "20"))
+LATEX_QUEUE_TIMEOUT = float(os.getenv("LATEX_QUEUE_TIMEOUT", "60"))
+LATEX_COMPILE_TIMEOUT = float(os.getenv("LATEX_COMPILE_TIMEOUT", "30"))
+LATEX_FORMAT_DIR = Path(os.getenv("LATEX_FORMAT_DIR", "cache/latex"))
+LATEX_PRECOMPILED_FORMAT = os.getenv("LATEX_PRECOMPILED_FORMAT", "1") == "1"
+
+class LatexServiceError(Exception):
+    """Exception levée lorsqu'une lettre ne peut pas être compilée (erreur, délai, file pleine)"""
+    pass
+
+class LatexService:
+    """Compilation des lettres avec un préambule précompilé et un nombre borné de pdflatex"""
+
+    def __init__(self, workers: int = LATEX_WORKERS, max_queue_size: int = LATEX_QUEUE_MAX_SIZE,
+                 format_dir: Path = LATEX_FORMAT_DIR, precompiled_format: bool = LATEX_PRECOMPILED_FORMAT,
+                 runner: Callable = subprocess.run):
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.format_dir = Path(format_dir)
+        self.precompiled_format = precompiled_format
+        self.runner = runner
+        self._slots = threading.BoundedSemaphore(workers)
+        self._lock = threading.Lock()
+        self._format_lock = threading.Lock()
+        self._formats = {}  # nom du format -> True (construit) ou False (échec, compilation complète)
+        self._tex_version = None
+        self._waiting = 0
+        self._running = 0
+        self._stats = {"compilations": 0, "with_format": 0, "full": 0, "errors": 0, "rejected": 0,
+                       "format_builds": 0, "format_failures": 0, "format_discarded": 0,
+                       "total_seconds": 0.0, "total_wait_seconds": 0.0}
+
+    @property
+    def capacity(self) -> int:
+        """Nombre maximal de compilations simultanées"""
+        return self.workers
+
+    def _version(self) -> str:
+        """Version de pdflatex (première ligne de pdflatex --version), lue une fois"""
+        if self._tex_version is None:
+            try:
+                result = self.runner(['pdflatex', '--version'], capture_output=True, text=True, timeout=LATEX_COMPILE_TIMEOUT)
+                self._tex_version = (result.stdout or "").strip().splitlines()[0] if result.returncode == 0 and result.stdout else "inconnue"
+            except (OSError, subprocess.TimeoutExpired):
+                self._tex_version = "inconnue"
+        return self._tex_version
+
+    def _format_name(self, preamble: str) -> str:
+        # Un format n'est lisible que par la version de pdflatex qui l'a produit
+        key = f"{self._version()}\n{preamble}"
+        return "lettre-" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+
+    def _env(self) -> dict:
+        # Répertoire des formats ajouté au chemin de recherche de pdflatex (le séparateur final garde les chemins par défaut)
+        return {**os.environ, "TEXFORMATS": f"{self.format_dir.resolve()}{os.pathsep}"}
+
+    def prepare_format(self, preamble: str) -> Optional[str]:
+        """
+        Construit le format du préambule s'il n'existe pas encore.
+
+        Returns:
+            str | None: Nom du format, ou None si les formats sont désactivés ou n'ont pas pu être construits
+        """
+        if not self.precompiled_format:
+            return None
+        name = self._format_name(preamble)
+        with self._format_lock:
+            built = self._formats.get(name)
+            if built is None:
+                built = self._formats[name] = self._build_format(name, preamble)
+        return name if built else None
+
+    def _build_format(self, name: str, preamble: str) -> bool:
+        if (self.format_dir / f"{name}.fmt").exists():
+            return True
+        self.format_dir.mkdir(parents=True, exist_ok=True)
+        source = self.format_dir / f"{name}.ltx"
+        source.write_text(preamble + "\n\\dump\n", encoding="utf-8")
+        started_at = time.monotonic()
+        try:
+            result = self.runner([
+                'pdflatex', '-ini', '-interaction=nonstopmode', '-halt-on-error',
+                f'-jobname={name}', f'-output-directory={self.format_dir}',
+                '&pdflatex', str(source)
+            ], capture_output=True, text=True, timeout=LATEX_COMPILE_TIMEOUT * 2, env=self._env())
+            built = result.returncode == 0 and (self.format_dir / f"{name}.fmt").exists()
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.warning(f"Construction du format LaTeX impossible: {str(e)}")
+            built = False
+        with self._lock:
+            self._stats["format_builds" if built else "format_failures"] += 1
+        if built:
+            logger.info(f"Format LaTeX {name} construit en {time.monotonic() - started_at:.1f}s")
+        else:
+            logger.warning(f"Format LaTeX {name} non construit, compilation complète des lettres")
+        return built
+
+    def compile(self, latex_content: str, jobname: str, preamble: Optional[str] = None) -> bytes:
+        """
+        Compile une lettre et retourne le PDF.
+
+        Args:
+            latex_content (str): Document LaTeX complet
+            jobname (str): Nom des fichiers de la compilation (ex: contestation_<task_id>)
+            preamble (str): Préambule statique par lequel commence le document: s'il est
+                fourni, il est précompilé une fois et seul le corps est compilé
+
+        Raises:
+            LatexServiceError: File pleine, délai d'attente dépassé ou erreur de compilation
+        """
+        with self._lock:
+            # Lettres en attente au-delà des compilateurs libres
+            if self._waiting + self._running >= self.workers + self.max_queue_size:
+                self._stats["rejected"] += 1
+                raise LatexServiceError(f"File de compilation LaTeX pleine ({self._waiting} lettres en attente)")
+            self._waiting += 1
+        queued_at = time.monotonic()
+        acquired = self._slots.acquire(timeout=LATEX_QUEUE_TIMEOUT)
+        with self._lock:
+            self._waiting -= 1
+            if acquired:
+                self._running += 1
+                self._stats["total_wait_seconds"] += time.monotonic() - queued_at
+            else:
+                self._stats["rejected"] += 1
+        if not acquired:
+            raise LatexServiceError(f"Aucun compilateur LaTeX libre après {LATEX_QUEUE_TIMEOUT:.0f}s")
+
+        started_at = time.monotonic()
+        try:
+            format_name = None
+            if preamble and latex_content.startswith(preamble):
+                format_name = self.prepare_format(preamble)
+            if format_name:
+                try:
+                    pdf = self._run(latex_content[len(preamble):], jobname, format_name)
+                except LatexServiceError as e:
+                    logger.warning(f"Compilation avec le format {format_name} en échec, nouvel essai sans format: {str(e)}")
+                    pdf = self._run(latex_content, jobname, None)
+                    # La lettre compile sans le format: c'est le format qui est inutilisable (TeX mis à jour...)
+                    self._discard_format(format_name)
+                    format_name = None
+            else:
+                pdf = self._run(latex_content, jobname, None)
+            with self._lock:
+                self._stats["compilations"] += 1
+                self._stats["with_format" if format_name else "full"] += 1
+            return pdf
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._stats["total_seconds"] += time.monotonic() - started_at
+            self._slots.release()
+
+    def _discard_format(self, name: str) -> None:
+        with self._format_lock:
+            self._formats[name] = False
+            (self.format_dir / f"{name}.fmt").unlink(missing_ok=True)
+        with self._lock:
+            self._stats["format_discarded"] += 1
+        logger.warning(f"Format LaTeX {name} supprimé, compilation complète des lettres")
+
+    def _run(self, source: str, jobname: str, format_name: Optional[str]) -> bytes:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            tex_file = Path(temp_dir) / f"{jobname}.tex"
+            tex_file.write_text(source, encoding="utf-8")
+            command = ['pdflatex', '-output-directory', temp_dir, '-interaction=nonstopmode', '-halt-on-error']
+            if format_name:
+                command.append(f'-fmt={format_name}')
+            try:
+                result = self.runner(command + [str(tex_file)], capture_output=True, text=True,
+                                     timeout=LATEX_COMPILE_TIMEOUT, env=self._env())
+            except subprocess.TimeoutExpired:
+                raise LatexServiceError("Timeout lors de la compilation LaTeX")
+            except FileNotFoundError:
+                raise LatexServiceError("pdflatex non trouvé sur le système")
+            if result.returncode != 0:
+                raise LatexServiceError(f"Erreur de compilation LaTeX: {result.stderr or result.stdout[-2000:]}")
+            pdf_file = Path(temp_dir) / f"{jobname}.pdf"
+            if not pdf_file.exists():
+                raise LatexServiceError("Le fichier PDF n'a pas été généré")
+            return pdf_file.read_bytes()
+
+    def stats(self) -> dict:
+        """Compilations (avec ou sans format précompilé), durées moyennes, file et constructions de format"""
+        with self._lock:
+            stats = {"workers": self.workers, "running": self._running, "waiting": self._waiting, **self._stats}
+        done = stats["compilations"] + stats["errors"]
+        stats["average_seconds"] = stats["total_seconds"] / done if done else None
+        stats["average_wait_seconds"] = stats["total_wait_seconds"] / done if done else None
+        return stats
+
+latex_service = LatexService()
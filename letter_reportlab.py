@@ -0,0 +1,183 @@
+"""
+Rendu ReportLab rapide des lettres de contestation
+
+Tout ce qui ne dépend pas de la tâche est préparé une fois par processus: styles de
+paragraphe, polices (LETTER_FONT / LETTER_FONT_BOLD, fichiers TTF optionnels, sinon
+Helvetica) et gabarits compilés. L'en-tête (avocat, destinataire et date du jour) est
+mis en page une fois par jour, les paragraphes sans champ variable (formules de
+politesse, signature) une fois par processus; ces blocs sont dessinés dans chaque PDF
+sous forme de form XObject, sans recalcul de leurs lignes. Seuls les paragraphes qui
+contiennent des données de la tâche sont mis en page pour chaque lettre. Un PDF ne
+peut pas référencer les objets d'un autre fichier: le XObject est écrit dans chaque
+document, mais à partir de la mise en page en cache.
+
+Mesure hors ligne (lettres par seconde, avant et après):
+    python letter_reportlab.py --benchmark 200
+"""
+
+import hashlib
+import io
+import os
+import threading
+import time
+from functools import lru_cache
+
+from reportlab.lib.enums import TA_LEFT, TA_RIGHT
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import cm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Flowable, Paragraph, SimpleDocTemplate, Spacer
+
+from letter_templates import get_reportlab_letterhead, get_reportlab_template
+
+LETTER_FONT = os.getenv("LETTER_FONT")
+LETTER_FONT_BOLD = os.getenv("LETTER_FONT_BOLD")
+MARGIN = 2.5 * cm
+FRAME_WIDTH = A4[0] - 2 * MARGIN
+
+# Le dessin d'un paragraphe mis en page en cache n'est pas protégé contre l'accès concurrent
+_draw_lock = threading.Lock()
+
+@lru_cache(maxsize=None)
+def letter_fonts() -> tuple:
+    """Polices (normale, grasse), enregistrées une fois par processus"""
+    if LETTER_FONT and LETTER_FONT_BOLD:
+        pdfmetrics.registerFont(TTFont("LetterFont", LETTER_FONT))
+        pdfmetrics.registerFont(TTFont("LetterFont-Bold", LETTER_FONT_BOLD))
+        pdfmetrics.registerFontFamily("LetterFont", normal="LetterFont", bold="LetterFont-Bold",
+                                      italic="LetterFont", boldItalic="LetterFont-Bold")
+        return "LetterFont", "LetterFont-Bold"
+    return "Helvetica", "Helvetica-Bold"
+
+@lru_cache(maxsize=None)
+def letter_styles() -> dict:
+    """Styles de paragraphe de la lettre, construits une fois par processus"""
+    regular, bold = letter_fonts()
+    normal = ParagraphStyle("LetterNormal", parent=getSampleStyleSheet()["Normal"], fontName=regular)
+    return {
+        "normal": normal,
+        "header": ParagraphStyle("HeaderStyle", parent=normal, alignment=TA_LEFT, spaceAfter=12, fontName=bold),
+        "right": ParagraphStyle("DateRightStyle", parent=normal, alignment=TA_RIGHT, spaceAfter=12, fontName=bold),
+    }
+
+class _BlockLayout:
+    """Bloc mis en page une fois: paragraphes déjà découpés en lignes et leur position dans le bloc"""
+
+    def __init__(self, entries: list, values: dict):
+        styles = letter_styles()
+        placed, y, markup = [], 0.0, []
+        for style, template, space_after in entries:
+            text = template.render(values)
+            markup.append(text)
+            paragraph = Paragraph(text, styles[style])
+            _, height = paragraph.wrap(FRAME_WIDTH, A4[1])
+            placed.append((paragraph, y + height))
+            y += height + styles[style].spaceAfter + space_after * cm
+        # Espace après le dernier paragraphe laissé au flux (comme un paragraphe ordinaire)
+        self.space_after = styles[style].spaceAfter + space_after * cm
+        self.height = y - self.space_after
+        self.placements = [(paragraph, self.height - top) for paragraph, top in placed]
+        self.name = "bloc-" + hashlib.sha1("\n".join(markup).encode("utf-8")).hexdigest()[:12]
+
+@lru_cache(maxsize=4)
+def letterhead_layout(date: str) -> _BlockLayout:
+    """Mise en page de l'en-tête pour une date de lettre (une par jour)"""
+    return _BlockLayout(get_reportlab_letterhead(), {"date_lettre": date})
+
+@lru_cache(maxsize=None)
+def body_layout() -> list:
+    """
+    Corps de la lettre: bloc mis en page une fois pour chaque paragraphe sans champ
+    variable (formules, signature...), gabarit à rendre pour les autres
+    """
+    return [(_BlockLayout([(style, template, space_after)], {}), None, None, 0) if not template.fields
+            else (None, style, template, space_after)
+            for style, template, space_after in get_reportlab_template()]
+
+class StaticBlock(Flowable):
+    """Bloc statique, dessiné une fois par document en form XObject puis référencé"""
+
+    def __init__(self, layout: _BlockLayout):
+        super().__init__()
+        self.layout = layout
+        self.spaceAfter = layout.space_after
+
+    def wrap(self, availWidth, availHeight):
+        return FRAME_WIDTH, self.layout.height
+
+    def draw(self):
+        canv = self.canv
+        name = self.layout.name
+        if not canv.hasForm(name):
+            canv.beginForm(name, lowerx=0, lowery=0, upperx=FRAME_WIDTH, uppery=self.layout.height)
+            with _draw_lock:
+                for paragraph, y in self.layout.placements:
+                    paragraph.drawOn(canv, 0, y)
+            canv.endForm()
+        canv.doForm(name)
+
+def render_letter(fields: dict, output) -> None:
+    """
+    Rend la lettre ReportLab.
+
+    Args:
+        fields (dict): Champs variables (cf. letter_templates.LETTER_FIELDS)
+        output: Chemin du PDF ou fichier binaire (io.BytesIO...)
+    """
+    styles = letter_styles()
+    doc = SimpleDocTemplate(output, pagesize=A4, leftMargin=MARGIN, rightMargin=MARGIN,
+                            topMargin=MARGIN, bottomMargin=MARGIN)
+    story = [StaticBlock(letterhead_layout(fields["date_lettre"]))]
+    for layout, style, template, space_after in body_layout():
+        if layout is not None:
+            story.append(StaticBlock(layout))
+            continue
+        story.append(Paragraph(template.render(fields), styles[style]))
+        if space_after:
+            story.append(Spacer(1, space_after * cm))
+    doc.build(story)
+
+def _render_letter_uncached(fields: dict, output) -> None:
+    """Rendu d'avant (styles reconstruits et en-tête remis en page à chaque lettre), pour la mesure"""
+    styles = getSampleStyleSheet()
+    paragraph_styles = {
+        "normal": styles["Normal"],
+        "header": ParagraphStyle("HeaderStyle", parent=styles["Normal"], alignment=TA_LEFT, spaceAfter=12, fontName="Helvetica-Bold"),
+        "right": ParagraphStyle("DateRightStyle", parent=styles["Normal"], alignment=TA_RIGHT, spaceAfter=12, fontName="Helvetica-Bold"),
+    }
+    doc = SimpleDocTemplate(output, pagesize=A4, leftMargin=MARGIN, rightMargin=MARGIN,
+                            topMargin=MARGIN, bottomMargin=MARGIN)
+    story = []
+    for style, template, space_after in get_reportlab_letterhead() + get_reportlab_template():
+        story.append(Paragraph(template.render(fields), paragraph_styles[style]))
+        if space_after:
+            story.append(Spacer(1, space_after * cm))
+    doc.build(story)
+
+def benchmark(letters: int = 200) -> dict:
+    """Lettres par seconde avec l'ancien rendu et avec le rendu en cache (en mémoire, sans disque)"""
+    from letter_templates import date_lettre
+
+    fields = {"nom_client": "Jean DUPONT", "adresse_client": "12 rue de la Paix, 75002 Paris",
+              "numero_avis": "12345678901234", "date_infraction": "15/01/2024 14h30",
+              "date_lettre": date_lettre()}
+    results = {}
+    # Mêmes réglages ReportLab pour les deux rendus: seul le travail mis en cache est mesuré
+    for label, render in (("before", _render_letter_uncached), ("after", render_letter)):
+        render(fields, io.BytesIO())
+        started_at = time.perf_counter()
+        for _ in range(letters):
+            render(fields, io.BytesIO())
+        results[label] = letters / (time.perf_counter() - started_at)
+    return {"letters": letters, "before_per_second": round(results["before"], 1),
+            "after_per_second": round(results["after"], 1),
+            "speedup": round(results["after"] / results["before"], 2)}
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    letters = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[1] == "--benchmark" else 200
+    print(json.dumps(benchmark(letters), indent=2))
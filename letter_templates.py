@@ -0,0 +1,300 @@
+"""
+Gabarits des lettres de contestation, communs à tous les moteurs de rendu
+
+Le texte de la lettre est écrit une seule fois (LETTER_TEXTS, MOTIFS); chaque moteur
+(LaTeX, HTML, ReportLab) n'a qu'un squelette de mise en forme qui y fait référence.
+Syntaxe des squelettes:
+    @{nom}   texte statique de LETTER_TEXTS, échappé une fois à la compilation
+    ${nom}   champ variable de la tâche (nom du client, numéro d'avis...), échappé à chaque lettre
+
+Un gabarit est compilé une fois par moteur et gardé en mémoire: le texte statique est
+déjà échappé et assemblé, seuls les champs variables sont échappés et insérés pour
+chaque lettre. Les données extraites ne peuvent donc pas casser la mise en forme (un
+"&" ou un "_" dans une adresse faisait échouer la compilation LaTeX).
+"""
+
+import html
+import re
+from datetime import datetime
+from functools import lru_cache
+
+_FIELD = re.compile(r"\$\{(\w+)\}")
+_STATIC = re.compile(r"@\{(\w+)\}")
+
+# Texte de la lettre, identique pour tous les moteurs
+LETTER_TEXTS = {
+    "avocat_nom": "Maître Yoann LEROUGE",
+    "avocat_cabinet": "Cabinet YSL",
+    "avocat_rue": "74 rue du Faubourg Saint-Denis",
+    "avocat_ville": "75010 PARIS",
+    "destinataire": "L'Officier du Ministère Public",
+    "destinataire_service": "CONTESTATION VITESSE",
+    "destinataire_cs": "CS41101",
+    "destinataire_ville": "35911 RENNES CEDEX 9",
+    "lieu": "Paris,",
+    "date": "le ${date_lettre}",
+    "objet": "Objet : Contestation d'un procès-verbal pour excès de vitesse",
+    "reference": "Avis de contravention n° ${numero_avis}",
+    "salutation": "Madame, Monsieur l'Officier du Ministère Public,",
+    "mandat": (
+        "En qualité de représentant de ${nom_client}, domicilié au ${adresse_client}, j'ai été mandaté pour "
+        "contester l'avis de contravention n° ${numero_avis} reçu en date du ${date_infraction}, "
+        "concernant un excès de vitesse supposé commis à cette occasion."
+    ),
+    "conducteur": (
+        "En tant que propriétaire du véhicule responsable de l'infraction, mon client a été présumé en "
+        "être le conducteur au moment des faits. Toutefois, mon client conteste être le conducteur au "
+        "moment de la réalisation de l'infraction. De plus, la photographie prise (ci-jointe) ne permet pas "
+        "d'identifier le conducteur."
+    ),
+    "annulation": "En conséquence, je sollicite l'annulation de ce procès-verbal pour les raisons évoquées.",
+    "attente": "Dans l'attente de votre retour, je vous remercie pour l'examen attentif de la demande.",
+}
+
+LETTER_FIELDS = ("nom_client", "adresse_client", "numero_avis", "date_infraction", "date_lettre")
+
+# Motifs de contestation (titre, texte), selon que le conducteur est visible ou non sur le cliché
+MOTIFS = {
+    True: [
+        ("Défaut de signalisation", "La signalisation du contrôle radar n'était pas conforme aux dispositions réglementaires en vigueur."),
+        ("Conditions de circulation", "Les conditions de circulation au moment des faits ne permettaient pas le respect de la limitation de vitesse en toute sécurité."),
+        ("Calibrage de l'appareil", "Je conteste la fiabilité de l'appareil de contrôle et demande la production du certificat de vérification périodique."),
+        ("Erreur sur la personne", "Je n'étais pas le conducteur du véhicule au moment des faits reprochés."),
+        ("Vice de procédure", "La procédure de constatation de l'infraction présente des irrégularités substantielles."),
+    ],
+    False: [
+        ("Impossibilité d'identification du conducteur", "La photographie jointe à l'avis de contravention ne permet pas d'identifier clairement le conducteur du véhicule au moment des faits."),
+        ("Défaut de preuve", "En application de l'article 529-2 du Code de procédure pénale, l'administration doit apporter la preuve de l'infraction. La photo fournie ne constitue pas une preuve suffisante de mon implication personnelle."),
+        ("Principe de la présomption d'innocence", "Conformément à l'article 9 de la Déclaration des droits de l'homme et du citoyen, toute personne est présumée innocente jusqu'à ce que sa culpabilité soit établie."),
+        ("Qualité de la photographie", "La qualité de l'image ne permet pas une identification formelle et certaine du conducteur, rendant impossible l'établissement de ma responsabilité."),
+        ("Usage possible du véhicule par un tiers", "Le véhicule aurait pu être utilisé par une tierce personne autorisée au moment des faits reprochés."),
+    ],
+}
+
+_MOIS = ["janvier", "février", "mars", "avril", "mai", "juin", "juillet", "août",
+         "septembre", "octobre", "novembre", "décembre"]
+
+def date_lettre(date: datetime = None) -> str:
+    """Date de la lettre en français (ex: 3 mars 2025), indépendamment de la locale du serveur"""
+    date = date or datetime.now()
+    return f"{date.day} {_MOIS[date.month - 1]} {date.year}"
+
+# Échappement par moteur
+
+_LATEX_SPECIALS = {
+    "\\": r"\textbackslash{}", "&": r"\&", "%": r"\%", "$": r"\$", "#": r"\#", "_": r"\_",
+    "{": r"\{", "}": r"\}", "~": r"\textasciitilde{}", "^": r"\textasciicircum{}",
+}
+_LATEX_SPECIAL = re.compile(r"[\\&%$#_{}~^]")
+
+def escape_latex(text: str) -> str:
+    return _LATEX_SPECIAL.sub(lambda match: _LATEX_SPECIALS[match.group(0)], text)
+
+def escape_html(text: str) -> str:
+    return html.escape(text, quote=False)
+
+def escape_reportlab(text: str) -> str:
+    # Les paragraphes ReportLab sont du balisage XML (<b>, <br/>...)
+    return html.escape(text, quote=False)
+
+ESCAPERS = {"latex": escape_latex, "html": escape_html, "reportlab": escape_reportlab}
+
+class CompiledTemplate:
+    """Squelette compilé: segments statiques déjà échappés et noms des champs variables"""
+
+    def __init__(self, skeleton: str, escape):
+        self.escape = escape
+        expanded = _STATIC.sub(lambda match: self._escape_static(LETTER_TEXTS[match.group(1)]), skeleton)
+        # Alternance texte statique / nom de champ: [statique, champ, statique, champ, ..., statique]
+        self.segments = _FIELD.split(expanded)
+        self.fields = set(self.segments[1::2])
+
+    def _escape_static(self, text: str) -> str:
+        # Le texte statique est échappé, les champs qu'il contient sont gardés pour le rendu
+        parts = _FIELD.split(text)
+        return "".join(self.escape(part) if i % 2 == 0 else f"${{{part}}}" for i, part in enumerate(parts))
+
+    def render(self, values: dict) -> str:
+        segments = self.segments
+        rendered = [segments[0]]
+        for i in range(1, len(segments), 2):
+            rendered.append(self.escape(str(values.get(segments[i], "N/A"))))
+            rendered.append(segments[i + 1])
+        return "".join(rendered)
+
+HTML_SKELETON = """
+<!DOCTYPE html>
+<html lang="fr">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Contestation de Contravention</title>
+    <style>
+        @media print {
+            body { margin: 0; }
+            .page-break { page-break-before: always; }
+        }
+
+        body {
+            font-family: 'Times New Roman', serif;
+            font-size: 12pt;
+            line-height: 1.6;
+            max-width: 21cm;
+            margin: 2.5cm auto;
+            padding: 0 2.5cm;
+            color: #000;
+        }
+
+        .header-avocat {
+            text-align: left;
+            margin-bottom: 0.6cm;
+        }
+
+        .destinataire-date {
+            text-align: right;
+            margin-bottom: 0.6cm;
+        }
+
+        .objet {
+            margin-bottom: 0.3cm;
+        }
+
+        .corps {
+            text-align: justify;
+            margin-bottom: 0.3cm;
+        }
+
+        .signature {
+            text-align: right;
+            margin-top: 1.2cm;
+        }
+
+        .bold {
+            font-weight: bold;
+        }
+    </style>
+</head>
+<body>
+    <div class="header-avocat">
+        <strong>@{avocat_nom}</strong><br>
+        @{avocat_cabinet}<br>
+        @{avocat_rue}<br>
+        @{avocat_ville}
+    </div>
+
+    <div class="destinataire-date">
+        <strong>@{destinataire}</strong><br>
+        @{destinataire_service}<br>
+        @{destinataire_cs}<br>
+        @{destinataire_ville}<br><br>
+        <strong>@{lieu}</strong> @{date}
+    </div>
+
+    <div class="objet">
+        <strong>@{objet}</strong><br>
+        <em>@{reference}</em>
+    </div>
+
+    <p class="corps">@{salutation}</p>
+
+    <p class="corps">@{mandat}</p>
+
+    <p class="corps">@{conducteur}</p>
+
+    <p class="corps">@{annulation}</p>
+
+    <p class="corps">@{attente}</p>
+
+    <div class="signature">
+        <strong>@{avocat_nom}</strong>
+    </div>
+</body>
+</html>
+"""
+
+# Corps du document LaTeX, après le préambule statique (LATEX_PREAMBLE de generate_letter)
+LATEX_BODY_SKELETON = r"""\begin{document}
+% En-tête avocat
+\noindent
+\textbf{@{avocat_nom}} \\
+@{avocat_cabinet} \\
+@{avocat_rue} \\
+@{avocat_ville}
+\vspace{0.6cm}
+% Bloc destinataire + date dans un seul bloc décalé de 10 cm
+\noindent
+
+\hspace*{10cm}%
+\begin{minipage}{7cm}
+\textbf{@{destinataire}} \\
+\normalsize @{destinataire_service}\\@{destinataire_cs}\\@{destinataire_ville} \\
+\vspace{0.4cm} \\
+\textbf{@{lieu}} @{date}
+\end{minipage}
+\vspace{0.6cm}
+% Objet
+\noindent
+\textbf{@{objet}} \\
+\vspace{0.15cm}
+\textit{@{reference}} \\[0.3cm]
+@{salutation} \\
+@{mandat}
+@{conducteur}
+@{annulation}
+@{attente}
+\vspace{1.2cm}
+% Bloc nom avocat + signature décalé de 10 cm
+\noindent
+\hspace*{10cm}%
+\begin{minipage}{7cm}
+\textbf{@{avocat_nom}} \\
+\end{minipage}
+\end{document}"""
+
+# En-tête ReportLab (avocat, destinataire et date), mis en page une fois: (style, squelette, espace après en cm)
+REPORTLAB_LETTERHEAD_SKELETON = [
+    ("header", "<b>@{avocat_nom}</b><br/>@{avocat_cabinet}<br/>@{avocat_rue}<br/>@{avocat_ville}", 0.6),
+    ("right", "<b>@{destinataire}</b><br/>@{destinataire_service}<br/>@{destinataire_cs}<br/>@{destinataire_ville}<br/><br/><b>@{lieu}</b> @{date}", 0.6),
+]
+
+# Paragraphes ReportLab après l'en-tête: (style, squelette, espace après en cm)
+REPORTLAB_SKELETON = [
+    ("normal", "<b>@{objet}</b><br/><i>@{reference}</i>", 0.3),
+    ("normal", "@{salutation}", 0.3),
+    ("normal", "@{mandat}", 0.3),
+    ("normal", "@{conducteur}", 0.3),
+    ("normal", "@{annulation}", 0.3),
+    ("normal", "@{attente}", 1.2),
+    ("right", "<b>@{avocat_nom}</b>", 0),
+]
+
+MOTIF_SKELETONS = {
+    "latex": r"\textbf{${titre} :} ${texte}",
+    "html": "<b>${titre} :</b> ${texte}",
+    "reportlab": "<b>${titre} :</b> ${texte}",
+}
+
+@lru_cache(maxsize=None)
+def get_template(backend: str) -> CompiledTemplate:
+    """Gabarit compilé de la lettre pour "latex" (corps seul) ou "html", compilé au premier appel"""
+    skeleton = {"latex": LATEX_BODY_SKELETON, "html": HTML_SKELETON}[backend]
+    return CompiledTemplate(skeleton, ESCAPERS[backend])
+
+@lru_cache(maxsize=None)
+def get_reportlab_template() -> list:
+    """Paragraphes compilés du corps de la lettre ReportLab: [(style, gabarit, espace après en cm)]"""
+    return [(style, CompiledTemplate(skeleton, escape_reportlab), space) for style, skeleton, space in REPORTLAB_SKELETON]
+
+@lru_cache(maxsize=None)
+def get_reportlab_letterhead() -> list:
+    """Paragraphes compilés de l'en-tête ReportLab (seul champ variable: date_lettre)"""
+    return [(style, CompiledTemplate(skeleton, escape_reportlab), space) for style, skeleton, space in REPORTLAB_LETTERHEAD_SKELETON]
+
+@lru_cache(maxsize=None)
+def _motif_template(backend: str) -> CompiledTemplate:
+    return CompiledTemplate(MOTIF_SKELETONS[backend], ESCAPERS[backend])
+
+def render_motifs(backend: str, driver_visible: bool) -> list:
+    """Motifs de contestation mis en forme pour un moteur"""
+    template = _motif_template(backend)
+    return [template.render({"titre": titre, "texte": texte}) for titre, texte in MOTIFS[bool(driver_visible)]]
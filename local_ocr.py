@@ -0,0 +1,231 @@
+"""
+Local extraction of standardized printed documents, without the model.
+
+The avis de contravention and the certificat d'immatriculation are printed forms with
+fixed labels ("Vitesse mesurée", "A", "D.1"...). Their text is read locally, from the
+PDF text layer when the upload is a born-digital PDF, otherwise with Tesseract, and
+parsed with per-template regular expressions. The result is only used when every
+required field of the template is found and passes the field checks; otherwise the
+document goes to the model as usual. Nothing here needs a network connection or a
+GPU; pytesseract (and the tesseract binary with the "fra" language) and pypdf are
+optional, each missing engine is simply skipped.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+
+from field_checks import assess_extraction
+from preprocess import pdf_text_layer
+from schemas import NONE, validate_extraction
+
+logger = logging.getLogger(__name__)
+
+LOCAL_OCR_ENABLED = os.getenv("LOCAL_OCR_ENABLED", "1") == "1"
+LOCAL_OCR_DOC_TYPES = [doc_type.strip() for doc_type in os.getenv("LOCAL_OCR_DOC_TYPES", "contravention,certificat").split(",") if doc_type.strip()]
+LOCAL_OCR_LANG = os.getenv("LOCAL_OCR_LANG", "fra")
+LOCAL_OCR_DPI = int(os.getenv("LOCAL_OCR_DPI", "300"))
+LOCAL_OCR_MAX_PAGES = int(os.getenv("LOCAL_OCR_MAX_PAGES", "2"))
+
+# Bump when a template parser changes: part of the extraction cache key
+LOCAL_OCR_VERSION = "2"
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+def _page_images(file_path):
+    from PIL import Image, ImageOps
+
+    if file_path.lower().endswith(".pdf"):
+        from pdf2image import convert_from_path
+        return convert_from_path(file_path, dpi=LOCAL_OCR_DPI, first_page=1, last_page=LOCAL_OCR_MAX_PAGES)
+    with Image.open(file_path) as image:
+        return [ImageOps.exif_transpose(image).convert("L")]
+
+def tesseract_text(file_path):
+    """
+    Text of a document read with Tesseract.
+
+    Returns:
+        str | None: The text, or None when pytesseract, the tesseract binary or its
+        language data (or pdf2image for PDFs) is unavailable
+    """
+    try:
+        import pytesseract
+        return "\n".join(pytesseract.image_to_string(image, lang=LOCAL_OCR_LANG) for image in _page_images(file_path))
+    except Exception as e:
+        logger.debug(f"Tesseract unavailable for {file_path}: {str(e)}")
+        return None
+
+def _search(text, *patterns):
+    """First capture group of the first matching pattern, stripped, or "NONE"."""
+    for pattern in patterns:
+        match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
+        if match and match.group(1).strip():
+            return re.sub(r"[ \t]+", " ", match.group(1).strip())
+    return NONE
+
+def _plate(text):
+    # SIV plate, tolerating spaces instead of dashes (OCR)
+    match = re.search(r"\b([A-Z]{2})[\s-]?(\d{3})[\s-]?([A-Z]{2})\b", text)
+    return f"{match.group(1)}-{match.group(2)}-{match.group(3)}" if match else NONE
+
+def parse_contravention(text):
+    """Fields of an avis de contravention, from its text (same keys as the extraction prompt)."""
+    date_heure = NONE
+    match = re.search(r"(\d{2}/\d{2}/\d{4})\s*(?:à|a)\s*(\d{1,2})\s*[h:]\s*(\d{2})", text, re.IGNORECASE)
+    if match:
+        # Same layout as format_date (DD/MM/YYYY:HHhMM)
+        date_heure = f"{match.group(1)}:{int(match.group(2)):02d}h{match.group(3)}"
+
+    speed_limit = _search(text, r"vitesse\s+(?:limite\s+|maximale\s+)?autoris[ée]e\s*:?\s*(\d{2,3})\s*km")
+    measured = _search(text, r"vitesse\s+mesur[ée]e\s*:?\s*(\d{2,3})\s*km")
+    excess = int(measured) - int(speed_limit) if NONE not in (measured, speed_limit) else NONE
+
+    vehicle_section = re.split(r"v[ée]hicule", text, maxsplit=1, flags=re.IGNORECASE)
+    plate = _search(text, r"immatriculation\s*:?\s*([A-Z]{2}[\s-]?\d{3}[\s-]?[A-Z]{2})")
+    plate = _plate(plate if plate != NONE else vehicle_section[-1])
+
+    return {
+        "identité": {
+            "nom": _search(text, r"^\s*nom\s*:\s*(.+)$"),
+            "prenom": _search(text, r"^\s*pr[ée]noms?\s*:\s*(.+)$"),
+            "adresse": _search(text, r"^\s*adresse\s*:\s*(.+)$"),
+        },
+        "infraction": {
+            "numero_avis": _search(text, r"(?:n°|numéro)\s*(?:de\s+l['’]\s*)?avis\s*:?\s*(\d[\d ]{8,}\d)",
+                                   r"avis\s+de\s+contravention\s+n°\s*(\d[\d ]{8,}\d)").replace(" ", ""),
+            "date_heure": date_heure,
+            "format_date": "DD/MM/YYYY:HHhMM" if date_heure != NONE else NONE,
+            "route": _search(text, r"(?:lieu|route|voie)\s*:?[^\n]*?\b([ADNM]\s?\d{1,4})\b").replace(" ", ""),
+            "exces_vitesse_kmh": excess,
+            "vitesse_maximale_autorisee": speed_limit,
+            "vitesse_mesuree": measured,
+        },
+        "identification_vehicule": {
+            "immatriculation": plate,
+            "pays": _search(text, r"pays\s*:?\s*([A-Z][A-Za-z]+)"),
+            "marque": _search(text, r"marque\s*:?\s*([A-Z][A-Z\- ]*[A-Z])\s*$"),
+        },
+        "appareil_controle": {
+            "type": _search(text, r"appareil(?:\s+de\s+contr[ôo]le)?\s*:\s*(.+)$"),
+            "date_derniere_verification": _search(text, r"v[ée]rification\s*(?:le|du)?\s*:?\s*(\d{2}/\d{2}/\d{4})"),
+        },
+        "agent_verbalisateur": {
+            "agent_verbalisateur": _search(text, r"agent\s+(?:verbalisateur\s*)?(?:n°|matricule)\s*:?\s*(\d+)"),
+            "service": _search(text, r"service\s+(?:verbalisateur\s*)?:\s*(.+)$"),
+        },
+        "réglements": {
+            "date_15j": _search(text, r"(?:à compter du|à partir du)\s+(\d{2}/\d{2}/\d{4})"),
+            "adresse_demarche": _search(text, r"(?:adresser|envoyer)\b[^\n:]*:\s*(.+)$"),
+        },
+    }
+
+def parse_certificat(text):
+    """Fields of a certificat d'immatriculation, from the labelled zones (A, C.1, D.1)."""
+    owner = _search(text, r"^\s*C\.1\s*:?\s*(.+)$")
+    # C.1 is printed as "NOM PRENOM(S)"
+    owner_parts = owner.split(" ", 1) if owner != NONE else [NONE]
+    plate = _search(text, r"^\s*A\s*:?\s*([A-Z]{2}[\s-]?\d{3}[\s-]?[A-Z]{2})")
+    return {
+        "proprietaire": {"nom": owner_parts[0], "prenom": owner_parts[1] if len(owner_parts) > 1 else NONE},
+        "vehicule": {
+            "immatriculation": _plate(plate if plate != NONE else text),
+            "marque": _search(text, r"^\s*D\.1\s*:?\s*([A-Z][A-Z\-]*)"),
+        },
+    }
+
+TEMPLATES = {
+    "contravention": parse_contravention,
+    "certificat": parse_certificat,
+}
+
+# Fields without which the local result is not used (the model extracts the document instead)
+REQUIRED_FIELDS = {
+    "contravention": [
+        "identité.nom", "identité.prenom", "identité.adresse", "réglements.adresse_demarche",
+        "infraction.numero_avis", "infraction.date_heure", "infraction.route",
+        "infraction.vitesse_maximale_autorisee", "infraction.vitesse_mesuree",
+        "identification_vehicule.immatriculation",
+    ],
+    "certificat": ["proprietaire.nom", "vehicule.immatriculation", "vehicule.marque"],
+}
+
+def local_ocr_fingerprint(doc_type):
+    """Part of the extraction cache key: local results must not be reused once the engine or templates change."""
+    if not LOCAL_OCR_ENABLED or doc_type not in LOCAL_OCR_DOC_TYPES or doc_type not in TEMPLATES:
+        return "off"
+    return f"local-{LOCAL_OCR_VERSION}-{LOCAL_OCR_LANG}"
+
+def _parse(doc_type, text):
+    """Parsed and normalized data, and the required fields that are missing or invalid."""
+    data, errors = validate_extraction(doc_type, TEMPLATES[doc_type](text))
+    if errors:
+        return None, [error["path"] for error in errors]
+    fields = assess_extraction(doc_type, data)["fields"]
+    return data, [path for path in REQUIRED_FIELDS[doc_type] if fields[path]["status"] not in ("valid", "present")]
+
+def extract_locally(doc_type, file_path):
+    """
+    Extract a document without the model, when its template allows it.
+
+    Args:
+        doc_type (str): contravention, permis, certificat or domicile
+        file_path (str): Path to the image or PDF file
+
+    Returns:
+        dict | None: Extracted data (same keys as the extraction prompts), or None when the
+        document type has no template, no engine is available or required fields are missing
+    """
+    if not LOCAL_OCR_ENABLED or doc_type not in LOCAL_OCR_DOC_TYPES or doc_type not in TEMPLATES:
+        return None
+
+    missing = None
+    started_at = time.monotonic()
+    engines = [("text_layer", lambda path: pdf_text_layer(path, LOCAL_OCR_MAX_PAGES))] if file_path.lower().endswith(".pdf") else []
+    for engine, read_text in engines + [("tesseract", tesseract_text)]:
+        text = read_text(file_path)
+        if text is None:
+            continue
+        data, missing = _parse(doc_type, text)
+        if not missing:
+            logger.info(f"{doc_type} extracted locally ({engine})")
+            _record(doc_type, engine, duration=time.monotonic() - started_at)
+            return data
+        logger.info(f"Local {doc_type} extraction ({engine}) incomplete, missing: {', '.join(missing)}")
+
+    _record(doc_type, None, missing, duration=time.monotonic() - started_at)
+    return None
+
+def _record(doc_type, engine, missing=None, duration=0.0):
+    with _stats_lock:
+        stats = _stats.setdefault(doc_type, {
+            "attempts": 0, "text_layer": 0, "tesseract": 0, "fallbacks": 0, "no_engine": 0,
+            "total_seconds": 0.0, "missing_fields": {}
+        })
+        stats["attempts"] += 1
+        # Time spent locally, including attempts that end up going to the model
+        stats["total_seconds"] += duration
+        if engine:
+            stats[engine] += 1
+        elif missing is None:
+            stats["no_engine"] += 1
+        else:
+            stats["fallbacks"] += 1
+            for path in missing:
+                stats["missing_fields"][path] = stats["missing_fields"].get(path, 0) + 1
+
+def get_local_ocr_stats():
+    """
+    Return how many documents were extracted locally, per document type and engine.
+
+    Returns:
+        dict: {doc_type: {"attempts", "text_layer", "tesseract", "fallbacks", "no_engine",
+               "total_seconds", "average_seconds", "missing_fields": {path: count}}}
+    """
+    with _stats_lock:
+        return {doc_type: {**stats, "average_seconds": stats["total_seconds"] / stats["attempts"],
+                           "missing_fields": dict(stats["missing_fields"])}
+                for doc_type, stats in _stats.items()}
@@ -0,0 +1,300 @@
+"""
+Document preprocessing before OCR.
+
+Phone photos and multi-page scans are much larger than what the extraction needs.
+Images are auto-rotated from their EXIF orientation, downsized to a maximum long
+edge and recompressed as (optionally grayscale) JPEG. Born-digital PDFs (bills,
+notices) are replaced by their compact text layer; other PDFs are rasterized page by
+page with pdf2image (requires poppler), or reduced to their first pages with pypdf
+when rasterization is unavailable. Byte and estimated image-token savings are logged
+per document and aggregated per document type.
+"""
+
+import base64
+import io
+import logging
+import math
+import os
+import re
+import threading
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+PREPROCESS_ENABLED = os.getenv("PREPROCESS_ENABLED", "1") == "1"
+PREPROCESS_MAX_LONG_EDGE = int(os.getenv("PREPROCESS_MAX_LONG_EDGE", "1568"))
+PREPROCESS_GRAYSCALE = os.getenv("PREPROCESS_GRAYSCALE", "1") == "1"
+PREPROCESS_JPEG_QUALITY = int(os.getenv("PREPROCESS_JPEG_QUALITY", "80"))
+PREPROCESS_PDF_DPI = int(os.getenv("PREPROCESS_PDF_DPI", "150"))
+PREPROCESS_PDF_MAX_PAGES = int(os.getenv("PREPROCESS_PDF_MAX_PAGES", "2"))
+PREPROCESS_RASTERIZE_PDF = os.getenv("PREPROCESS_RASTERIZE_PDF", "1") == "1"
+# Born-digital PDFs are sent as their compact text layer instead of page images
+PREPROCESS_PDF_TEXT = os.getenv("PREPROCESS_PDF_TEXT", "1") == "1"
+# Below this many characters, a PDF text layer is considered absent (scanned PDF); above the maximum, the pages are sent
+PDF_TEXT_MIN_CHARS = int(os.getenv("PDF_TEXT_MIN_CHARS", "200"))
+PDF_TEXT_MAX_CHARS = int(os.getenv("PDF_TEXT_MAX_CHARS", "20000"))
+
+# The API downsizes larger images itself and bills roughly width * height / 750 tokens
+API_MAX_LONG_EDGE = 1568
+API_MAX_PIXELS = 1_150_000
+PIXELS_PER_TOKEN = 750
+
+# Rough cost of one PDF page sent as a document (page image + extracted text)
+PDF_PAGE_TOKENS_ESTIMATE = 2500
+
+# French text averages about 3.5 characters per token
+CHARS_PER_TOKEN = 3.5
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+API_IMAGE_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp')
+EXIF_ORIENTATION = 0x0112
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+def preprocessing_fingerprint():
+    """Settings that change what the model sees; part of the extraction cache key."""
+    if not PREPROCESS_ENABLED:
+        return "raw"
+    return (f"{PREPROCESS_MAX_LONG_EDGE}|{PREPROCESS_GRAYSCALE}|{PREPROCESS_JPEG_QUALITY}|"
+            f"{PREPROCESS_PDF_DPI}|{PREPROCESS_PDF_MAX_PAGES}|{PREPROCESS_RASTERIZE_PDF}|"
+            f"{PREPROCESS_PDF_TEXT}|{PDF_TEXT_MIN_CHARS}|{PDF_TEXT_MAX_CHARS}")
+
+def estimate_image_tokens(width, height):
+    """
+    Estimate the input tokens billed for an image, after the API's own downsizing.
+
+    Args:
+        width (int): Image width in pixels
+        height (int): Image height in pixels
+
+    Returns:
+        int: Estimated token count
+    """
+    scale = min(1.0, API_MAX_LONG_EDGE / max(width, height), math.sqrt(API_MAX_PIXELS / (width * height)))
+    return math.ceil((width * scale) * (height * scale) / PIXELS_PER_TOKEN)
+
+def _encode(data, media_type):
+    return {"base64_data": base64.b64encode(data).decode('utf-8'), "media_type": media_type}
+
+def _compress_image(image):
+    """Resize and recompress a PIL image; returns (jpeg_bytes, width, height)."""
+    if PREPROCESS_GRAYSCALE:
+        image = image.convert("L")
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    long_edge = max(image.size)
+    if long_edge > PREPROCESS_MAX_LONG_EDGE:
+        ratio = PREPROCESS_MAX_LONG_EDGE / long_edge
+        image = image.resize(
+            (max(1, round(image.width * ratio)), max(1, round(image.height * ratio))),
+            Image.LANCZOS,
+        )
+
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=PREPROCESS_JPEG_QUALITY, optimize=True)
+    return output.getvalue(), image.width, image.height
+
+def _preprocess_image(raw):
+    with Image.open(io.BytesIO(raw)) as original:
+        media_type = Image.MIME.get(original.format)
+        tokens_before = estimate_image_tokens(*original.size)
+        needs_rotation = original.getexif().get(EXIF_ORIENTATION, 1) != 1
+        needs_resize = max(original.size) > PREPROCESS_MAX_LONG_EDGE
+        processed, width, height = _compress_image(ImageOps.exif_transpose(original))
+
+    if len(processed) >= len(raw) and not needs_rotation and not needs_resize and media_type in API_IMAGE_TYPES:
+        # Already compact and small enough (e.g. small PNG): sending it unchanged is cheaper
+        return [_encode(raw, media_type)], tokens_before, tokens_before, len(raw)
+    return [_encode(processed, "image/jpeg")], tokens_before, estimate_image_tokens(width, height), len(processed)
+
+def _rasterize_pdf(file_path):
+    """Render the first pages of a PDF as images; None when pdf2image/poppler is unavailable."""
+    if not PREPROCESS_RASTERIZE_PDF:
+        return None
+    try:
+        from pdf2image import convert_from_path
+        return convert_from_path(
+            file_path, dpi=PREPROCESS_PDF_DPI, first_page=1, last_page=PREPROCESS_PDF_MAX_PAGES
+        )
+    except Exception as e:
+        logger.debug(f"PDF rasterization unavailable for {file_path}: {str(e)}")
+        return None
+
+def _select_pdf_pages(raw):
+    """Keep only the first pages of a PDF; returns (pdf_bytes, total_pages, kept_pages)."""
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError:
+        return raw, None, None
+
+    reader = PdfReader(io.BytesIO(raw))
+    total_pages = len(reader.pages)
+    if total_pages <= PREPROCESS_PDF_MAX_PAGES:
+        return raw, total_pages, total_pages
+
+    writer = PdfWriter()
+    for page in reader.pages[:PREPROCESS_PDF_MAX_PAGES]:
+        writer.add_page(page)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue(), total_pages, PREPROCESS_PDF_MAX_PAGES
+
+def _page_count(raw):
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(io.BytesIO(raw)).pages)
+    except Exception:
+        return None
+
+def pdf_text_layer(file_path, max_pages=PREPROCESS_PDF_MAX_PAGES):
+    """
+    Embedded text of the first pages of a PDF, with blank lines and repeated spaces removed.
+
+    Returns:
+        str | None: The text, or None when pypdf is unavailable, the file cannot be read
+        or the PDF has no meaningful text layer (scanned document)
+    """
+    try:
+        from pypdf import PdfReader
+        reader = PdfReader(file_path)
+        text = "\n".join(page.extract_text() or "" for page in reader.pages[:max_pages])
+    except Exception as e:
+        logger.debug(f"No PDF text layer for {file_path}: {str(e)}")
+        return None
+    lines = (re.sub(r"\s+", " ", line).strip() for line in text.splitlines())
+    text = "\n".join(line for line in lines if line)
+    return text if len(text.replace(" ", "").replace("\n", "")) >= PDF_TEXT_MIN_CHARS else None
+
+def _pdf_text(file_path, raw):
+    """The PDF as its text layer (media type text/plain), or None to send the pages."""
+    if not PREPROCESS_PDF_TEXT:
+        return None
+    text = pdf_text_layer(file_path)
+    if text is None or len(text) > PDF_TEXT_MAX_CHARS:
+        return None
+    encoded = text.encode("utf-8")
+    tokens_before = (_page_count(raw) or 1) * PDF_PAGE_TOKENS_ESTIMATE
+    return [{"text": text, "media_type": "text/plain"}], tokens_before, math.ceil(len(text) / CHARS_PER_TOKEN), len(encoded)
+
+def _preprocess_pdf(file_path, raw):
+    text = _pdf_text(file_path, raw)
+    if text:
+        return text
+    
+    pages = _rasterize_pdf(file_path)
+    if pages:
+        total_pages = _page_count(raw) or len(pages)
+        tokens_before = total_pages * PDF_PAGE_TOKENS_ESTIMATE
+        documents, tokens_after, processed_bytes = [], 0, 0
+        for page in pages:
+            processed, width, height = _compress_image(page)
+            documents.append(_encode(processed, "image/jpeg"))
+            tokens_after += estimate_image_tokens(width, height)
+            processed_bytes += len(processed)
+        return documents, tokens_before, tokens_after, processed_bytes
+
+    processed, total_pages, kept_pages = _select_pdf_pages(raw)
+    tokens_before = (total_pages or 1) * PDF_PAGE_TOKENS_ESTIMATE
+    tokens_after = (kept_pages or 1) * PDF_PAGE_TOKENS_ESTIMATE
+    return [_encode(processed, "application/pdf")], tokens_before, tokens_after, len(processed)
+
+def preprocess_document(file_path, doc_type=None):
+    """
+    Prepare a document for the vision model.
+
+    Args:
+        file_path (str): Path to the image or PDF file
+        doc_type (str, optional): Document type, used to aggregate statistics
+
+    Returns:
+        dict: {
+            "documents": [{"base64_data": str, "media_type": str}, ...]
+                (or [{"text": str, "media_type": "text/plain"}] for a PDF with a text layer),
+            "stats": {"original_bytes", "processed_bytes", "estimated_tokens_before", "estimated_tokens_after"}
+        }
+
+    Raises:
+        Exception: If the file cannot be read or decoded
+    """
+    _, ext = os.path.splitext(file_path.lower())
+    with open(file_path, "rb") as file:
+        raw = file.read()
+
+    if ext == ".pdf":
+        documents, tokens_before, tokens_after, processed_bytes = _preprocess_pdf(file_path, raw)
+    elif ext in IMAGE_EXTENSIONS:
+        documents, tokens_before, tokens_after, processed_bytes = _preprocess_image(raw)
+    else:
+        raise Exception(f"Unsupported file format: {ext}")
+
+    stats = {
+        "original_bytes": len(raw),
+        "processed_bytes": processed_bytes,
+        "estimated_tokens_before": tokens_before,
+        "estimated_tokens_after": tokens_after,
+    }
+    _record_stats(doc_type or "unknown", stats)
+    logger.info(
+        f"Preprocessed {doc_type or file_path}: {len(raw)} -> {processed_bytes} bytes, "
+        f"~{tokens_before} -> ~{tokens_after} image tokens"
+    )
+    return {"documents": documents, "stats": stats}
+
+def crop_document(file_path, box, page=0):
+    """
+    Crop a region of a document, e.g. to re-read a single field at a higher resolution.
+
+    Args:
+        file_path (str): Path to the image or PDF file
+        box (tuple): (left, top, right, bottom) as fractions of the page size, between 0 and 1
+        page (int): Page of a PDF to crop from (0-based)
+
+    Returns:
+        list: [{"base64_data": str, "media_type": "image/jpeg"}]
+
+    Raises:
+        ValueError: If the box is not a valid region
+        Exception: If the file cannot be decoded or the PDF cannot be rasterized
+    """
+    left, top, right, bottom = box
+    if not (0 <= left < right <= 1 and 0 <= top < bottom <= 1):
+        raise ValueError(f"Invalid crop box: {box}")
+
+    _, ext = os.path.splitext(file_path.lower())
+    if ext == ".pdf":
+        pages = _rasterize_pdf(file_path)
+        if not pages or page >= len(pages):
+            raise Exception(f"Cannot rasterize page {page + 1} of {file_path} (pdf2image/poppler unavailable?)")
+        image = pages[page]
+    elif ext in IMAGE_EXTENSIONS:
+        with Image.open(file_path) as original:
+            image = ImageOps.exif_transpose(original)
+            image.load()
+    else:
+        raise Exception(f"Unsupported file format: {ext}")
+
+    width, height = image.size
+    region = image.crop((round(left * width), round(top * height), round(right * width), round(bottom * height)))
+    processed, _, _ = _compress_image(region)
+    return [_encode(processed, "image/jpeg")]
+
+def _record_stats(doc_type, stats):
+    with _stats_lock:
+        totals = _stats.setdefault(doc_type, {"documents": 0, **{key: 0 for key in stats}})
+        totals["documents"] += 1
+        for key, value in stats.items():
+            totals[key] += value
+
+def get_preprocessing_stats():
+    """
+    Return the cumulated byte and token savings per document type.
+
+    Returns:
+        dict: {doc_type: {"documents", "original_bytes", "processed_bytes",
+               "estimated_tokens_before", "estimated_tokens_after"}}
+    """
+    with _stats_lock:
+        return {doc_type: dict(totals) for doc_type, totals in _stats.items()}
@@ -0,0 +1,196 @@
+"""
+Versioned registry of the extraction prompt templates.
+
+The four extraction prompts are long, static instruction blocks with a JSON schema.
+They are assembled into a single shared system prompt, marked for provider-side prompt
+caching. The cached prefix is the tool list followed by the system prompt: both are
+the same for every single-document extraction and re-extraction whatever the document
+type (schemas.extraction_tools() carries every extraction tool, tool_choice selects
+one), so after the first call the prefix is read from the cache instead of being
+processed again. Each call only adds the document itself and a one-line instruction
+naming its template. The batched request has its own tool and caches separately.
+
+The tools (about 2k tokens) are what takes the prefix past the minimum cacheable
+length of the fast model (2048 tokens for Haiku, 1024 for Sonnet): the system prompt
+alone (about 1.3k tokens) is only cached by SCAN_MODEL.
+
+Any change to a template or to the shared preamble changes prompt_version(), which
+is part of the extraction cache key, so cached extractions made with an older prompt
+are never reused.
+"""
+
+import hashlib
+import os
+
+from schemas import TOOL_NAMES, schema_fingerprint
+
+PROMPT_CACHING_ENABLED = os.getenv("PROMPT_CACHING_ENABLED", "1") == "1"
+
+# Bump when the shared preamble or the way templates are assembled changes
+PROMPT_REGISTRY_VERSION = "2"
+
+# Extraction prompts, one per document type
+CONTRAVENTION_PROMPT = """Analyse cette image d'avis de contravention français et extrais les informations suivantes au format JSON strict. Si une information n'est pas disponible, utilise "NONE".
+
+Structure JSON attendue:
+{
+  "identité": {
+    "nom": "nom de la personne verbalisée",
+    "prenom": "prénom de la personne verbalisée",
+    "adresse": "adresse de la personne verbalisée (ex:)"
+  },
+  "infraction": {
+    "numero_avis": "numéro de l'avis de contravention",
+    "date_heure": "date et heure de l'infraction (format exact trouvé)",
+    "format_date": "DD/MM/YYYY:HHhMM",
+    "route": "nom de la route (ex: D938, A10, etc.)",
+    "exces_vitesse_kmh": nombre (vitesse mesurée - vitesse autorisée),
+    "vitesse_maximale_autorisee": nombre,
+    "vitesse_mesuree": nombre
+  },
+  "identification_vehicule": {
+    "immatriculation": "numéro d'immatriculation",
+    "pays": "pays d'immatriculation",
+    "marque": "marque du véhicule"
+  },
+  "appareil_controle": {
+    "type": "type d'appareil de contrôle",
+    "date_derniere_verification": "date de dernière vérification"
+  },
+  "agent_verbalisateur": {
+    "agent_verbalisateur": "Numéro de l'agent verbalisateur",
+    "service": "nom du service verbalisateur"
+  },
+  "réglements": {
+      "date_15j": "date à compter de laquelle la personne doit payer dans les 15 jours",
+      "adresse_demarche": "Adresse à laquelle adresser requêtes par lettre recommandée"
+  }
+}
+
+Retourne UNIQUEMENT le JSON, sans commentaire ni explication. Si l'information est indisponible, return NONE."""
+
+PERMIS_PROMPT = """Analyse cette image de permis de conduire français et extrais les informations suivantes au format JSON strict. Si une information n'est pas disponible, utilise "NONE".
+
+Structure JSON attendue:
+{
+  "identite": {
+    "nom": "nom de famille",
+    "prenom": "prénom(s)",
+    "date_naissance": "DD/MM/YYYY",
+    "lieu_naissance": "ville et pays de naissance"
+  },
+  "permis": {
+    "numero_permis": "numéro du permis",
+    "date_delivrance": "DD/MM/YYYY",
+    "date_expiration": "DD/MM/YYYY",
+    "autorite_delivrance": "préfecture ou autorité",
+    "categories": ["B", "A1", "etc."]
+  },
+  "adresse": {
+    "adresse_complete": "adresse complète",
+    "code_postal": "code postal",
+    "ville": "ville"
+  }
+}
+
+Retourne UNIQUEMENT le JSON, sans commentaire ni explication."""
+
+CERTIFICAT_PROMPT = """Analyse cette image de certificat d'immatriculation français (carte grise) et extrais UNIQUEMENT les informations suivantes au format JSON strict. Si une information n'est pas disponible, utilise "NONE".
+
+Structure JSON attendue:
+{
+  "proprietaire": {
+    "nom": "nom de famille du propriétaire",
+    "prenom": "prénom du propriétaire"
+  },
+  "vehicule": {
+    "immatriculation": "numéro d'immatriculation au format XX-123-XX",
+    "marque": "marque du véhicule uniquement"
+  }
+}
+
+IMPORTANT: 
+- Pour l'immatriculation, cherche le format XX-123-XX (2 lettres, 3 chiffres, 2 lettres)
+- Pour la marque, donne uniquement la marque (ex: PEUGEOT, RENAULT, etc.)
+- Ne pas inclure le modèle, juste la marque
+
+Retourne UNIQUEMENT le JSON, sans commentaire ni explication."""
+
+DOMICILE_PROMPT = """Analyse cette image de justificatif de domicile français (facture, attestation, etc.) et extrais UNIQUEMENT les informations suivantes au format JSON strict. Si une information n'est pas disponible, utilise "NONE".
+
+Structure JSON attendue:
+{
+  "personne": {
+    "nom": "nom de famille de la personne",
+    "prenom": "prénom de la personne"
+  },
+  "domicile": {
+    "adresse": "adresse complète du domicile",
+    "date_justificatif": "date du justificatif (convertis au format: DD-MM-YYYY)"
+  }
+}
+
+IMPORTANT: 
+- Cherche le nom et prénom du titulaire/destinataire du document
+- Pour l'adresse, donne l'adresse complète (rue, code postal, ville)
+- Pour la date, utilise le format exact trouvé sur le document (peut être une date de facture, d'émission, etc.)
+
+Retourne UNIQUEMENT le JSON, sans commentaire ni explication."""
+
+
+SHARED_PREAMBLE = """Tu es un assistant spécialisé dans l'extraction de données de documents administratifs français, utilisé pour préparer la contestation d'avis de contravention.
+
+Chaque demande contient un ou plusieurs documents et indique le modèle d'extraction à appliquer à chacun. Applique uniquement les consignes du modèle demandé; les autres modèles ne concernent pas ce document.
+
+Les données sont transmises avec l'outil indiqué dans la demande: la structure JSON de chaque modèle décrit le contenu attendu par cet outil."""
+
+# Extraction templates per document type: version (bump on any wording change), title and text
+PROMPT_TEMPLATES = {
+    "contravention": {"version": "2", "title": "Avis de contravention", "text": CONTRAVENTION_PROMPT},
+    "permis": {"version": "1", "title": "Permis de conduire", "text": PERMIS_PROMPT},
+    "certificat": {"version": "1", "title": "Certificat d'immatriculation", "text": CERTIFICAT_PROMPT},
+    "domicile": {"version": "1", "title": "Justificatif de domicile", "text": DOMICILE_PROMPT},
+}
+
+def _shared_prompt_text():
+    sections = [SHARED_PREAMBLE]
+    for doc_type, template in PROMPT_TEMPLATES.items():
+        sections.append(f"## Modèle \"{doc_type}\" ({template['title']})\n\n{template['text']}")
+    return "\n\n".join(sections)
+
+SHARED_PROMPT = _shared_prompt_text()
+
+def get_template(doc_type):
+    """
+    Return the extraction template of a document type.
+
+    Args:
+        doc_type (str): contravention, permis, certificat or domicile
+
+    Returns:
+        dict: {"version": str, "title": str, "text": str}
+    """
+    return PROMPT_TEMPLATES[doc_type]
+
+def prompt_version(doc_type):
+    """Fingerprint of the prompt sent for a document type (shared system prompt, template and tool schemas)."""
+    template = PROMPT_TEMPLATES[doc_type]
+    fingerprint = f"{PROMPT_REGISTRY_VERSION}|{doc_type}|{template['version']}|{schema_fingerprint()}|{SHARED_PROMPT}"
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:16]
+
+def system_prompt():
+    """
+    System blocks carrying every extraction template, with a prompt caching breakpoint.
+
+    Returns:
+        list: Content blocks for the "system" argument of messages.create()
+    """
+    block = {"type": "text", "text": SHARED_PROMPT}
+    if PROMPT_CACHING_ENABLED:
+        block["cache_control"] = {"type": "ephemeral"}
+    return [block]
+
+def document_instruction(doc_type):
+    """Per-call instruction pointing the model at the template of a single document."""
+    return (f"Applique le modèle \"{doc_type}\" ({PROMPT_TEMPLATES[doc_type]['title']}) à ce document "
+            f"et transmets le résultat avec l'outil {TOOL_NAMES[doc_type]}.")
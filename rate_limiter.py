@@ -0,0 +1,403 @@
+"""
+Token-bucket rate limiting of model API usage.
+
+Every model call (document scans, validation, browser agent) takes one request and
+its estimated input tokens from two token buckets sized on the provider limits
+(LLM_REQUESTS_PER_MINUTE, LLM_INPUT_TOKENS_PER_MINUTE). The estimate is corrected
+with the real usage once the answer is received. Callers wait for capacity instead
+of tripping 429 errors.
+
+Calls have a priority class: "interactive" (a user is waiting on the task) or "bulk"
+(reprocessing). Waiting calls are served by priority, then in arrival order, and bulk
+calls cannot dip into the last LLM_BULK_RESERVE fraction of either bucket, which stays
+available for interactive calls. The priority of the current task is carried by a
+context variable (see priority_class()).
+
+The buckets live in the process by default. With LLM_RATE_LIMIT_URL=redis://...
+they are kept in Redis and shared by every worker and machine using the API key.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from preprocess import API_MAX_PIXELS, CHARS_PER_TOKEN, PDF_PAGE_TOKENS_ESTIMATE, PIXELS_PER_TOKEN, PREPROCESS_PDF_MAX_PAGES
+
+logger = logging.getLogger(__name__)
+
+LLM_RATE_LIMIT_ENABLED = os.getenv("LLM_RATE_LIMIT_ENABLED", "1") == "1"
+LLM_RATE_LIMIT_URL = os.getenv("LLM_RATE_LIMIT_URL", "")
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "50"))
+LLM_INPUT_TOKENS_PER_MINUTE = float(os.getenv("LLM_INPUT_TOKENS_PER_MINUTE", "40000"))
+LLM_BULK_RESERVE = float(os.getenv("LLM_BULK_RESERVE", "0.2"))
+LLM_RATE_LIMIT_MAX_WAIT = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT", "300"))
+
+PRIORITIES = {"interactive": 0, "bulk": 1}
+DEFAULT_PRIORITY = "interactive"
+
+IMAGE_TOKENS_ESTIMATE = API_MAX_PIXELS // PIXELS_PER_TOKEN
+PDF_TOKENS_ESTIMATE = PDF_PAGE_TOKENS_ESTIMATE * PREPROCESS_PDF_MAX_PAGES
+
+# Longest sleep between two capacity checks, so priority changes are noticed quickly
+MAX_POLL_INTERVAL = 0.25
+
+_current_priority = contextvars.ContextVar("llm_priority", default=DEFAULT_PRIORITY)
+
+class RateLimitTimeout(Exception):
+    """Raised when a call waited longer than LLM_RATE_LIMIT_MAX_WAIT for capacity."""
+    pass
+
+@contextmanager
+def priority_class(priority):
+    """
+    Run the enclosed model calls (including tasks and threads started from it) with a priority class.
+
+    Args:
+        priority (str): "interactive" or "bulk"
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority class: {priority}")
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+def current_priority():
+    """Priority class of the model calls made from the current context."""
+    return _current_priority.get()
+
+def estimate_request_tokens(request):
+    """
+    Estimate the input tokens of a messages.create() request.
+
+    Args:
+        request (dict): Arguments of messages.create()
+
+    Returns:
+        int: Estimated input tokens (text, images and PDF documents)
+    """
+    chars, tokens = 0, 0
+    blocks = []
+    for value in [request.get("system")] + [message.get("content") for message in request.get("messages", [])]:
+        if isinstance(value, str):
+            chars += len(value)
+        elif isinstance(value, list):
+            blocks.extend(value)
+    for block in blocks:
+        if block.get("type") == "image":
+            tokens += IMAGE_TOKENS_ESTIMATE
+        elif block.get("type") == "document":
+            tokens += PDF_TOKENS_ESTIMATE
+        else:
+            chars += len(block.get("text", ""))
+    for tool in request.get("tools", []):
+        chars += len(str(tool))
+    return tokens + int(chars / CHARS_PER_TOKEN)
+
+class _Bucket:
+    """In-process token bucket (capacity = one minute of budget)."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_for(self, cost, reserve):
+        """Seconds before `cost` can be taken while keeping `reserve` in the bucket (0 if available now)."""
+        missing = min(cost + reserve, self.capacity) - self.level
+        return 0.0 if missing <= 0 else missing / self.rate
+
+class LocalBuckets:
+    """Request and token buckets kept in the current process."""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.buckets = {"requests": _Bucket(requests_per_minute), "tokens": _Bucket(tokens_per_minute)}
+
+    def take(self, costs, reserve_fraction):
+        """Take every cost atomically; returns 0 on success, else the seconds to wait."""
+        now = time.monotonic()
+        waits = []
+        for name, bucket in self.buckets.items():
+            bucket.refill(now)
+            waits.append(bucket.wait_for(costs[name], bucket.capacity * reserve_fraction))
+        if max(waits) > 0:
+            return max(waits)
+        for name, bucket in self.buckets.items():
+            bucket.level -= min(costs[name], bucket.capacity)
+        return 0.0
+
+    def adjust(self, name, delta):
+        """Give back (negative delta) or take more (positive delta) once the real usage is known."""
+        bucket = self.buckets[name]
+        bucket.refill(time.monotonic())
+        bucket.level = min(bucket.capacity, bucket.level - delta)
+
+    def levels(self):
+        now = time.monotonic()
+        for bucket in self.buckets.values():
+            bucket.refill(now)
+        return {name: round(bucket.level) for name, bucket in self.buckets.items()}
+
+# Refill then take from both buckets atomically, on the Redis server clock.
+# KEYS: requests, tokens buckets. ARGV: per-bucket capacity, rate (per second), cost, then reserve fraction.
+# Returns 0 when taken, else the milliseconds to wait.
+_TAKE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local reserve = tonumber(ARGV[7])
+local levels, wait = {}, 0
+for i, key in ipairs(KEYS) do
+    local capacity, rate, cost = tonumber(ARGV[i * 3 - 2]), tonumber(ARGV[i * 3 - 1]), tonumber(ARGV[i * 3])
+    local state = redis.call('HMGET', key, 'level', 'ts')
+    local level = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    level = math.min(capacity, level + (now - ts) * rate)
+    levels[i] = level
+    local missing = math.min(cost + capacity * reserve, capacity) - level
+    if missing > 0 then wait = math.max(wait, missing / rate) end
+end
+for i, key in ipairs(KEYS) do
+    local capacity, rate, cost = tonumber(ARGV[i * 3 - 2]), tonumber(ARGV[i * 3 - 1]), tonumber(ARGV[i * 3])
+    local level = levels[i]
+    if wait == 0 then level = level - math.min(cost, capacity) end
+    redis.call('HSET', key, 'level', level, 'ts', now)
+    redis.call('EXPIRE', key, 120)
+end
+return math.ceil(wait * 1000)
+"""
+
+# Correct a bucket once the real usage is known. KEYS: bucket. ARGV: capacity, delta.
+_ADJUST_SCRIPT = """
+local level = tonumber(redis.call('HGET', KEYS[1], 'level'))
+if level then
+    redis.call('HSET', KEYS[1], 'level', math.min(tonumber(ARGV[1]), level - tonumber(ARGV[2])))
+end
+return 0
+"""
+
+class RedisBuckets:
+    """Request and token buckets shared through Redis by every process using the API key."""
+
+    def __init__(self, client, requests_per_minute, tokens_per_minute, prefix="avopoint:llm_rate:"):
+        self.client = client
+        self.limits = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.keys = {name: f"{prefix}{name}" for name in self.limits}
+        self._take = client.register_script(_TAKE_SCRIPT)
+        self._adjust = client.register_script(_ADJUST_SCRIPT)
+
+    def take(self, costs, reserve_fraction):
+        args = []
+        for name, per_minute in self.limits.items():
+            args += [per_minute, per_minute / 60, costs[name]]
+        wait_ms = self._take(keys=list(self.keys.values()), args=args + [reserve_fraction])
+        return int(wait_ms) / 1000
+
+    def adjust(self, name, delta):
+        self._adjust(keys=[self.keys[name]], args=[self.limits[name], delta])
+
+    def levels(self):
+        levels = {name: self.client.hget(key, "level") for name, key in self.keys.items()}
+        return {name: round(float(level)) if level is not None else None for name, level in levels.items()}
+
+class RateLimiter:
+    """Priority-ordered access to the request and token buckets."""
+
+    def __init__(self, buckets, bulk_reserve=LLM_BULK_RESERVE, max_wait=LLM_RATE_LIMIT_MAX_WAIT):
+        self.buckets = buckets
+        self.bulk_reserve = bulk_reserve
+        self.max_wait = max_wait
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._stats = {
+            priority: {"calls": 0, "waited_calls": 0, "total_wait_s": 0.0, "estimated_tokens": 0, "actual_tokens": 0}
+            for priority in PRIORITIES
+        }
+
+    def _try_take(self, ticket, costs, priority):
+        """Take capacity if this ticket is first in line; returns 0 on success, else the seconds to wait."""
+        with self._lock:
+            if self._waiters[0] != ticket:
+                return MAX_POLL_INTERVAL
+            reserve = self.bulk_reserve if priority == "bulk" else 0.0
+            wait = self.buckets.take(costs, reserve)
+            if wait == 0:
+                heapq.heappop(self._waiters)
+            return wait
+
+    def _enqueue(self, priority):
+        ticket = (PRIORITIES[priority], next(self._sequence))
+        with self._lock:
+            heapq.heappush(self._waiters, ticket)
+        return ticket
+
+    def _dequeue(self, ticket):
+        with self._lock:
+            if ticket in self._waiters:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+
+    def _record(self, priority, tokens, waited):
+        with self._lock:
+            stats = self._stats[priority]
+            stats["calls"] += 1
+            stats["estimated_tokens"] += tokens
+            if waited > 0.001:
+                stats["waited_calls"] += 1
+                stats["total_wait_s"] += waited
+
+    def acquire(self, tokens, priority=None, max_wait=None):
+        """Block until one request and `tokens` input tokens are available (at most max_wait seconds, capped by self.max_wait)."""
+        priority = priority or current_priority()
+        max_wait = self.max_wait if max_wait is None else min(max_wait, self.max_wait)
+        costs = {"requests": 1, "tokens": tokens}
+        ticket = self._enqueue(priority)
+        started_at = time.monotonic()
+        try:
+            while True:
+                wait = self._try_take(ticket, costs, priority)
+                if wait == 0:
+                    break
+                if time.monotonic() - started_at + wait > max_wait:
+                    raise RateLimitTimeout(f"No model API capacity within {max_wait:.0f}s")
+                time.sleep(min(wait, MAX_POLL_INTERVAL))
+        finally:
+            self._dequeue(ticket)
+        self._record(priority, tokens, time.monotonic() - started_at)
+
+    async def acquire_async(self, tokens, priority=None, max_wait=None):
+        """Async variant of acquire, waiting without blocking the event loop."""
+        priority = priority or current_priority()
+        max_wait = self.max_wait if max_wait is None else min(max_wait, self.max_wait)
+        costs = {"requests": 1, "tokens": tokens}
+        ticket = self._enqueue(priority)
+        started_at = time.monotonic()
+        try:
+            while True:
+                if isinstance(self.buckets, RedisBuckets):
+                    # Network round-trip: keep it off the event loop
+                    wait = await asyncio.to_thread(self._try_take, ticket, costs, priority)
+                else:
+                    wait = self._try_take(ticket, costs, priority)
+                if wait == 0:
+                    break
+                if time.monotonic() - started_at + wait > max_wait:
+                    raise RateLimitTimeout(f"No model API capacity within {max_wait:.0f}s")
+                await asyncio.sleep(min(wait, MAX_POLL_INTERVAL))
+        finally:
+            self._dequeue(ticket)
+        self._record(priority, tokens, time.monotonic() - started_at)
+
+    def settle(self, estimated_tokens, actual_tokens, priority=None):
+        """Correct the token bucket with the real input tokens of a call."""
+        priority = priority or current_priority()
+        with self._lock:
+            self._stats[priority]["actual_tokens"] += actual_tokens
+            self.buckets.adjust("tokens", actual_tokens - estimated_tokens)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "redis" if isinstance(self.buckets, RedisBuckets) else "local",
+                "waiting": len(self._waiters),
+                "levels": self.buckets.levels(),
+                "priorities": {priority: dict(stats) for priority, stats in self._stats.items()},
+            }
+
+def create_rate_limiter(url=LLM_RATE_LIMIT_URL):
+    """
+    Create the rate limiter from a URL: "" for in-process buckets, redis://host:port/db
+    for buckets shared by every worker (requires the redis package).
+    """
+    if url.startswith(("redis://", "rediss://")):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The 'redis' package is required for LLM_RATE_LIMIT_URL=redis://...")
+        buckets = RedisBuckets(redis.Redis.from_url(url), LLM_REQUESTS_PER_MINUTE, LLM_INPUT_TOKENS_PER_MINUTE)
+    elif url:
+        raise ValueError(f"Unsupported rate limiter URL: {url}")
+    else:
+        buckets = LocalBuckets(LLM_REQUESTS_PER_MINUTE, LLM_INPUT_TOKENS_PER_MINUTE)
+    return RateLimiter(buckets)
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_rate_limiter():
+    """
+    Return the process-wide rate limiter, or None when LLM_RATE_LIMIT_ENABLED is off.
+
+    Returns:
+        RateLimiter | None: The shared limiter
+    """
+    global _limiter
+    if not LLM_RATE_LIMIT_ENABLED:
+        return None
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = create_rate_limiter()
+        return _limiter
+
+def _usage_tokens(usage):
+    """Input tokens counted by the provider's limit (cache reads excluded)."""
+    return (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "cache_creation_input_tokens", 0) or 0)
+
+def wait_for_capacity(request, max_wait=None):
+    """
+    Block until the limiter has capacity for one attempt of a messages.create() request.
+
+    Called by call_with_retries before each attempt, outside the circuit breaker and
+    with max_wait set to what is left of the call deadline.
+    """
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        limiter.acquire(estimate_request_tokens(request), max_wait=max_wait)
+
+async def wait_for_capacity_async(request, max_wait=None):
+    """Async variant of wait_for_capacity."""
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        await limiter.acquire_async(estimate_request_tokens(request), max_wait=max_wait)
+
+def rate_limited(create):
+    """Wrap a synchronous messages.create() so the limiter is corrected with the real usage of each attempt."""
+    def limited_create(**request):
+        message = create(**request)
+        limiter = get_rate_limiter()
+        if limiter is not None:
+            limiter.settle(estimate_request_tokens(request), _usage_tokens(getattr(message, "usage", None)))
+        return message
+    return limited_create
+
+def rate_limited_async(create):
+    """Async variant of rate_limited, for AsyncAnthropic.messages.create."""
+    async def limited_create(**request):
+        message = await create(**request)
+        limiter = get_rate_limiter()
+        if limiter is not None:
+            limiter.settle(estimate_request_tokens(request), _usage_tokens(getattr(message, "usage", None)))
+        return message
+    return limited_create
+
+def get_rate_limit_stats():
+    """
+    Return the limiter state: backend, waiting calls, bucket levels and per-priority counters.
+
+    Returns:
+        dict | None: None when rate limiting is disabled
+    """
+    limiter = get_rate_limiter()
+    return limiter.stats() if limiter is not None else None
@@ -0,0 +1,290 @@
+"""
+Retries, deadlines and circuit breaking around model API calls.
+
+Transient upstream errors (429 rate limits, 529 overload, 5xx, timeouts, dropped
+connections) are retried with jittered exponential backoff, honoring the
+retry-after header when the API sends one. Every call has an overall deadline that
+bounds retries and the timeout of each attempt. A circuit breaker shared by the
+whole process opens after consecutive upstream failures and rejects calls
+immediately (CircuitOpenError) until a trial call succeeds, so a degraded upstream
+does not pile up waiting requests. Rate limits (429) are retried but do not count as
+failures: they mean this client is sending too much, not that the upstream is down. The SDK's own retries are disabled on the clients
+so attempts are not multiplied.
+"""
+
+import asyncio
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+
+import anthropic
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "180"))
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "90"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# 408 request timeout, 409 lock conflict, 429 rate limit, 5xx server errors (529 = overloaded)
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the upstream is considered degraded."""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} API unavailable (circuit open), retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+class DeadlineExceeded(Exception):
+    """Raised when retries would go past the deadline of the call."""
+    pass
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed: calls go through. open: calls are rejected for reset_timeout seconds.
+    half_open: a single trial call is let through; its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self.rejected_calls = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def retry_in(self):
+        """Seconds before the circuit lets a trial call through (0 when closed)."""
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def is_open(self):
+        """Whether calls are currently being rejected."""
+        with self._lock:
+            return self.state == "open" and self.retry_in() > 0
+
+    def before_call(self):
+        """Let a call through, or raise CircuitOpenError."""
+        with self._lock:
+            if self.state == "open":
+                if self.retry_in() > 0:
+                    self.rejected_calls += 1
+                    raise CircuitOpenError(self.name, self.retry_in())
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open":
+                if self._trial_in_flight:
+                    self.rejected_calls += 1
+                    raise CircuitOpenError(self.name, self.reset_timeout)
+                self._trial_in_flight = True
+
+    def release(self):
+        """Forget a call that was abandoned (cancelled) without telling anything about the upstream."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"{self.name} circuit closed")
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                    logger.warning(f"{self.name} circuit opened after {self.consecutive_failures} consecutive failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened,
+                "rejected_calls": self.rejected_calls,
+                "retry_in_s": round(self.retry_in(), 1),
+            }
+
+anthropic_circuit = CircuitBreaker("Anthropic")
+
+_stats = {
+    "calls": 0, "attempts": 0, "retries": 0, "successes": 0, "failures": 0,
+    "deadline_exceeded": 0, "total_backoff_s": 0.0, "total_latency_s": 0.0, "errors": {},
+}
+_stats_lock = threading.Lock()
+
+def is_retryable(error):
+    """Whether an API error is transient and worth retrying."""
+    if isinstance(error, anthropic.APIConnectionError):
+        # Also covers APITimeoutError
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+def is_rate_limited(error):
+    """Whether an API error is a rate limit (429) rather than an upstream failure."""
+    return isinstance(error, anthropic.APIStatusError) and error.status_code == 429
+
+def retry_after(error):
+    """Delay requested by the API (retry-after-ms / retry-after headers), in seconds, or None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for the given retry number (0-based)."""
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+def _count(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            _stats[key] += value
+
+def _count_error(error):
+    name = type(error).__name__
+    status = getattr(error, "status_code", None)
+    key = f"{name} ({status})" if status else name
+    with _stats_lock:
+        _stats["errors"][key] = _stats["errors"].get(key, 0) + 1
+
+def _next_delay(error, attempt, deadline, circuit):
+    """Record a failed attempt; return the delay before the next one, or raise if giving up."""
+    _count_error(error)
+    if not is_retryable(error):
+        # Client errors (bad request, authentication...) do not count against upstream health
+        circuit.release()
+        raise error
+    if is_rate_limited(error):
+        # Retried with backoff, but a healthy upstream enforcing our quota is not a breaker failure
+        circuit.release()
+    else:
+        circuit.record_failure()
+    if attempt >= LLM_MAX_RETRIES:
+        raise error
+    delay = retry_after(error)
+    delay = backoff_delay(attempt) if delay is None else delay
+    if time.monotonic() + delay >= deadline:
+        _count(deadline_exceeded=1)
+        raise DeadlineExceeded(f"Giving up after {attempt + 1} attempts, deadline reached: {str(error)}") from error
+    logger.warning(f"Transient API error ({str(error)}), retry {attempt + 1}/{LLM_MAX_RETRIES} in {delay:.1f}s")
+    _count(retries=1, total_backoff_s=delay)
+    return delay
+
+def call_with_retries(create, deadline=LLM_CALL_DEADLINE, circuit=anthropic_circuit, before_attempt=None, **request):
+    """
+    Call create(**request) with retries, a deadline and the circuit breaker.
+
+    Args:
+        create (callable): e.g. client.messages.create
+        deadline (float): Maximum total duration of the call, retries included, in seconds
+        circuit (CircuitBreaker): Breaker of the upstream service
+        before_attempt (callable): Called as before_attempt(request, max_wait=...) before each attempt,
+            e.g. rate_limiter.wait_for_capacity; it waits outside the breaker and within the deadline
+        **request: Arguments of the call
+
+    Returns:
+        The result of create()
+
+    Raises:
+        CircuitOpenError: If the upstream is considered degraded
+        DeadlineExceeded: If the next retry would go past the deadline
+        anthropic.APIError: The last error when it is not retryable or retries are exhausted
+    """
+    started_at = time.monotonic()
+    deadline_at = started_at + deadline
+    _count(calls=1)
+    try:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            if before_attempt is not None:
+                # Rate limiter wait before the breaker: a half-open trial never sits in the queue
+                before_attempt(request, max_wait=deadline_at - time.monotonic())
+            circuit.before_call()
+            _count(attempts=1)
+            try:
+                result = create(timeout=min(LLM_ATTEMPT_TIMEOUT, deadline_at - time.monotonic()), **request)
+            except Exception as e:
+                time.sleep(_next_delay(e, attempt, deadline_at, circuit))
+                continue
+            circuit.record_success()
+            _count(successes=1)
+            return result
+    except Exception:
+        _count(failures=1)
+        raise
+    finally:
+        _count(total_latency_s=time.monotonic() - started_at)
+
+async def call_with_retries_async(create, deadline=LLM_CALL_DEADLINE, circuit=anthropic_circuit, before_attempt=None, **request):
+    """Async variant of call_with_retries, for coroutine functions (e.g. AsyncAnthropic.messages.create; before_attempt is awaited)."""
+    started_at = time.monotonic()
+    deadline_at = started_at + deadline
+    _count(calls=1)
+    try:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            if before_attempt is not None:
+                await before_attempt(request, max_wait=deadline_at - time.monotonic())
+            circuit.before_call()
+            _count(attempts=1)
+            try:
+                result = await create(timeout=min(LLM_ATTEMPT_TIMEOUT, deadline_at - time.monotonic()), **request)
+            except asyncio.CancelledError:
+                circuit.release()
+                raise
+            except Exception as e:
+                await asyncio.sleep(_next_delay(e, attempt, deadline_at, circuit))
+                continue
+            circuit.record_success()
+            _count(successes=1)
+            return result
+    except Exception:
+        _count(failures=1)
+        raise
+    finally:
+        _count(total_latency_s=time.monotonic() - started_at)
+
+def get_resilience_stats():
+    """
+    Return retry counters and the circuit breaker state.
+
+    Returns:
+        dict: {"calls", "attempts", "retries", "successes", "failures", "deadline_exceeded",
+               "total_backoff_s", "average_latency_s", "errors": {error: count}, "circuit": {...}}
+    """
+    with _stats_lock:
+        stats = {**_stats, "errors": dict(_stats["errors"])}
+    stats["average_latency_s"] = stats["total_latency_s"] / stats["calls"] if stats["calls"] else 0.0
+    stats["circuit"] = anthropic_circuit.stats()
+    return stats
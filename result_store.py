@@ -0,0 +1,201 @@
+"""
+Stockage des lettres générées
+
+Les lettres sont rendues en mémoire puis écrites une seule fois dans le stockage de
+résultats, sans fichier temporaire ni copie. Le téléchargement lit le stockage par
+morceaux (plage d'octets éventuelle), avec l'ETag calculé à l'écriture. Implémentations
+choisies par RESULT_STORE_URL:
+- file://results            répertoire local (par défaut)
+- s3://bucket/prefixe       stockage compatible S3 (paquet boto3, point d'accès RESULT_STORE_S3_ENDPOINT)
+- s3local:///chemin         réplique locale d'un stockage S3 (mêmes appels que boto3), pour
+                            les tests et le développement sans service S3
+"""
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Iterator, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+RESULT_STORE_URL = os.getenv("RESULT_STORE_URL", "file://results")
+RESULT_STORE_S3_ENDPOINT = os.getenv("RESULT_STORE_S3_ENDPOINT")
+RESULT_CHUNK_SIZE = int(os.getenv("RESULT_CHUNK_SIZE", str(64 * 1024)))
+
+class ResultStoreError(Exception):
+    """Exception levée lorsque le stockage des résultats est mal configuré ou indisponible"""
+    pass
+
+def _etag(data: bytes) -> str:
+    return f'"{hashlib.md5(data).hexdigest()}"'
+
+class ResultStore:
+    """Interface commune des stockages de résultats"""
+
+    def put(self, key: str, data: bytes, content_type: str) -> dict:
+        """Écrit un résultat et retourne ses métadonnées: {"key", "size", "etag", "content_type"}"""
+        raise NotImplementedError
+
+    def iter_range(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Contenu du résultat par morceaux, de l'octet start à l'octet end inclus (jusqu'à la fin par défaut)"""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+class LocalResultStore(ResultStore):
+    """Résultats dans un répertoire local"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        path = (self.directory / key).resolve()
+        if self.directory.resolve() not in path.parents:
+            raise ResultStoreError(f"Clé de résultat invalide: {key}")
+        return path
+
+    def put(self, key: str, data: bytes, content_type: str) -> dict:
+        path = self._path(key)
+        # Écriture atomique: un téléchargement en cours ne lit jamais un fichier à moitié écrit
+        temporary = path.with_name(f".{path.name}.tmp")
+        temporary.write_bytes(data)
+        os.replace(temporary, path)
+        return {"key": key, "size": len(data), "etag": _etag(data), "content_type": content_type}
+
+    def iter_range(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(RESULT_CHUNK_SIZE if remaining is None else min(RESULT_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+class LocalObjectClient:
+    """
+    Réplique locale d'un client S3 (put_object, get_object avec Range, head_object,
+    delete_object), objets rangés dans un répertoire par bucket
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+
+    def _path(self, bucket: str, key: str) -> Path:
+        return self.directory / bucket / key
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, ContentType: str = "binary/octet-stream", **kwargs) -> dict:
+        path = self._path(Bucket, Key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            path.write_bytes(Body)
+            path.with_name(path.name + ".content-type").write_text(ContentType)
+        return {"ETag": _etag(Body)}
+
+    def head_object(self, Bucket: str, Key: str) -> dict:
+        path = self._path(Bucket, Key)
+        if not path.exists():
+            raise ResultStoreError(f"Objet introuvable: {Bucket}/{Key}")
+        return {"ContentLength": path.stat().st_size,
+                "ContentType": path.with_name(path.name + ".content-type").read_text()}
+
+    def get_object(self, Bucket: str, Key: str, Range: str = None) -> dict:
+        path = self._path(Bucket, Key)
+        if not path.exists():
+            raise ResultStoreError(f"Objet introuvable: {Bucket}/{Key}")
+        data = path.read_bytes()
+        if Range:
+            start, _, end = Range[len("bytes="):].partition("-")
+            data = data[int(start):int(end) + 1 if end else None]
+        return {"Body": _LocalBody(data), "ContentLength": len(data)}
+
+    def delete_object(self, Bucket: str, Key: str) -> dict:
+        path = self._path(Bucket, Key)
+        path.unlink(missing_ok=True)
+        path.with_name(path.name + ".content-type").unlink(missing_ok=True)
+        return {}
+
+class _LocalBody:
+    """Corps de réponse de LocalObjectClient (mêmes méthodes que le StreamingBody de boto3)"""
+
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def iter_chunks(self, chunk_size: int = RESULT_CHUNK_SIZE) -> Iterator[bytes]:
+        for offset in range(0, len(self._data), chunk_size):
+            yield self._data[offset:offset + chunk_size]
+
+    def close(self) -> None:
+        pass
+
+class S3ResultStore(ResultStore):
+    """Résultats dans un stockage compatible S3 (client boto3 ou LocalObjectClient)"""
+
+    def __init__(self, client, bucket: str, prefix: str = ""):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, key: str, data: bytes, content_type: str) -> dict:
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data, ContentType=content_type)
+        return {"key": key, "size": len(data), "etag": _etag(data), "content_type": content_type}
+
+    def iter_range(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        request = {"Bucket": self.bucket, "Key": self._key(key)}
+        if start or end is not None:
+            request["Range"] = f"bytes={start}-{'' if end is None else end}"
+        body = self.client.get_object(**request)["Body"]
+        try:
+            yield from body.iter_chunks(RESULT_CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except Exception:
+            return False
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+def create_result_store(url: str = RESULT_STORE_URL) -> ResultStore:
+    """
+    Crée le stockage des résultats à partir d'une URL:
+    - file://repertoire
+    - s3://bucket/prefixe (nécessite le paquet boto3)
+    - s3local:///chemin/bucket
+    """
+    if url.startswith("file://"):
+        return LocalResultStore(url[len("file://"):])
+    if url.startswith("s3local:///"):
+        path = Path(url[len("s3local://"):])
+        return S3ResultStore(LocalObjectClient(path.parent), path.name)
+    if url.startswith("s3://"):
+        try:
+            import boto3
+        except ImportError:
+            raise ResultStoreError("Le paquet 'boto3' est requis pour RESULT_STORE_URL=s3://...")
+        bucket, _, prefix = url[len("s3://"):].partition("/")
+        return S3ResultStore(boto3.client("s3", endpoint_url=RESULT_STORE_S3_ENDPOINT), bucket, prefix)
+    raise ResultStoreError(f"URL de stockage des résultats non supportée: {url}")
@@ -1,120 +1,547 @@
 import anthropic
+import asyncio
 import dotenv
 import base64
+import hashlib
+import httpx
 import json
 from datetime import datetime
+import logging
 import re, os
+import threading
+import time
+
+from extraction_cache import get_extraction_cache, hash_file
+from field_checks import assess_extraction
+from local_ocr import extract_locally, local_ocr_fingerprint
+from preprocess import PREPROCESS_ENABLED, crop_document, preprocess_document, preprocessing_fingerprint
+from prompts import document_instruction, get_template, prompt_version, system_prompt
+from schemas import (
+    BATCH_TOOL, REPAIR_TOOL, TOOL_NAMES, ValidationChecks, batch_tools, extraction_tools,
+    get_path, set_path, unavailable_value, validate_extraction
+)
+from rate_limiter import rate_limited, rate_limited_async, wait_for_capacity, wait_for_capacity_async
+from resilience import CircuitOpenError, DeadlineExceeded, call_with_retries, call_with_retries_async
+from validation_rules import check_documents, collect_names, record_validation
 
 dotenv.load_dotenv()
 
-client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+logger = logging.getLogger(__name__)
+
+# Retries are handled by resilience.call_with_retries (backoff, deadline, circuit breaker)
+client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0)
+
+# Connection pool of the shared async client, sized for many concurrent extractions
+ANTHROPIC_MAX_CONNECTIONS = int(os.getenv("ANTHROPIC_MAX_CONNECTIONS", "100"))
+ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS", "20"))
 
-def scan_contravention(file_path):
+_async_client = None
+
+def get_async_client():
     """
-    Extract structured data from a French traffic violation notice (avis de contravention).
+    Return the shared AsyncAnthropic client, creating it on first use.
     
-    Args:
-        file_path (str): Path to the image or PDF file
+    The client keeps a pooled HTTP connection set (ANTHROPIC_MAX_CONNECTIONS /
+    ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS) so one worker can keep many requests in flight
+    without blocking the event loop.
     
     Returns:
-        dict: Structured data extracted from the traffic violation notice
+        anthropic.AsyncAnthropic: The shared async client
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = anthropic.AsyncAnthropic(
+            api_key=os.getenv("ANTHROPIC_API_KEY"),
+            max_retries=0,
+            http_client=anthropic.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=ANTHROPIC_MAX_CONNECTIONS,
+                    max_keepalive_connections=ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS,
+                )
+            ),
+        )
+    return _async_client
+
+async def close_async_client():
+    """Close the shared async client and its connection pool (e.g. on application shutdown)."""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+
+# Extraction settings per document type: max_tokens and error message prefix (prompts are in prompts.py)
+DOCUMENT_SCANS = {
+    "contravention": {
+        "max_tokens": 4024,
+        "error": "Error extracting data from image",
+    },
+    "permis": {
+        "max_tokens": 2048,
+        "error": "Error extracting data from license",
+    },
+    "certificat": {
+        "max_tokens": 4024,
+        "error": "Error extracting data from registration certificate",
+    },
+    "domicile": {
+        "max_tokens": 4024,
+        "error": "Error extracting data from proof of residence",
+    },
+}
+
+SCAN_MODEL = os.getenv("SCAN_MODEL", "claude-sonnet-4-20250514")
+VALIDATION_MODEL = os.getenv("VALIDATION_MODEL", "claude-3-5-sonnet-20241022")
+
+# Model routing: simple documents (a few short fields) are first extracted with the small model,
+# and escalated to SCAN_MODEL only when the result fails the schema or the field checks
+SCAN_FAST_MODEL = os.getenv("SCAN_FAST_MODEL", "claude-3-5-haiku-20241022")
+FAST_FIRST_DOC_TYPES = [doc_type.strip() for doc_type in os.getenv("FAST_FIRST_DOC_TYPES", "certificat,domicile").split(",") if doc_type.strip()]
+ROUTER_MIN_CONFIDENCE = float(os.getenv("ROUTER_MIN_CONFIDENCE", "0.75"))
+# A failed fast-tier call (retries exhausted, circuit open) escalates instead of failing the scan
+FAST_TIER_ERRORS = (anthropic.APIError, CircuitOpenError, DeadlineExceeded)
+
+# USD per million tokens (input, output); cache reads cost 10% of input, cache writes 125%
+MODEL_PRICES = {
+    "claude-sonnet-4-20250514": (3.0, 15.0),
+    "claude-3-5-sonnet-20241022": (3.0, 15.0),
+    "claude-3-5-haiku-20241022": (0.8, 4.0),
+}
+
+# "per_document": one request per document plus a validation request
+# "batched": a single request extracting every document and checking consistency
+SCAN_MODE = os.getenv("SCAN_MODE", "per_document")
+
+# Targeted re-extraction of a few fields (reextract_fields); fast=True uses SCAN_FAST_MODEL
+REEXTRACT_MAX_TOKENS = 1024
+
+# Names and dates are checked locally; the model is only asked when the checks are ambiguous
+LOCAL_VALIDATION_ENABLED = os.getenv("LOCAL_VALIDATION_ENABLED", "1") == "1"
+
+_scan_stats = {}
+_doc_type_stats = {}
+_scan_stats_lock = threading.Lock()
+
+USAGE_FIELDS = ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+
+def estimate_cost(model, counts):
+    """Cost of a call in USD from its token usage, or None for a model missing from MODEL_PRICES."""
+    if model not in MODEL_PRICES:
+        return None
+    input_price, output_price = MODEL_PRICES[model]
+    return (
+        counts["input_tokens"] * input_price
+        + counts["cache_read_input_tokens"] * input_price * 0.1
+        + counts["cache_creation_input_tokens"] * input_price * 1.25
+        + counts["output_tokens"] * output_price
+    ) / 1_000_000
+
+def _new_doc_type_stats():
+    return {"documents": 0, "fast_accepted": 0, "escalations": 0, "escalation_reasons": {}, "models": {}}
+
+def _record_call(kind, started_at, message, model=None, doc_type=None):
+    """
+    Accumulate latency, token usage and prompt cache hits per kind of call (per-document scan,
+    validation, batched), and latency and cost per document type and model.
+    """
+    latency = time.monotonic() - started_at
+    usage = getattr(message, "usage", None)
+    counts = {field: getattr(usage, field, 0) or 0 for field in USAGE_FIELDS}
+    cost = estimate_cost(model, counts)
+    logger.info(
+        f"{kind} call{f' ({doc_type}, {model})' if doc_type else ''}: {latency:.2f}s, {counts['input_tokens']} input tokens "
+        f"(+{counts['cache_read_input_tokens']} cached, +{counts['cache_creation_input_tokens']} written to cache), "
+        f"{counts['output_tokens']} output tokens"
+    )
+    with _scan_stats_lock:
+        stats = _scan_stats.setdefault(kind, {
+            "calls": 0, "total_latency_s": 0.0, "prompt_cache_hits": 0, "prompt_cache_misses": 0,
+            **{field: 0 for field in USAGE_FIELDS}
+        })
+        stats["calls"] += 1
+        stats["total_latency_s"] += latency
+        for field, count in counts.items():
+            stats[field] += count
+        # A miss writes the prefix to the cache; calls without cacheable prefix count as neither
+        if counts["cache_read_input_tokens"]:
+            stats["prompt_cache_hits"] += 1
+        elif counts["cache_creation_input_tokens"]:
+            stats["prompt_cache_misses"] += 1
+        
+        if doc_type:
+            model_stats = _doc_type_stats.setdefault(doc_type, _new_doc_type_stats())["models"].setdefault(model, {
+                "calls": 0, "total_latency_s": 0.0, "cost_usd": 0.0, "input_tokens": 0, "output_tokens": 0
+            })
+            model_stats["calls"] += 1
+            model_stats["total_latency_s"] += latency
+            model_stats["cost_usd"] += cost or 0.0
+            model_stats["input_tokens"] += counts["input_tokens"]
+            model_stats["output_tokens"] += counts["output_tokens"]
+
+def _record_route(doc_type, escalation_reason=None, fast_tried=False):
+    """Count a routed extraction: accepted from the fast model, escalated (with the reason), or direct."""
+    with _scan_stats_lock:
+        stats = _doc_type_stats.setdefault(doc_type, _new_doc_type_stats())
+        stats["documents"] += 1
+        if escalation_reason:
+            stats["escalations"] += 1
+            stats["escalation_reasons"][escalation_reason] = stats["escalation_reasons"].get(escalation_reason, 0) + 1
+        elif fast_tried:
+            stats["fast_accepted"] += 1
+
+def _create_message(kind, doc_type=None, **request):
+    """messages.create() with rate limiting, retries and circuit breaker, recording latency and token usage."""
+    started_at = time.monotonic()
+    message = call_with_retries(rate_limited(client.messages.create), before_attempt=wait_for_capacity, **request)
+    _record_call(kind, started_at, message, request.get("model"), doc_type)
+    return message
+
+async def _create_message_async(kind, doc_type=None, **request):
+    """Async variant of _create_message, on the shared AsyncAnthropic client."""
+    started_at = time.monotonic()
+    message = await call_with_retries_async(rate_limited_async(get_async_client().messages.create),
+                                            before_attempt=wait_for_capacity_async, **request)
+    _record_call(kind, started_at, message, request.get("model"), doc_type)
+    return message
+
+# The scan, re-extraction, validation and batched pipelines are written once, as generators:
+# each model call is yielded as (kind, doc_type, request) and its message (or the exception
+# of the call) is sent back in. _run_steps and _run_steps_async only differ by the client.
+
+def _advance(send, value):
+    """Run a pipeline up to its next model call; returns (done, (kind, doc_type, request) or result)."""
+    try:
+        return False, send(value)
+    except StopIteration as stop:
+        return True, stop.value
+
+def _run_steps(steps):
+    """Run a pipeline generator with the synchronous client."""
+    send, value = steps.send, None
+    while True:
+        done, step = _advance(send, value)
+        if done:
+            return step
+        kind, doc_type, request = step
+        try:
+            send, value = steps.send, _create_message(kind, doc_type=doc_type, **request)
+        except Exception as e:
+            send, value = steps.throw, e
+
+async def _run_steps_async(steps):
+    """
+    Run a pipeline generator with the shared async client. The steps between model calls
+    (hashing, cache, reading and encoding files) are blocking I/O and run in a thread.
+    """
+    send, value = steps.send, None
+    while True:
+        done, step = await asyncio.to_thread(_advance, send, value)
+        if done:
+            return step
+        kind, doc_type, request = step
+        try:
+            send, value = steps.send, await _create_message_async(kind, doc_type=doc_type, **request)
+        except Exception as e:
+            send, value = steps.throw, e
+
+def get_scan_stats():
+    """
+    Return model call statistics per kind of call.
     
-    Raises:
-        Exception: If there's an error with the API call or data extraction
+    Returns:
+        dict: {kind: {"calls", "total_latency_s", "average_latency_s", "input_tokens", "output_tokens",
+               "cache_read_input_tokens", "cache_creation_input_tokens", "prompt_cache_hits", "prompt_cache_misses"}}
+    """
+    with _scan_stats_lock:
+        return {
+            kind: {**stats, "average_latency_s": stats["total_latency_s"] / stats["calls"]}
+            for kind, stats in _scan_stats.items()
+        }
+
+def get_routing_stats():
+    """
+    Return the model routing configuration and, per document type, escalations, latency and cost per model.
+    
+    Returns:
+        dict: {"routes": {doc_type: [models]}, "min_confidence": float,
+               "doc_types": {doc_type: {"documents", "fast_accepted", "escalations", "escalation_reasons",
+                                        "cost_usd", "average_cost_usd", "total_latency_s", "average_latency_s",
+                                        "models": {model: {"calls", "total_latency_s", "average_latency_s",
+                                                           "cost_usd", "input_tokens", "output_tokens"}}}}}
+    """
+    with _scan_stats_lock:
+        doc_types = {}
+        for doc_type, stats in _doc_type_stats.items():
+            models = {
+                model: {**model_stats, "average_latency_s": model_stats["total_latency_s"] / model_stats["calls"]}
+                for model, model_stats in stats["models"].items()
+            }
+            cost = sum(model_stats["cost_usd"] for model_stats in models.values())
+            latency = sum(model_stats["total_latency_s"] for model_stats in models.values())
+            documents = stats["documents"]
+            doc_types[doc_type] = {
+                **stats,
+                "escalation_reasons": dict(stats["escalation_reasons"]),
+                "models": models,
+                "cost_usd": cost,
+                "average_cost_usd": cost / documents if documents else None,
+                "total_latency_s": latency,
+                "average_latency_s": latency / documents if documents else None,
+            }
+    return {
+        "routes": {doc_type: scan_route(doc_type) for doc_type in DOCUMENT_SCANS},
+        "min_confidence": ROUTER_MIN_CONFIDENCE,
+        "doc_types": doc_types,
+    }
+
+def scan_route(doc_type):
+    """Models tried in order to extract a document type: the fast model first for simple documents."""
+    if doc_type in FAST_FIRST_DOC_TYPES and SCAN_FAST_MODEL and SCAN_FAST_MODEL != SCAN_MODEL:
+        return [SCAN_FAST_MODEL, SCAN_MODEL]
+    return [SCAN_MODEL]
+
+def _fast_tier_result(doc_type, message):
+    """
+    Score an answer of the fast model against the schema and the field checks.
+    
+    Returns:
+        tuple: (extracted_data, None) when it is good enough, (None, reason) when it must be escalated
     """
     try:
+        raw_data = _tool_input(message, TOOL_NAMES[doc_type])
+    except Exception:
+        return None, "no_tool_call"
+    extracted_data, errors = validate_extraction(doc_type, raw_data)
+    if errors:
+        return None, "schema"
+    checks = assess_extraction(doc_type, extracted_data)
+    if any(field["status"] == "invalid" for field in checks["fields"].values()):
+        return None, "invalid_field"
+    if checks["confidence"] < ROUTER_MIN_CONFIDENCE:
+        return None, "low_confidence"
+    return extracted_data, None
+
+def _document_content(doc_type, file_path, crop=None):
+    """
+    Content blocks carrying the document: preprocessed (downsized, recompressed, or the text
+    layer of a born-digital PDF) when enabled, or only the region given by crop ((left, top, right, bottom) fractions of the first page).
+    """
+    documents = crop_document(file_path, crop) if crop else None
+    if documents is None and PREPROCESS_ENABLED:
+        try:
+            documents = preprocess_document(file_path, doc_type)["documents"]
+        except Exception as e:
+            logger.warning(f"Preprocessing failed for {file_path}, sending the original file: {str(e)}")
+    if documents is None:
         # Convert file to base64 and get media type
-        file_data = file_to_base64(file_path)
-        image_base64 = file_data["base64_data"]
-        media_type = file_data["media_type"]
-        
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=4024,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "document" if media_type == "application/pdf" else "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": media_type,
-                                "data": image_base64,
-                            },
-                        },
-                        {
-                            "type": "text",
-                            "text": """Analyse cette image d'avis de contravention français et extrais les informations suivantes au format JSON strict. Si une information n'est pas disponible, utilise "NONE".
-
-Structure JSON attendue:
-{
-  "identité": {
-    "nom": "nom de la personne verbalisée",
-    "prenom": "prénom de la personne verbalisée",
-    "adresse": "adresse de la personne verbalisée (ex:)"
-  },
-  "infraction": {
-    "numero_avis": "numéro de l'avis de contravention",
-    "date_heure": "date et heure de l'infraction (format exact trouvé)",
-    "format_date": "DD/MM/YYYY:HHhMM",
-    "route": "nom de la route (ex: D938, A10, etc.)",
-    "exces_vitesse_kmh": nombre (vitesse mesurée - vitesse autorisée),
-    "vitesse_maximale_autorisee": nombre,
-    "vitesse_mesuree": nombre
-  },
-  "identification_vehicule": {
-    "immatriculation": "numéro d'immatriculation",
-    "pays": "pays d'immatriculation",
-    "marque": "marque du véhicule"
-  },
-  "appareil_controle": {
-    "type": "type d'appareil de contrôle",
-    "date_derniere_verification": "date de dernière vérification"
-  },
-  "agent_verbalisateur": {
-    "agent_verbalisateur": "Numéro de l'agent verbalisateur",
-    "service": "nom du service verbalisateur"
-  },
-  "réglements": {
-      "date_15j": "date à compter de laquelle la personne doit payer dans les 15 jours",
-      "adresse_demarche": "Adresse à laquelle adresser requêtes par lettre recommandée",
-  }
-}
+        documents = [file_to_base64(file_path)]
+    
+    return [
+        {
+            # Born-digital PDF: its text layer replaces the pages
+            "type": "text",
+            "text": f"Contenu textuel du document PDF:\n{file_data['text']}",
+        } if file_data["media_type"] == "text/plain" else {
+            "type": "document" if file_data["media_type"] == "application/pdf" else "image",
+            "source": {
+                "type": "base64",
+                "media_type": file_data["media_type"],
+                "data": file_data["base64_data"],
+            },
+        }
+        for file_data in documents
+    ]
 
-Retourne UNIQUEMENT le JSON, sans commentaire ni explication. Si l'information est indisponible, return NONE."""
-                        }
-                    ],
-                }
-            ],
-        )
-        
-        # Extract the JSON content from the response
-        response_text = message.content[0].text.strip()
+def _build_scan_request(doc_type, file_path):
+    """Build the messages.create() arguments to extract a document of the given type."""
+    spec = DOCUMENT_SCANS[doc_type]
+    
+    return {
+        "model": SCAN_MODEL,
+        "max_tokens": spec["max_tokens"],
+        # Tools and instructions are the cached prefix, identical for every document type;
+        # only tool_choice, the document and a short pointer change per call
+        "tools": extraction_tools(),
+        "tool_choice": {"type": "tool", "name": TOOL_NAMES[doc_type]},
+        "system": system_prompt(),
+        "messages": [
+            {
+                "role": "user",
+                "content": _document_content(doc_type, file_path) + [
+                    {
+                        "type": "text",
+                        "text": document_instruction(doc_type)
+                    }
+                ],
+            }
+        ],
+    }
+
+def _tool_input(message, tool_name):
+    """Arguments of the tool call in the model's answer (already-parsed JSON)."""
+    for block in message.content:
+        if block.type == "tool_use" and block.name == tool_name:
+            return block.input
+    raise Exception(f"No {tool_name} tool call in the response")
+
+def _build_repair_request(request, message, errors):
+    """
+    Follow-up request asking the model to correct only the fields that failed validation.
+    The document and the first answer stay in the conversation, so no field is re-extracted.
+    """
+    tool_use = next(block for block in message.content if block.type == "tool_use")
+    details = "\n".join(
+        f"- {error['path']}: {error['error']} (valeur reçue: {json.dumps(error['value'], ensure_ascii=False)})"
+        for error in errors
+    )
+    return {
+        **request,
+        "tool_choice": {"type": "tool", "name": REPAIR_TOOL},
+        "messages": request["messages"] + [
+            {
+                "role": "assistant",
+                "content": [{"type": "tool_use", "id": tool_use.id, "name": tool_use.name, "input": tool_use.input}],
+            },
+            {
+                "role": "user",
+                "content": [{
+                    "type": "tool_result",
+                    "tool_use_id": tool_use.id,
+                    "is_error": True,
+                    "content": f"Champs invalides:\n{details}\n\nCorrige uniquement ces champs avec l'outil {REPAIR_TOOL}, "
+                               f"en relisant le document. Utilise \"NONE\" si l'information n'est pas disponible.",
+                }],
+            },
+        ],
+    }
+
+def _apply_repair(doc_type, raw_data, repair_input, errors):
+    """Merge the corrected fields; fields still invalid after the repair are set to "NONE" (unavailable)."""
+    repaired = json.loads(json.dumps(raw_data))
+    allowed = {tuple(error["path"].split(".")) for error in errors}
+    for field in repair_input.get("champs", []):
+        path = tuple(str(field.get("chemin", "")).split("."))
+        if path in allowed:
+            set_path(repaired, path, field.get("valeur"))
+    
+    extracted_data, remaining = validate_extraction(doc_type, repaired)
+    if remaining:
+        logger.warning(f"{doc_type}: fields still invalid after repair, set to NONE: {', '.join(e['path'] for e in remaining)}")
+        for error in remaining:
+            path = tuple(error["path"].split("."))
+            set_path(repaired, path, unavailable_value(doc_type, path))
+        extracted_data, remaining = validate_extraction(doc_type, repaired)
+        if remaining:
+            raise Exception(f"Invalid fields: {', '.join(e['path'] for e in remaining)}")
+    return extracted_data
+
+def _parse_json_response(response_text):
+    """Parse the JSON object returned by the model, tolerating text around it."""
+    try:
+        return json.loads(response_text)
+    except json.JSONDecodeError:
+        # If JSON parsing fails, try to extract JSON from the response
+        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group())
+        raise Exception("Could not extract valid JSON from response")
+
+def _prompt_version(doc_type):
+    """Fingerprint of everything that shapes an extraction (model, prompt, preprocessing), used as cache key."""
+    spec = DOCUMENT_SCANS[doc_type]
+    fingerprint = (f"{'>'.join(scan_route(doc_type))}|{spec['max_tokens']}|{preprocessing_fingerprint()}|"
+                   f"{prompt_version(doc_type)}|{local_ocr_fingerprint(doc_type)}")
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:16]
+
+def _cache_lookup(doc_type, file_path, content_hash=None, prompt_version=None):
+    """Return (cached_result, content_hash); the hash is None when the cache is disabled."""
+    cache = get_extraction_cache()
+    if cache is None:
+        return None, None
+    content_hash = content_hash or hash_file(file_path)
+    return cache.get(content_hash, doc_type, prompt_version or _prompt_version(doc_type)), content_hash
+
+def _cache_store(doc_type, content_hash, extracted_data, prompt_version=None):
+    """Remember a fresh extraction under its content hash and prompt version."""
+    cache = get_extraction_cache()
+    if cache is not None and content_hash:
+        cache.set(content_hash, doc_type, prompt_version or _prompt_version(doc_type), extracted_data)
+
+def _scan_steps(doc_type, file_path, content_hash=None):
+    """Extraction pipeline of a document (see _run_steps), serving repeat documents from the cache."""
+    try:
+        cached, content_hash = _cache_lookup(doc_type, file_path, content_hash)
+        if cached is not None:
+            return cached
         
-        # Try to parse as JSON
-        try:
-            extracted_data = json.loads(response_text)
+        # Printed forms: PDF text layer or Tesseract, without the model when every required field is found
+        extracted_data = extract_locally(doc_type, file_path)
+        if extracted_data is not None:
+            _cache_store(doc_type, content_hash, extracted_data)
             return extracted_data
-        except json.JSONDecodeError:
-            # If JSON parsing fails, try to extract JSON from the response
-            import re
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                extracted_data = json.loads(json_match.group())
-                return extracted_data
-            else:
-                raise Exception("Could not extract valid JSON from response")
         
+        request = _build_scan_request(doc_type, file_path)
+        route = scan_route(doc_type)
+        extracted_data = escalation_reason = None
+        if len(route) > 1:
+            # Fast model first; escalate when its answer fails the schema or the field checks
+            try:
+                message = yield "per_document", doc_type, {**request, "model": route[0]}
+            except FAST_TIER_ERRORS as e:
+                logger.warning(f"{doc_type}: {route[0]} call failed: {e}")
+                escalation_reason = "fast_error"
+            else:
+                extracted_data, escalation_reason = _fast_tier_result(doc_type, message)
+        if extracted_data is None:
+            if escalation_reason:
+                logger.info(f"{doc_type}: escalating from {route[0]} to {route[-1]} ({escalation_reason})")
+            message = yield "per_document", doc_type, {**request, "model": route[-1]}
+            raw_data = _tool_input(message, TOOL_NAMES[doc_type])
+            extracted_data, errors = validate_extraction(doc_type, raw_data)
+            if errors:
+                # Single targeted repair call for the invalid fields only
+                repair = yield "repair", doc_type, _build_repair_request({**request, "model": route[-1]}, message, errors)
+                extracted_data = _apply_repair(doc_type, raw_data, _tool_input(repair, REPAIR_TOOL), errors)
+        _record_route(doc_type, escalation_reason, fast_tried=len(route) > 1)
+        _cache_store(doc_type, content_hash, extracted_data)
+        return extracted_data
     except Exception as e:
-        raise Exception(f"Error extracting data from image: {str(e)}")
+        raise Exception(f"{DOCUMENT_SCANS[doc_type]['error']}: {str(e)}")
+
+def _scan_document(doc_type, file_path, content_hash=None):
+    """Extract a document with the synchronous client."""
+    return _run_steps(_scan_steps(doc_type, file_path, content_hash))
+
+async def _scan_document_async(doc_type, file_path, content_hash=None):
+    """Extract a document with the shared async client, without blocking the event loop."""
+    return await _run_steps_async(_scan_steps(doc_type, file_path, content_hash))
+
+def scan_contravention(file_path, content_hash=None):
+    """
+    Extract structured data from a French traffic violation notice (avis de contravention).
+    
+    Args:
+        file_path (str): Path to the image or PDF file
+        content_hash (str, optional): SHA-256 of the file, if already known (extraction cache key)
+    
+    Returns:
+        dict: Structured data extracted from the traffic violation notice
+    
+    Raises:
+        Exception: If there's an error with the API call or data extraction
+    """
+    return _scan_document("contravention", file_path, content_hash)
 
-def scan_permis_conduire(file_path):
+async def scan_contravention_async(file_path, content_hash=None):
+    """Async variant of scan_contravention, backed by the shared AsyncAnthropic client."""
+    return await _scan_document_async("contravention", file_path, content_hash)
+
+def scan_permis_conduire(file_path, content_hash=None):
     """
     Extract structured data from a French driving license (permis de conduire).
     
     Args:
         file_path (str): Path to the image or PDF file
+        content_hash (str, optional): SHA-256 of the file, if already known (extraction cache key)
     
     Returns:
         dict: Structured data extracted from the driving license
@@ -122,86 +549,19 @@ def scan_permis_conduire(file_path):
     Raises:
         Exception: If there's an error with the API call or data extraction
     """
-    try:
-        # Convert file to base64 and get media type
-        file_data = file_to_base64(file_path)
-        image_base64 = file_data["base64_data"]
-        media_type = file_data["media_type"]
-        
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=2048,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "document" if media_type == "application/pdf" else "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": media_type,
-                                "data": image_base64,
-                            },
-                        },
-                        {
-                            "type": "text",
-                            "text": """Analyse cette image de permis de conduire français et extrais les informations suivantes au format JSON strict. Si une information n'est pas disponible, utilise "NONE".
-
-Structure JSON attendue:
-{
-  "identite": {
-    "nom": "nom de famille",
-    "prenom": "prénom(s)",
-    "date_naissance": "DD/MM/YYYY",
-    "lieu_naissance": "ville et pays de naissance"
-  },
-  "permis": {
-    "numero_permis": "numéro du permis",
-    "date_delivrance": "DD/MM/YYYY",
-    "date_expiration": "DD/MM/YYYY",
-    "autorite_delivrance": "préfecture ou autorité",
-    "categories": ["B", "A1", "etc."]
-  },
-  "adresse": {
-    "adresse_complete": "adresse complète",
-    "code_postal": "code postal",
-    "ville": "ville"
-  }
-}
+    return _scan_document("permis", file_path, content_hash)
 
-Retourne UNIQUEMENT le JSON, sans commentaire ni explication."""
-                        }
-                    ],
-                }
-            ],
-        )
-        
-        # Extract the JSON content from the response
-        response_text = message.content[0].text.strip()
-        
-        # Try to parse as JSON
-        try:
-            extracted_data = json.loads(response_text)
-            return extracted_data
-        except json.JSONDecodeError:
-            # If JSON parsing fails, try to extract JSON from the response
-            import re
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                extracted_data = json.loads(json_match.group())
-                return extracted_data
-            else:
-                raise Exception("Could not extract valid JSON from response")
-        
-    except Exception as e:
-        raise Exception(f"Error extracting data from license: {str(e)}")
+async def scan_permis_conduire_async(file_path, content_hash=None):
+    """Async variant of scan_permis_conduire, backed by the shared AsyncAnthropic client."""
+    return await _scan_document_async("permis", file_path, content_hash)
 
-def scan_certificat_immatriculation(file_path):
+def scan_certificat_immatriculation(file_path, content_hash=None):
     """
     Extract structured data from a French vehicle registration certificate (certificat d'immatriculation).
     
     Args:
         file_path (str): Path to the image or PDF file
+        content_hash (str, optional): SHA-256 of the file, if already known (extraction cache key)
     
     Returns:
         dict: Structured data extracted from the registration certificate
@@ -209,81 +569,19 @@ def scan_certificat_immatriculation(file_path):
     Raises:
         Exception: If there's an error with the API call or data extraction
     """
-    try:
-        # Convert file to base64 and get media type
-        file_data = file_to_base64(file_path)
-        image_base64 = file_data["base64_data"]
-        media_type = file_data["media_type"]
-        
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=4024,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "document" if media_type == "application/pdf" else "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": media_type,
-                                "data": image_base64,
-                            },
-                        },
-                        {
-                            "type": "text",
-                            "text": """Analyse cette image de certificat d'immatriculation français (carte grise) et extrais UNIQUEMENT les informations suivantes au format JSON strict. Si une information n'est pas disponible, utilise "NONE".
-
-Structure JSON attendue:
-{
-  "proprietaire": {
-    "nom": "nom de famille du propriétaire",
-    "prenom": "prénom du propriétaire"
-  },
-  "vehicule": {
-    "immatriculation": "numéro d'immatriculation au format XX-123-XX",
-    "marque": "marque du véhicule uniquement"
-  }
-}
+    return _scan_document("certificat", file_path, content_hash)
 
-IMPORTANT: 
-- Pour l'immatriculation, cherche le format XX-123-XX (2 lettres, 3 chiffres, 2 lettres)
-- Pour la marque, donne uniquement la marque (ex: PEUGEOT, RENAULT, etc.)
-- Ne pas inclure le modèle, juste la marque
-
-Retourne UNIQUEMENT le JSON, sans commentaire ni explication."""
-                        }
-                    ],
-                }
-            ],
-        )
-        
-        # Extract the JSON content from the response
-        response_text = message.content[0].text.strip()
-        
-        # Try to parse as JSON
-        try:
-            extracted_data = json.loads(response_text)
-            return extracted_data
-        except json.JSONDecodeError:
-            # If JSON parsing fails, try to extract JSON from the response
-            import re
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                extracted_data = json.loads(json_match.group())
-                return extracted_data
-            else:
-                raise Exception("Could not extract valid JSON from response")
-        
-    except Exception as e:
-        raise Exception(f"Error extracting data from registration certificate: {str(e)}")
+async def scan_certificat_immatriculation_async(file_path, content_hash=None):
+    """Async variant of scan_certificat_immatriculation, backed by the shared AsyncAnthropic client."""
+    return await _scan_document_async("certificat", file_path, content_hash)
 
-def scan_justificatif_domicile(file_path):
+def scan_justificatif_domicile(file_path, content_hash=None):
     """
     Extract structured data from a French proof of residence document (justificatif de domicile).
     
     Args:
         file_path (str): Path to the image or PDF file
+        content_hash (str, optional): SHA-256 of the file, if already known (extraction cache key)
     
     Returns:
         dict: Structured data extracted from the proof of residence document
@@ -291,133 +589,149 @@ def scan_justificatif_domicile(file_path):
     Raises:
         Exception: If there's an error with the API call or data extraction
     """
-    try:
-        # Convert file to base64 and get media type
-        file_data = file_to_base64(file_path)
-        image_base64 = file_data["base64_data"]
-        media_type = file_data["media_type"]
-        
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=4024,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "document" if media_type == "application/pdf" else "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": media_type,
-                                "data": image_base64,
-                            },
-                        },
-                        {
-                            "type": "text",
-                            "text": """Analyse cette image de justificatif de domicile français (facture, attestation, etc.) et extrais UNIQUEMENT les informations suivantes au format JSON strict. Si une information n'est pas disponible, utilise "NONE".
-
-Structure JSON attendue:
-{
-  "personne": {
-    "nom": "nom de famille de la personne",
-    "prenom": "prénom de la personne"
-  },
-  "domicile": {
-    "adresse": "adresse complète du domicile",
-    "date_justificatif": "date du justificatif (convertis au format: DD-MM-YYYY)"
-  }
-}
+    return _scan_document("domicile", file_path, content_hash)
 
-IMPORTANT: 
-- Cherche le nom et prénom du titulaire/destinataire du document
-- Pour l'adresse, donne l'adresse complète (rue, code postal, ville)
-- Pour la date, utilise le format exact trouvé sur le document (peut être une date de facture, d'émission, etc.)
+async def scan_justificatif_domicile_async(file_path, content_hash=None):
+    """Async variant of scan_justificatif_domicile, backed by the shared AsyncAnthropic client."""
+    return await _scan_document_async("domicile", file_path, content_hash)
 
-Retourne UNIQUEMENT le JSON, sans commentaire ni explication."""
-                        }
-                    ],
-                }
-            ],
-        )
-        
-        # Extract the JSON content from the response
-        response_text = message.content[0].text.strip()
-        
-        # Try to parse as JSON
-        try:
-            extracted_data = json.loads(response_text)
-            return extracted_data
-        except json.JSONDecodeError:
-            # If JSON parsing fails, try to extract JSON from the response
-            import re
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                extracted_data = json.loads(json_match.group())
-                return extracted_data
-            else:
-                raise Exception("Could not extract valid JSON from response")
-        
+def _reextract_paths(doc_type, extracted_data, fields):
+    """Fields to re-read: the requested ones (checked against the document), by default the invalid and missing ones."""
+    checks = assess_extraction(doc_type, extracted_data)
+    if not fields:
+        return checks, checks["failing"]
+    unknown = [path for path in fields if path not in checks["fields"]]
+    if unknown:
+        raise ValueError(f"Unknown fields for {doc_type}: {', '.join(unknown)}")
+    return checks, list(fields)
+
+def _build_reextract_request(doc_type, file_path, extracted_data, checks, paths, crop=None, fast=False):
+    """
+    Small request re-reading only some fields, from the whole document or a cropped region.
+    Tools and system prompt are those of the extraction, so the cached prefix is reused.
+    """
+    details = "\n".join(
+        f"- {path}: valeur actuelle {json.dumps(get_path(extracted_data, tuple(path.split('.'))), ensure_ascii=False)}"
+        + (f" ({checks['fields'][path]['reason']})" if checks["fields"][path]["reason"] else "")
+        for path in paths
+    )
+    region = "cette zone du document" if crop else "ce document"
+    return {
+        "model": SCAN_FAST_MODEL if fast else SCAN_MODEL,
+        "max_tokens": REEXTRACT_MAX_TOKENS,
+        "tools": extraction_tools(),
+        "tool_choice": {"type": "tool", "name": REPAIR_TOOL},
+        "system": system_prompt(),
+        "messages": [
+            {
+                "role": "user",
+                "content": _document_content(doc_type, file_path, crop) + [
+                    {
+                        "type": "text",
+                        "text": f"Relis dans {region} (modèle \"{doc_type}\", {get_template(doc_type)['title']}) "
+                                f"uniquement les champs suivants:\n{details}\n\n"
+                                f"Transmets leurs valeurs avec l'outil {REPAIR_TOOL}. "
+                                f"Utilise \"NONE\" si l'information n'est pas lisible.",
+                    }
+                ],
+            }
+        ],
+    }
+
+def _merge_reextracted(doc_type, extracted_data, checks, paths, repair_input):
+    """
+    Merge the re-read values of the requested fields. A new value is kept only if it is
+    valid for the schema and its check is not worse than the current value's.
+    """
+    merged = json.loads(json.dumps(extracted_data))
+    changes = {}
+    for field in repair_input.get("champs", []):
+        path = str(field.get("chemin", ""))
+        if path not in paths:
+            continue
+        candidate = json.loads(json.dumps(merged))
+        set_path(candidate, tuple(path.split(".")), field.get("valeur"))
+        validated, errors = validate_extraction(doc_type, candidate)
+        if errors:
+            logger.warning(f"{doc_type}: re-extracted value of {path} rejected: {errors[0]['error']}")
+            continue
+        new_check = assess_extraction(doc_type, validated)["fields"][path]
+        if new_check["confidence"] < checks["fields"][path]["confidence"]:
+            continue
+        changes[path] = {
+            "before": get_path(merged, tuple(path.split("."))),
+            "after": get_path(validated, tuple(path.split("."))),
+        }
+        merged = validated
+    return merged, changes
+
+def _reextract_steps(doc_type, file_path, extracted_data, fields, crop, fast, content_hash):
+    """Re-extraction pipeline (see _run_steps and reextract_fields)."""
+    checks, paths = _reextract_paths(doc_type, extracted_data, fields)
+    if not paths:
+        return {"data": extracted_data, "field_checks": checks, "reextracted": {}}
+    
+    request = _build_reextract_request(doc_type, file_path, extracted_data, checks, paths, crop, fast)
+    try:
+        message = yield "reextract", doc_type, request
+        data, changes = _merge_reextracted(doc_type, extracted_data, checks, paths, _tool_input(message, REPAIR_TOOL))
     except Exception as e:
-        raise Exception(f"Error extracting data from proof of residence: {str(e)}")
+        raise Exception(f"{DOCUMENT_SCANS[doc_type]['error']}: {str(e)}")
+    if changes:
+        _cache_store(doc_type, content_hash or hash_file(file_path), data)
+    return {"data": data, "field_checks": assess_extraction(doc_type, data), "reextracted": changes}
 
-def validate_documents_data(contravention_data=None, permis_data=None, certificat_data=None, justificatif_data=None):
+def reextract_fields(doc_type, file_path, extracted_data, fields=None, crop=None, fast=False, content_hash=None):
     """
-    Validate consistency between extracted document data using LLM analysis.
+    Re-read only some fields of an extracted document instead of rescanning it.
     
     Args:
-        contravention_data (dict): JSON data from traffic violation notice
-        permis_data (dict): JSON data from driving license
-        certificat_data (dict): JSON data from vehicle registration
-        justificatif_data (dict): JSON data from proof of residence
+        doc_type (str): contravention, permis, certificat or domicile
+        file_path (str): Path to the image or PDF file of the document
+        extracted_data (dict): Current extraction of the document
+        fields (list, optional): Paths of the fields to re-read (e.g. "infraction.vitesse_mesuree"),
+            by default the invalid and missing ones (see field_checks.assess_extraction)
+        crop (tuple, optional): (left, top, right, bottom) region of the first page, as fractions
+            of the page size, where the fields are printed
+        fast (bool): Use the cheaper SCAN_FAST_MODEL instead of SCAN_MODEL
+        content_hash (str, optional): SHA-256 of the file; the corrected extraction replaces the cached one
     
     Returns:
-        dict: Validation results with status and details
+        dict: {
+            "data": updated extraction,
+            "field_checks": assess_extraction() of the updated extraction,
+            "reextracted": {path: {"before", "after"}} for the fields whose value was replaced
+        }
+    
+    Raises:
+        ValueError: If a requested field does not exist for this document type, or the crop box is invalid
+        Exception: If there's an error with the API call
     """
-    try:
-        # Get current date
-        current_date = datetime.now().strftime("%d/%m/%Y")
-        
-        # Prepare data summary for LLM
-        data_summary = f"Date du jour: {current_date}\n\nDonnées extraites des documents:\n"
-        
-        found_names = []
-        justificatif_date = None
-        
-        if contravention_data and "identité" in contravention_data:
-            identite = contravention_data["identité"]
-            if identite.get("nom") and identite.get("nom") != "NONE":
-                name = f"{identite.get('nom', '')} {identite.get('prenom', '')}"
-                found_names.append(f"Contravention: {name}")
-                data_summary += f"- Contravention: {name}\n"
-        
-        if permis_data and "identite" in permis_data:
-            identite = permis_data["identite"]
-            if identite.get("nom") and identite.get("nom") != "NONE":
-                name = f"{identite.get('nom', '')} {identite.get('prenom', '')}"
-                found_names.append(f"Permis: {name}")
-                data_summary += f"- Permis de conduire: {name}\n"
-        
-        if certificat_data and "proprietaire" in certificat_data:
-            proprietaire = certificat_data["proprietaire"]
-            if proprietaire.get("nom") and proprietaire.get("nom") != "NONE":
-                name = f"{proprietaire.get('nom', '')} {proprietaire.get('prenom', '')}"
-                found_names.append(f"Certificat: {name}")
-                data_summary += f"- Certificat d'immatriculation: {name}\n"
-        
-        if justificatif_data and "personne" in justificatif_data:
-            personne = justificatif_data["personne"]
-            domicile = justificatif_data.get("domicile", {})
-            if personne.get("nom") and personne.get("nom") != "NONE":
-                name = f"{personne.get('nom', '')} {personne.get('prenom', '')}"
-                found_names.append(f"Justificatif: {name}")
-                justificatif_date = domicile.get("date_justificatif")
-                data_summary += f"- Justificatif de domicile: {name}"
-                if justificatif_date and justificatif_date != "NONE":
-                    data_summary += f", date: {justificatif_date}"
-                data_summary += "\n"
-        
-        # Create LLM prompt
-        prompt = f"""{data_summary}
+    return _run_steps(_reextract_steps(doc_type, file_path, extracted_data, fields, crop, fast, content_hash))
+
+async def reextract_fields_async(doc_type, file_path, extracted_data, fields=None, crop=None, fast=False, content_hash=None):
+    """Async variant of reextract_fields, backed by the shared AsyncAnthropic client."""
+    return await _run_steps_async(_reextract_steps(doc_type, file_path, extracted_data, fields, crop, fast, content_hash))
+
+def _build_validation_prompt(contravention_data, permis_data, certificat_data, justificatif_data):
+    """Build the cross-check prompt; returns (prompt, found_names)."""
+    # Get current date
+    current_date = datetime.now().strftime("%d/%m/%Y")
+    
+    # Prepare data summary for LLM
+    data_summary = f"Date du jour: {current_date}\n\nDonnées extraites des documents:\n"
+    
+    names, justificatif_date = collect_names(contravention_data, permis_data, certificat_data, justificatif_data)
+    found_names = []
+    for label, description, name in names:
+        found_names.append(f"{label}: {name}")
+        data_summary += f"- {description}: {name}"
+        if label == "Justificatif" and justificatif_date and justificatif_date != "NONE":
+            data_summary += f", date: {justificatif_date}"
+        data_summary += "\n"
+    
+    # Create LLM prompt
+    prompt = f"""{data_summary}
 
 Analyse ces données et vérifie:
 1. Les noms/prénoms sont-ils cohérents entre tous les documents (même personne) ?
@@ -440,71 +754,298 @@ Notes importantes:
 - Pour la date, accepte tous les formats français courants
 - Si pas de justificatif de domicile, date_valid = null
 - Si moins de 2 noms trouvés, names_consistent = null"""
+    
+    return prompt, found_names
+
+def _format_validation_result(response_text, found_names):
+    """Convert the model's answer into the validation_result structure used by the pipeline."""
+    try:
+        llm_result = _parse_json_response(response_text)
+    except Exception:
+        raise Exception("Could not parse LLM response as JSON")
+    
+    return _validation_result_from(llm_result, found_names)
+
+def _validation_result_from(llm_result, found_names):
+    """Build the validation_result structure from the model's parsed checks."""
+    # Format result in expected structure
+    return {
+        "validation_status": llm_result.get("overall_status", "WARNING"),
+        "checks": {
+            "names_consistency": {
+                "status": "VALID" if llm_result.get("names_consistent") == True else 
+                         "INVALID" if llm_result.get("names_consistent") == False else "NOT_CHECKED",
+                "details": llm_result.get("names_explanation", ""),
+                "found_names": llm_result.get("names_found", found_names)
+            },
+            "justificatif_date": {
+                "status": "VALID" if llm_result.get("date_valid") == True else 
+                         "INVALID" if llm_result.get("date_valid") == False else "NOT_CHECKED",
+                "date_found": llm_result.get("date_found"),
+                "details": llm_result.get("date_explanation", "")
+            }
+        },
+        "summary": llm_result.get("summary", "Validation effectuée")
+    }
 
+def _validation_error(e):
+    """Validation result returned when the check itself could not be performed."""
+    return {
+        "validation_status": "ERROR",
+        "checks": {
+            "names_consistency": {
+                "status": "ERROR",
+                "details": f"Erreur lors de la validation: {str(e)}",
+                "found_names": []
+            },
+            "justificatif_date": {
+                "status": "ERROR",
+                "date_found": None,
+                "details": f"Erreur lors de la validation: {str(e)}"
+            }
+        },
+        "summary": f"❌ Erreur de validation: {str(e)}"
+    }
+
+def _validate_locally(contravention_data, permis_data, certificat_data, justificatif_data):
+    """Run the deterministic checks; None when they are disabled or ambiguous and the model must decide."""
+    if not LOCAL_VALIDATION_ENABLED:
+        return None
+    checks = check_documents(contravention_data, permis_data, certificat_data, justificatif_data)
+    if checks is None:
+        record_validation("llm_fallback")
+        return None
+    record_validation("local")
+    return _validation_result_from(checks, checks["names_found"])
+
+def _validation_steps(contravention_data, permis_data, certificat_data, justificatif_data):
+    """Validation pipeline (see _run_steps): local checks, the model only when they are ambiguous."""
+    try:
+        local_result = _validate_locally(contravention_data, permis_data, certificat_data, justificatif_data)
+        if local_result is not None:
+            return local_result
+        
+        prompt, found_names = _build_validation_prompt(
+            contravention_data, permis_data, certificat_data, justificatif_data
+        )
+        
         # Call LLM
-        message = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=1024,
-            messages=[
+        message = yield "validation", None, {
+            "model": VALIDATION_MODEL,
+            "max_tokens": 1024,
+            "messages": [
                 {
                     "role": "user",
                     "content": prompt
                 }
             ]
-        )
+        }
         
-        response_text = message.content[0].text.strip()
+        return _format_validation_result(message.content[0].text.strip(), found_names)
         
-        # Parse LLM response
-        try:
-            llm_result = json.loads(response_text)
-        except json.JSONDecodeError:
-            # Try to extract JSON from response if it's wrapped
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                llm_result = json.loads(json_match.group())
-            else:
-                raise Exception("Could not parse LLM response as JSON")
+    except Exception as e:
+        return _validation_error(e)
+
+def validate_documents_data(contravention_data=None, permis_data=None, certificat_data=None, justificatif_data=None):
+    """
+    Validate consistency between extracted document data.
+    
+    Names and the proof of residence date are checked locally; LLM analysis is only
+    used when a check is ambiguous (close but different names, unrecognized date).
+    
+    Args:
+        contravention_data (dict): JSON data from traffic violation notice
+        permis_data (dict): JSON data from driving license
+        certificat_data (dict): JSON data from vehicle registration
+        justificatif_data (dict): JSON data from proof of residence
+    
+    Returns:
+        dict: Validation results with status and details
+    """
+    return _run_steps(_validation_steps(contravention_data, permis_data, certificat_data, justificatif_data))
+
+async def validate_documents_data_async(contravention_data=None, permis_data=None, certificat_data=None, justificatif_data=None):
+    """Async variant of validate_documents_data, backed by the shared AsyncAnthropic client."""
+    return await _run_steps_async(_validation_steps(contravention_data, permis_data, certificat_data, justificatif_data))
+
+# Key of each document in the batched answer -> argument of _build_validation_prompt
+BATCH_VALIDATION_ARGS = {
+    "contravention": "contravention_data",
+    "permis": "permis_data",
+    "certificat": "certificat_data",
+    "domicile": "justificatif_data",
+}
+
+BATCH_INSTRUCTIONS = """Transmets le résultat avec l'outil {tool}, qui contient:
+{keys}
+- "validation": la vérification croisée de tous les documents (y compris les données déjà extraites):
+  1. Les noms/prénoms sont-ils cohérents entre tous les documents (même personne) ?
+  2. Si il y a un justificatif de domicile avec une date, cette date fait-elle moins de 3 mois par rapport à aujourd'hui ?
+
+Notes importantes:
+- Pour les noms, considère les variations normales (majuscules/minuscules, tirets, espaces)
+- Pour la date, accepte tous les formats français courants
+- Si pas de justificatif de domicile, date_valid = null
+- Si moins de 2 noms trouvés, names_consistent = null"""
+
+def _validation_kwargs(extracted_data):
+    """Map extracted documents to the arguments of the validation functions."""
+    return {argument: extracted_data.get(doc_type) for doc_type, argument in BATCH_VALIDATION_ARGS.items()}
+
+def _batch_prompt_version(doc_type):
+    """Cache version of an extraction made by the batched request (distinct from single-document extractions)."""
+    fingerprint = f"batch|{_prompt_version(doc_type)}|{BATCH_INSTRUCTIONS}"
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:16]
+
+def _build_batch_request(file_paths, cached_data):
+    """
+    Build a single messages.create() request extracting every uncached document and
+    cross-checking all of them. Each document is labelled and pointed at its template
+    in the shared system prompt.
+    """
+    content = [{"type": "text", "text": f"Date du jour: {datetime.now().strftime('%d/%m/%Y')}\n\n"
+                                        f"Voici {len(file_paths)} documents d'un même dossier de contestation."}]
+    max_tokens = 1024
+    for doc_type, file_path in file_paths.items():
+        spec = DOCUMENT_SCANS[doc_type]
+        content.append({"type": "text", "text": f"Document \"{doc_type}\":"})
+        content.extend(_document_content(doc_type, file_path))
+        content.append({"type": "text", "text": f"Consignes pour le document \"{doc_type}\": applique le modèle \"{doc_type}\"."})
+        max_tokens += spec["max_tokens"]
+    
+    for doc_type, data in cached_data.items():
+        content.append({
+            "type": "text",
+            "text": f"Données déjà extraites du document \"{doc_type}\":\n{json.dumps(data, ensure_ascii=False)}"
+        })
+    
+    keys = "\n".join(f'- "{doc_type}": les données extraites du document "{doc_type}"' for doc_type in file_paths)
+    content.append({"type": "text", "text": BATCH_INSTRUCTIONS.format(tool=BATCH_TOOL, keys=keys)})
+    
+    return {
+        "model": SCAN_MODEL,
+        "max_tokens": max_tokens,
+        "tools": batch_tools(),
+        "tool_choice": {"type": "tool", "name": BATCH_TOOL},
+        "system": system_prompt(),
+        "messages": [{"role": "user", "content": content}],
+    }
+
+def _batch_lookup(file_paths, content_hashes):
+    """Split documents between cached extractions and documents to send; returns (cached, to_send, hashes)."""
+    cached_data, to_send, hashes = {}, {}, {}
+    for doc_type, file_path in file_paths.items():
+        cached, hashes[doc_type] = _cache_lookup(
+            doc_type, file_path, content_hashes.get(doc_type), _batch_prompt_version(doc_type)
+        )
+        if cached is not None:
+            cached_data[doc_type] = cached
+        else:
+            to_send[doc_type] = file_path
+    return cached_data, to_send, hashes
+
+def _batch_result(response, cached_data, to_send, hashes):
+    """
+    Merge the batched answer with cached extractions and cache the new ones. Documents
+    failing schema validation are left out, to be extracted (and repaired) individually.
+    """
+    results = dict(cached_data)
+    for doc_type in to_send:
+        extracted_data, errors = validate_extraction(doc_type, response.get(doc_type))
+        if errors:
+            logger.warning(f"Invalid {doc_type} in the batched answer: {', '.join(e['path'] or doc_type for e in errors)}")
+            continue
+        results[doc_type] = extracted_data
+        _cache_store(doc_type, hashes[doc_type], extracted_data, _batch_prompt_version(doc_type))
+    
+    found_names = _build_validation_prompt(
+        **_validation_kwargs(results)
+    )[1]
+    try:
+        checks = ValidationChecks.model_validate(response.get("validation")).model_dump()
+        results["validation_result"] = _validation_result_from(checks, found_names)
+    except ValueError as e:
+        logger.warning(f"Invalid validation in the batched answer, validating separately: {str(e)}")
+    return results
+
+def _batch_steps(file_paths, content_hashes):
+    """Batched pipeline (see _run_steps and scan_documents_batched)."""
+    try:
+        cached_data, to_send, hashes = _batch_lookup(file_paths, content_hashes)
+        if not to_send:
+            validation_result = yield from _validation_steps(**_validation_kwargs(cached_data))
+            return {**cached_data, "validation_result": validation_result}
         
-        # Format result in expected structure
-        validation_result = {
-            "validation_status": llm_result.get("overall_status", "WARNING"),
-            "checks": {
-                "names_consistency": {
-                    "status": "VALID" if llm_result.get("names_consistent") == True else 
-                             "INVALID" if llm_result.get("names_consistent") == False else "NOT_CHECKED",
-                    "details": llm_result.get("names_explanation", ""),
-                    "found_names": llm_result.get("names_found", found_names)
-                },
-                "justificatif_date": {
-                    "status": "VALID" if llm_result.get("date_valid") == True else 
-                             "INVALID" if llm_result.get("date_valid") == False else "NOT_CHECKED",
-                    "date_found": llm_result.get("date_found"),
-                    "details": llm_result.get("date_explanation", "")
-                }
-            },
-            "summary": llm_result.get("summary", "Validation effectuée")
-        }
+        message = yield "batched", None, _build_batch_request(to_send, cached_data)
+        return _batch_result(_tool_input(message, BATCH_TOOL), cached_data, to_send, hashes)
+    except Exception as e:
+        raise Exception(f"Error extracting documents in a single request: {str(e)}")
+
+def scan_documents_batched(file_paths, content_hashes=None):
+    """
+    Extract every document and check their consistency with a single model call.
+    
+    Documents already in the extraction cache are not sent again: their data is given
+    to the model as context for the cross-check. When all of them are cached, the
+    regular validation call is used instead.
+    
+    Args:
+        file_paths (dict): {doc_type: file_path} for contravention, permis, certificat, domicile
+        content_hashes (dict, optional): {doc_type: SHA-256} already computed at upload
+    
+    Returns:
+        dict: {doc_type: extracted_data, ..., "validation_result": dict}. A document missing
+        from the answer is absent from the result; "validation_result" is absent when the
+        answer contains no usable validation.
+    
+    Raises:
+        Exception: If the model call fails or does not use the extraction tool
+    """
+    return _run_steps(_batch_steps(file_paths, content_hashes or {}))
+
+async def scan_documents_batched_async(file_paths, content_hashes=None):
+    """Async variant of scan_documents_batched, backed by the shared AsyncAnthropic client."""
+    return await _run_steps_async(_batch_steps(file_paths, content_hashes or {}))
+
+def benchmark_scan_modes(file_paths):
+    """
+    Run both scan modes on the same documents, bypassing the extraction cache, and
+    compare latency and token usage.
+    
+    Args:
+        file_paths (dict): {doc_type: file_path}
+    
+    Returns:
+        dict: {"per_document": {...}, "batched": {...}} with latency_s, input_tokens, output_tokens and calls
+    """
+    import extraction_cache
+    
+    def usage_delta(before, after):
+        delta = {"calls": 0, "input_tokens": 0, "output_tokens": 0}
+        for kind, stats in after.items():
+            for key in delta:
+                delta[key] += stats[key] - before.get(kind, {}).get(key, 0)
+        return delta
+    
+    saved_cache_setting = extraction_cache.EXTRACTION_CACHE_ENABLED
+    extraction_cache.EXTRACTION_CACHE_ENABLED = False
+    try:
+        results = {}
         
-        return validation_result
+        before, started_at = get_scan_stats(), time.monotonic()
+        extracted = {doc_type: _scan_document(doc_type, path) for doc_type, path in file_paths.items()}
+        validate_documents_data(
+            **_validation_kwargs(extracted)
+        )
+        results["per_document"] = {"latency_s": time.monotonic() - started_at, **usage_delta(before, get_scan_stats())}
         
-    except Exception as e:
-        return {
-            "validation_status": "ERROR",
-            "checks": {
-                "names_consistency": {
-                    "status": "ERROR",
-                    "details": f"Erreur lors de la validation: {str(e)}",
-                    "found_names": []
-                },
-                "justificatif_date": {
-                    "status": "ERROR",
-                    "date_found": None,
-                    "details": f"Erreur lors de la validation: {str(e)}"
-                }
-            },
-            "summary": f"❌ Erreur de validation: {str(e)}"
-        }
+        before, started_at = get_scan_stats(), time.monotonic()
+        scan_documents_batched(file_paths)
+        results["batched"] = {"latency_s": time.monotonic() - started_at, **usage_delta(before, get_scan_stats())}
+        
+        return results
+    finally:
+        extraction_cache.EXTRACTION_CACHE_ENABLED = saved_cache_setting
 
 def file_to_base64(file_path):
     """
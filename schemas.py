@@ -0,0 +1,311 @@
+"""
+Typed schemas of the extracted documents, used for tool-use structured output.
+
+Each document type has a Pydantic model whose JSON schema is given to the model as a
+tool: the answer arrives as already-parsed tool input instead of free text, and is
+validated in one pass. Field names and nesting are those of the extraction prompts
+(including the "identité" and "réglements" keys), and every leaf accepts "NONE", the
+value used for unavailable information. Fields that fail validation are reported by
+path so that a single repair call can target them (see REPAIR_TOOL).
+
+Tools come first in the cached prompt prefix, so every single-document request sends
+the same tool list (the four extraction tools and the repair tool) and picks its tool
+with tool_choice.
+"""
+
+import hashlib
+import json
+import re
+from typing import Annotated, List, Literal, Optional, Union
+
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, ValidationError
+
+NONE = "NONE"
+
+def _to_text(value):
+    if value is None:
+        return NONE
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return value
+
+def _to_number(value):
+    if value is None:
+        return NONE
+    if isinstance(value, str) and value.strip().upper() != NONE:
+        # "50 km/h", "12,5"
+        match = re.fullmatch(r"\s*(-?\d+(?:[.,]\d+)?)\s*(?:km/?h)?\s*", value, re.IGNORECASE)
+        if match:
+            number = float(match.group(1).replace(",", "."))
+            return int(number) if number.is_integer() else number
+    return value
+
+Text = Annotated[str, BeforeValidator(_to_text)]
+Number = Annotated[Union[int, float, Literal["NONE"]], BeforeValidator(_to_number)]
+
+class _Section(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+# Avis de contravention
+
+class ContraventionIdentite(_Section):
+    nom: Text = Field(description="nom de la personne verbalisée")
+    prenom: Text = Field(description="prénom de la personne verbalisée")
+    adresse: Text = Field(description="adresse de la personne verbalisée")
+
+class Infraction(_Section):
+    numero_avis: Text = Field(description="numéro de l'avis de contravention")
+    date_heure: Text = Field(description="date et heure de l'infraction (format exact trouvé)")
+    format_date: Text = Field(description="DD/MM/YYYY:HHhMM")
+    route: Text = Field(description="nom de la route (ex: D938, A10, etc.)")
+    exces_vitesse_kmh: Number = Field(description="vitesse mesurée - vitesse autorisée")
+    vitesse_maximale_autorisee: Number
+    vitesse_mesuree: Number
+
+class IdentificationVehicule(_Section):
+    immatriculation: Text = Field(description="numéro d'immatriculation")
+    pays: Text = Field(description="pays d'immatriculation")
+    marque: Text = Field(description="marque du véhicule")
+
+class AppareilControle(_Section):
+    type: Text = Field(description="type d'appareil de contrôle")
+    date_derniere_verification: Text = Field(description="date de dernière vérification")
+
+class AgentVerbalisateur(_Section):
+    agent_verbalisateur: Text = Field(description="numéro de l'agent verbalisateur")
+    service: Text = Field(description="nom du service verbalisateur")
+
+class Reglements(_Section):
+    date_15j: Text = Field(description="date à compter de laquelle la personne doit payer dans les 15 jours")
+    adresse_demarche: Text = Field(description="adresse à laquelle adresser les requêtes par lettre recommandée")
+
+class ContraventionData(_Section):
+    identite: ContraventionIdentite = Field(alias="identité")
+    infraction: Infraction
+    identification_vehicule: IdentificationVehicule
+    appareil_controle: AppareilControle
+    agent_verbalisateur: AgentVerbalisateur
+    reglements: Reglements = Field(alias="réglements")
+
+# Permis de conduire
+
+class PermisIdentite(_Section):
+    nom: Text = Field(description="nom de famille")
+    prenom: Text = Field(description="prénom(s)")
+    date_naissance: Text = Field(description="DD/MM/YYYY")
+    lieu_naissance: Text = Field(description="ville et pays de naissance")
+
+class Permis(_Section):
+    numero_permis: Text = Field(description="numéro du permis")
+    date_delivrance: Text = Field(description="DD/MM/YYYY")
+    date_expiration: Text = Field(description="DD/MM/YYYY")
+    autorite_delivrance: Text = Field(description="préfecture ou autorité")
+    categories: Union[List[Text], Literal["NONE"]] = Field(description="catégories du permis (B, A1, etc.)")
+
+class PermisAdresse(_Section):
+    adresse_complete: Text = Field(description="adresse complète")
+    code_postal: Text = Field(description="code postal")
+    ville: Text = Field(description="ville")
+
+class PermisData(_Section):
+    identite: PermisIdentite
+    permis: Permis
+    adresse: PermisAdresse
+
+# Certificat d'immatriculation
+
+class Proprietaire(_Section):
+    nom: Text = Field(description="nom de famille du propriétaire")
+    prenom: Text = Field(description="prénom du propriétaire")
+
+class Vehicule(_Section):
+    immatriculation: Text = Field(description="numéro d'immatriculation au format XX-123-XX")
+    marque: Text = Field(description="marque du véhicule uniquement")
+
+class CertificatData(_Section):
+    proprietaire: Proprietaire
+    vehicule: Vehicule
+
+# Justificatif de domicile
+
+class Personne(_Section):
+    nom: Text = Field(description="nom de famille de la personne")
+    prenom: Text = Field(description="prénom de la personne")
+
+class Domicile(_Section):
+    adresse: Text = Field(description="adresse complète du domicile")
+    date_justificatif: Text = Field(description="date du justificatif")
+
+class DomicileData(_Section):
+    personne: Personne
+    domicile: Domicile
+
+# Cross-document checks (batched mode)
+
+class ValidationChecks(_Section):
+    names_consistent: Optional[bool] = Field(description="noms cohérents entre les documents (null si moins de 2 noms)")
+    names_explanation: str = Field(description="explication détaillée de l'analyse des noms")
+    names_found: List[str] = Field(description="noms trouvés, au format \"Document: NOM Prénom\"")
+    date_valid: Optional[bool] = Field(description="justificatif de moins de 3 mois (null si pas de date)")
+    date_explanation: Optional[str] = Field(description="explication de la vérification de date")
+    date_found: Optional[str] = Field(description="date du justificatif de domicile")
+    overall_status: Literal["VALID", "INVALID", "WARNING"]
+    summary: str = Field(description="résumé avec emojis")
+
+DOCUMENT_SCHEMAS = {
+    "contravention": ContraventionData,
+    "permis": PermisData,
+    "certificat": CertificatData,
+    "domicile": DomicileData,
+}
+
+TOOL_NAMES = {doc_type: f"extraire_{doc_type}" for doc_type in DOCUMENT_SCHEMAS}
+BATCH_TOOL = "extraire_documents"
+REPAIR_TOOL = "corriger_champs"
+
+def _strip_titles(schema):
+    # Pydantic titles repeat the field names: drop them to keep the tool definitions short
+    if isinstance(schema, dict):
+        return {key: _strip_titles(value) for key, value in schema.items()
+                if not (key == "title" and isinstance(value, str))}
+    if isinstance(schema, list):
+        return [_strip_titles(value) for value in schema]
+    return schema
+
+def _json_schema(model):
+    return _strip_titles(model.model_json_schema(by_alias=True))
+
+def _batch_schema():
+    definitions, properties = {}, {}
+    for doc_type, model in {**DOCUMENT_SCHEMAS, "validation": ValidationChecks}.items():
+        schema = _json_schema(model)
+        definitions.update(schema.pop("$defs", {}))
+        definitions[model.__name__] = schema
+        properties[doc_type] = {"$ref": f"#/$defs/{model.__name__}"}
+    return {"type": "object", "properties": properties, "required": ["validation"], "$defs": definitions}
+
+REPAIR_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "champs": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "chemin": {"type": "string", "description": "chemin du champ signalé, ex: infraction.vitesse_mesuree"},
+                    "valeur": {"description": "valeur corrigée, conforme au schéma du champ, ou \"NONE\""},
+                },
+                "required": ["chemin", "valeur"],
+            },
+        }
+    },
+    "required": ["champs"],
+}
+
+def extraction_tools():
+    """
+    Tools of a single-document extraction or re-extraction, identical for every document
+    type: the extraction tool of each type and the repair tool.
+
+    Returns:
+        list: Tool definitions for the "tools" argument of messages.create()
+    """
+    return [
+        {
+            "name": TOOL_NAMES[doc_type],
+            "description": f"Transmet les données extraites d'un document de type {doc_type}.",
+            "input_schema": _json_schema(model),
+        }
+        for doc_type, model in DOCUMENT_SCHEMAS.items()
+    ] + [
+        {
+            "name": REPAIR_TOOL,
+            "description": "Transmet uniquement les valeurs corrigées des champs signalés comme invalides.",
+            "input_schema": REPAIR_SCHEMA,
+        },
+    ]
+
+def batch_tools():
+    """Tool of the batched extraction: every document type plus the cross-document checks."""
+    return [{
+        "name": BATCH_TOOL,
+        "description": "Transmet les données extraites de plusieurs documents et leur vérification croisée.",
+        "input_schema": _batch_schema(),
+    }]
+
+def schema_fingerprint():
+    """Hash of every tool schema; part of the prompt version, so a schema change invalidates cached extractions."""
+    tools = [extraction_tools(), batch_tools()]
+    return hashlib.sha256(json.dumps(tools, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def _field(model, key):
+    return next((field for name, field in model.model_fields.items() if key in (name, field.alias)), None)
+
+def _section_model(field):
+    annotation = field.annotation
+    return annotation if isinstance(annotation, type) and issubclass(annotation, BaseModel) else None
+
+def _error_path(model, loc):
+    # Keep the schema fields of the location: errors inside a list or a union member are repaired as a whole field
+    path = []
+    for part in loc:
+        field = _field(model, part) if model is not None else None
+        if field is None:
+            break
+        path.append(part)
+        model = _section_model(field)
+    return tuple(path)
+
+def validate_extraction(doc_type, data):
+    """
+    Validate an extraction against the schema of its document type.
+
+    Args:
+        doc_type (str): contravention, permis, certificat or domicile
+        data (dict): Tool input returned by the model
+
+    Returns:
+        tuple: (validated_data, errors). validated_data is the normalized dict (same keys as
+        the prompts) or None; errors is a list of {"path", "error", "value"} for invalid fields
+    """
+    if not isinstance(data, dict):
+        return None, [{"path": "", "error": "Document absent de la réponse", "value": data}]
+    try:
+        return DOCUMENT_SCHEMAS[doc_type].model_validate(data).model_dump(by_alias=True), []
+    except ValidationError as e:
+        errors = {}
+        for error in e.errors():
+            path = _error_path(DOCUMENT_SCHEMAS[doc_type], error["loc"])
+            if path not in errors:
+                errors[path] = {"path": ".".join(path), "error": error["msg"], "value": get_path(data, path)}
+        return None, list(errors.values())
+
+def get_path(data, path):
+    """Value at a dotted path (tuple of keys), or None if absent."""
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+def set_path(data, path, value):
+    """Set the value at a path (tuple of keys), creating missing sections."""
+    for key in path[:-1]:
+        if not isinstance(data.get(key), dict):
+            data[key] = {}
+        data = data[key]
+    data[path[-1]] = value
+
+def _unavailable(model):
+    return {
+        field.alias or name: _unavailable(_section_model(field)) if _section_model(field) else NONE
+        for name, field in model.model_fields.items()
+    }
+
+def unavailable_value(doc_type, path):
+    """Value standing for missing information at a path: "NONE" for a field, a section of "NONE" for a section."""
+    model = DOCUMENT_SCHEMAS[doc_type]
+    for key in path:
+        field = _field(model, key) if model is not None else None
+        model = _section_model(field) if field is not None else None
+    return _unavailable(model) if model is not None else NONE
@@ -0,0 +1,241 @@
+"""
+Remplissage scripté du formulaire de demande de cliché
+
+La mise en page du formulaire est fixe: plutôt que de faire explorer chaque page par
+l'agent browser-use (plusieurs appels au modèle de vision par demande), les données
+extraites sont saisies directement dans des sélecteurs connus, puis le formulaire est
+envoyé et la confirmation lue. Si un sélecteur est introuvable (formulaire modifié,
+page d'erreur...) avant l'envoi, fill_website_form se rabat sur l'agent.
+
+form_standin.html est une réplique locale du formulaire avec les mêmes sélecteurs:
+FORM_TEST_MODE=1 fait pointer le remplissage dessus, pour tester et mesurer le
+script sans réseau (python scripted_form.py --benchmark).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from browser_pool import browser_session
+
+logger = logging.getLogger(__name__)
+
+FORM_TEST_MODE = os.getenv("FORM_TEST_MODE", "0") == "1"
+# Sélecteurs relevés sur la réplique locale: le remplissage scripté n'est actif par défaut
+# qu'en FORM_TEST_MODE, SCRIPTED_FORM_ENABLED=1 l'active sur le vrai site une fois les sélecteurs vérifiés
+SCRIPTED_FORM_ENABLED = os.getenv("SCRIPTED_FORM_ENABLED", "1" if FORM_TEST_MODE else "0") == "1"
+FORM_LOAD_TIMEOUT = float(os.getenv("FORM_LOAD_TIMEOUT", "20"))
+FORM_CONFIRMATION_TIMEOUT = float(os.getenv("FORM_CONFIRMATION_TIMEOUT", "30"))
+FORM_POLL_INTERVAL = 0.2
+
+STANDIN_FORM_PATH = Path(__file__).parent / "form_standin.html"
+STANDIN_FORM_URL = STANDIN_FORM_PATH.resolve().as_uri()
+
+# Champs du formulaire: (nom, sélecteur, action). Les sélecteurs sont ceux de form_standin.html
+FORM_FIELDS = [
+    ("numero_avis", "#numero_avis", "fill"),
+    ("date_infraction", "#date_infraction", "fill"),
+    ("heure_infraction", "#heure_infraction", "fill"),
+    ("immatriculation", "#immatriculation", "fill"),
+    ("qualite", "#qualite", "select"),
+    ("nom", "#nom", "fill"),
+    ("prenom", "#prenom", "fill"),
+    ("adresse", "#adresse", "fill"),
+    ("email", "#email", "fill"),
+    ("consentement", "#consentement", "check"),
+]
+OPTIONAL_FIELDS = {"heure_infraction"}
+SUBMIT_SELECTOR = "#envoyer"
+CONFIRMATION_SELECTOR = "#confirmation"
+ERROR_SELECTOR = "#erreur"
+
+# Texte visible de la confirmation et du message d'erreur du formulaire
+_READ_OUTCOME = """(confirmationSelector, errorSelector) => {
+    const text = (selector) => {
+        const element = document.querySelector(selector);
+        return element && !element.hidden ? element.innerText : "";
+    };
+    return JSON.stringify({confirmation: text(confirmationSelector), erreur: text(errorSelector)});
+}"""
+
+_stats = {"scripted": 0, "fallbacks": 0, "errors": 0, "total_duration_s": 0.0, "fallback_reasons": {}}
+_stats_lock = threading.Lock()
+
+class ScriptedFormError(Exception):
+    """Échec du remplissage scripté; submitted indique si le formulaire avait déjà été envoyé"""
+
+    def __init__(self, message: str, submitted: bool = False):
+        super().__init__(message)
+        self.submitted = submitted
+
+def _known(value) -> Optional[str]:
+    if value is None or str(value).strip().upper() in ("", "NONE"):
+        return None
+    return str(value).strip()
+
+def form_values(validated_data: dict, email: str) -> dict:
+    """
+    Valeurs à saisir dans chaque champ du formulaire, à partir des données extraites.
+    Lève ScriptedFormError si une valeur obligatoire est absente.
+    """
+    contravention = validated_data.get("contravention") or {}
+    infraction = contravention.get("infraction") or {}
+    permis = validated_data.get("permis") or {}
+    certificat = validated_data.get("certificat") or {}
+    domicile = validated_data.get("domicile") or {}
+    identite = permis.get("identite") or contravention.get("identité") or {}
+
+    date_heure = _known(infraction.get("date_heure")) or ""
+    date_match = re.search(r"\d{2}/\d{2}/\d{4}", date_heure)
+    time_match = re.search(r"(\d{1,2})\s*[h:]\s*(\d{2})", date_heure[date_match.end():] if date_match else date_heure)
+
+    values = {
+        "numero_avis": (_known(infraction.get("numero_avis")) or "").replace(" ", "") or None,
+        "date_infraction": date_match.group(0) if date_match else None,
+        "heure_infraction": f"{int(time_match.group(1)):02d}:{time_match.group(2)}" if time_match else None,
+        "immatriculation": _known((certificat.get("vehicule") or {}).get("immatriculation"))
+                           or _known((contravention.get("identification_vehicule") or {}).get("immatriculation")),
+        "qualite": "titulaire",
+        "nom": _known(identite.get("nom")),
+        "prenom": _known(identite.get("prenom")),
+        "adresse": _known((domicile.get("domicile") or {}).get("adresse"))
+                   or _known((permis.get("adresse") or {}).get("adresse_complete")),
+        "email": email,
+        "consentement": True,
+    }
+    missing = [name for name, _, _ in FORM_FIELDS if values.get(name) is None and name not in OPTIONAL_FIELDS]
+    if missing:
+        raise ScriptedFormError(f"Données manquantes pour le formulaire: {', '.join(missing)}")
+    return values
+
+async def _element(page, selector: str, timeout: float = 0):
+    """Premier élément correspondant au sélecteur, en attendant au plus timeout secondes"""
+    deadline = time.monotonic() + timeout
+    while True:
+        elements = await page.get_elements_by_css_selector(selector)
+        if elements:
+            return elements[0]
+        if time.monotonic() >= deadline:
+            raise ScriptedFormError(f"Sélecteur introuvable: {selector}")
+        await asyncio.sleep(FORM_POLL_INTERVAL)
+
+async def run_form_script(page, values: dict, url: str) -> str:
+    """
+    Saisit les valeurs dans le formulaire, l'envoie et retourne le texte de confirmation.
+
+    Args:
+        page: Page browser-use (goto, get_elements_by_css_selector, evaluate)
+        values (dict): Valeurs par champ (cf. form_values)
+        url (str): Adresse du formulaire
+    """
+    await page.goto(url)
+    await _element(page, FORM_FIELDS[0][1], timeout=FORM_LOAD_TIMEOUT)
+
+    for name, selector, action in FORM_FIELDS:
+        value = values.get(name)
+        if value is None:
+            continue
+        element = await _element(page, selector)
+        if action == "fill":
+            await element.fill(value)
+        elif action == "select":
+            await element.select_option(value)
+        elif action == "check":
+            await element.check()
+
+    submit = await _element(page, SUBMIT_SELECTOR)
+    try:
+        await submit.click()
+        return await _read_outcome(page)
+    except ScriptedFormError:
+        raise
+    except Exception as e:
+        # Le clic a pu envoyer le formulaire: le relancer avec l'agent ferait une demande en double
+        raise ScriptedFormError(f"Issue de l'envoi inconnue: {str(e)}", submitted=True)
+
+async def _read_outcome(page) -> str:
+    """Attend la confirmation (ou le message d'erreur) affichée après l'envoi"""
+    deadline = time.monotonic() + FORM_CONFIRMATION_TIMEOUT
+    while time.monotonic() < deadline:
+        outcome = json.loads(await page.evaluate(_READ_OUTCOME, CONFIRMATION_SELECTOR, ERROR_SELECTOR) or "{}")
+        if outcome.get("erreur"):
+            raise ScriptedFormError(f"Formulaire refusé: {outcome['erreur']}", submitted=True)
+        if outcome.get("confirmation"):
+            return outcome["confirmation"]
+        await asyncio.sleep(FORM_POLL_INTERVAL)
+    raise ScriptedFormError("Pas de confirmation après l'envoi du formulaire", submitted=True)
+
+async def fill_form_scripted(validated_data: dict, email: str, url: str) -> dict:
+    """
+    Remplit et envoie le formulaire sans agent, dans un navigateur du pool.
+
+    Returns:
+        dict: Même format que fill_website_form, avec "mode": "scripted"
+
+    Raises:
+        ScriptedFormError: Données manquantes, sélecteur introuvable ou envoi refusé
+    """
+    values = form_values(validated_data, email)
+    started_at = time.monotonic()
+    async with browser_session() as session:
+        page = await session.must_get_current_page()
+        try:
+            confirmation = await run_form_script(page, values, url)
+        except ScriptedFormError:
+            raise
+        except Exception as e:
+            # Erreur du navigateur pendant la saisie, avant le clic d'envoi (cf. run_form_script)
+            raise ScriptedFormError(f"Saisie impossible: {str(e)}")
+    duration = time.monotonic() - started_at
+    record_form_fill("scripted", duration=duration)
+    logger.info(f"Formulaire rempli par script en {duration:.1f}s")
+    return {
+        "status": "success",
+        "mode": "scripted",
+        "formulaire_rempli": True,
+        "email_avocat": email,
+        "message": "Formulaire rempli et demande de cliché envoyée",
+        "result_details": confirmation,
+        "duration_s": duration,
+    }
+
+def record_form_fill(outcome: str, reason: str = None, duration: float = 0.0) -> None:
+    """Compte un remplissage scripté ("scripted"), un repli sur l'agent ("fallbacks") ou un échec ("errors")"""
+    with _stats_lock:
+        _stats[outcome] += 1
+        _stats["total_duration_s"] += duration
+        if reason:
+            _stats["fallback_reasons"][reason] = _stats["fallback_reasons"].get(reason, 0) + 1
+
+def get_form_stats() -> dict:
+    """Nombre de formulaires remplis par script, de replis sur l'agent (avec leur motif) et d'échecs"""
+    with _stats_lock:
+        stats = {**_stats, "fallback_reasons": dict(_stats["fallback_reasons"])}
+    stats["average_scripted_duration_s"] = stats["total_duration_s"] / stats["scripted"] if stats["scripted"] else None
+    return stats
+
+async def benchmark_scripted_form(validated_data: dict, runs: int = 5) -> dict:
+    """Mesure le remplissage scripté sur la réplique locale du formulaire (hors ligne)"""
+    durations = []
+    for _ in range(runs):
+        result = await fill_form_scripted(validated_data, "avocat@example.com", STANDIN_FORM_URL)
+        durations.append(result["duration_s"])
+    return {"runs": runs, "average_s": sum(durations) / runs, "min_s": min(durations), "max_s": max(durations)}
+
+if __name__ == "__main__":
+    import sys
+
+    sample = {
+        "contravention": {"infraction": {"numero_avis": "1234567890", "date_heure": "15/01/2024 14h32"}},
+        "certificat": {"vehicule": {"immatriculation": "AB-123-CD"}},
+        "permis": {"identite": {"nom": "DUPONT", "prenom": "Jean"}},
+        "domicile": {"domicile": {"adresse": "12 rue de la Paix, 75002 Paris"}},
+    }
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[1] == "--benchmark" else 1
+    print(json.dumps(asyncio.run(benchmark_scripted_form(sample, runs)), indent=2))
@@ -0,0 +1,47 @@
+"""
+Diffusion en temps réel des changements de statut des tâches
+
+Chaque appel à update_task_status publie l'état complet de la tâche aux abonnés du
+processus courant (flux Server-Sent Events de /api/v1/task/{task_id}/events).
+Les mises à jour faites dans un autre processus (workers séparés, autre instance)
+ne passent pas par ce canal: le flux SSE les récupère en relisant le stockage des tâches.
+"""
+
+import asyncio
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Set, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+class TaskEventBroker:
+    """Diffusion des mises à jour de tâches aux abonnés d'un même processus"""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = defaultdict(set)
+
+    def publish(self, task: dict) -> None:
+        """Envoie l'état d'une tâche à tous ses abonnés"""
+        for loop, queue in list(self._subscribers.get(task["task_id"], ())):
+            try:
+                running_loop = asyncio.get_running_loop()
+            except RuntimeError:
+                running_loop = None
+            if running_loop is loop:
+                queue.put_nowait(dict(task))
+            else:
+                # Publication depuis un thread: passer par la boucle de l'abonné
+                loop.call_soon_threadsafe(queue.put_nowait, dict(task))
+
+    @contextmanager
+    def subscribe(self, task_id: str):
+        """Abonnement aux mises à jour d'une tâche; fournit une asyncio.Queue d'états"""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        self._subscribers[task_id].add(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            self._subscribers[task_id].discard(subscriber)
+            if not self._subscribers[task_id]:
+                del self._subscribers[task_id]
@@ -0,0 +1,295 @@
+"""
+Stockage des tâches de traitement
+
+Remplace le dictionnaire en mémoire de app.py par une interface commune et plusieurs
+implémentations (mémoire, SQLite, Redis) pour que le statut des tâches survive aux
+redémarrages et soit partagé entre plusieurs workers uvicorn.
+Les tâches terminées expirent après TASK_FINISHED_TTL secondes, les tâches en cours
+(ex: worker arrêté brutalement) après TASK_ACTIVE_TTL secondes.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+TASK_STORE_URL = os.getenv("TASK_STORE_URL", "sqlite:///data/tasks.db")
+TASK_FINISHED_TTL = int(os.getenv("TASK_FINISHED_TTL", str(24 * 3600)))
+TASK_ACTIVE_TTL = int(os.getenv("TASK_ACTIVE_TTL", str(7 * 24 * 3600)))
+
+# Statuts après lesquels une tâche n'évolue plus
+FINISHED_STATUSES = {"COMPLETED", "FAILED"}
+
+# Champs datetime à reconvertir après désérialisation
+DATETIME_FIELDS = ("created_at", "updated_at")
+
+# Nombre de tentatives d'une mise à jour Redis concurrencée par un autre worker
+REDIS_UPDATE_ATTEMPTS = 10
+
+class TaskStoreError(Exception):
+    """Exception levée lorsque le stockage des tâches est mal configuré ou indisponible"""
+    pass
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def _serialize(task: dict) -> str:
+    return json.dumps(task, ensure_ascii=False, default=_json_default)
+
+def _deserialize(data) -> dict:
+    task = json.loads(data)
+    for field in DATETIME_FIELDS:
+        if isinstance(task.get(field), str):
+            task[field] = datetime.fromisoformat(task[field])
+    return task
+
+def _apply_update(task: dict, fields: dict, merge: dict = None) -> dict:
+    """Remplace les champs de fields puis fusionne les dictionnaires de merge dans ceux de la tâche"""
+    task.update(fields)
+    for field, values in (merge or {}).items():
+        task[field] = {**(task.get(field) or {}), **values}
+    return task
+
+class TaskStore:
+    """Interface commune des stockages de tâches"""
+
+    def __init__(self, finished_ttl: int = TASK_FINISHED_TTL, active_ttl: int = TASK_ACTIVE_TTL):
+        self.finished_ttl = finished_ttl
+        self.active_ttl = active_ttl
+
+    def ttl_for(self, task: dict) -> int:
+        """Durée de conservation (en secondes) d'une tâche selon son statut"""
+        return self.finished_ttl if task.get("status") in FINISHED_STATUSES else self.active_ttl
+
+    def create(self, task: dict) -> None:
+        """Enregistre une nouvelle tâche"""
+        raise NotImplementedError
+
+    def get(self, task_id: str) -> Optional[dict]:
+        """Récupère une tâche, ou None si elle n'existe pas ou a expiré"""
+        raise NotImplementedError
+
+    def update(self, task_id: str, fields: dict, merge: dict = None) -> Optional[dict]:
+        """
+        Met à jour une partie des champs d'une tâche et retourne la tâche complète.
+        merge ({champ: {clé: valeur}}) complète les dictionnaires existants au lieu de les
+        remplacer, dans la même opération atomique que fields.
+        """
+        raise NotImplementedError
+
+    def delete(self, task_id: str) -> bool:
+        """Supprime une tâche; retourne False si elle n'existait pas"""
+        raise NotImplementedError
+
+    def list(self) -> List[dict]:
+        """Liste toutes les tâches non expirées"""
+        raise NotImplementedError
+
+class MemoryTaskStore(TaskStore):
+    """Stockage en mémoire du processus (développement et tests, un seul worker)"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._tasks: Dict[str, dict] = {}
+        self._expires_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _purge_expired(self) -> None:
+        now = time.time()
+        for task_id in [task_id for task_id, expires_at in self._expires_at.items() if expires_at <= now]:
+            self._tasks.pop(task_id, None)
+            self._expires_at.pop(task_id, None)
+
+    def create(self, task: dict) -> None:
+        with self._lock:
+            self._purge_expired()
+            self._tasks[task["task_id"]] = dict(task)
+            self._expires_at[task["task_id"]] = time.time() + self.ttl_for(task)
+
+    def get(self, task_id: str) -> Optional[dict]:
+        with self._lock:
+            self._purge_expired()
+            task = self._tasks.get(task_id)
+            return dict(task) if task is not None else None
+
+    def update(self, task_id: str, fields: dict, merge: dict = None) -> Optional[dict]:
+        with self._lock:
+            self._purge_expired()
+            task = self._tasks.get(task_id)
+            if task is None:
+                return None
+            _apply_update(task, fields, merge)
+            self._expires_at[task_id] = time.time() + self.ttl_for(task)
+            return dict(task)
+
+    def delete(self, task_id: str) -> bool:
+        with self._lock:
+            self._expires_at.pop(task_id, None)
+            return self._tasks.pop(task_id, None) is not None
+
+    def list(self) -> List[dict]:
+        with self._lock:
+            self._purge_expired()
+            return [dict(task) for task in self._tasks.values()]
+
+class SQLiteTaskStore(TaskStore):
+    """Stockage persistant dans un fichier SQLite, partagé entre les workers d'une même machine"""
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = str(path)
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_expires_at ON tasks (expires_at)")
+
+    def _purge_expired(self) -> None:
+        self._conn.execute("DELETE FROM tasks WHERE expires_at <= ?", (time.time(),))
+
+    def create(self, task: dict) -> None:
+        with self._lock:
+            self._purge_expired()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, data, expires_at) VALUES (?, ?, ?)",
+                (task["task_id"], _serialize(task), time.time() + self.ttl_for(task))
+            )
+
+    def get(self, task_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM tasks WHERE task_id = ? AND expires_at > ?", (task_id, time.time())
+            ).fetchone()
+        return _deserialize(row[0]) if row else None
+
+    def update(self, task_id: str, fields: dict, merge: dict = None) -> Optional[dict]:
+        with self._lock:
+            # Lecture-modification-écriture atomique vis-à-vis des autres processus
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT data FROM tasks WHERE task_id = ? AND expires_at > ?", (task_id, time.time())
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                task = _deserialize(row[0])
+                _apply_update(task, fields, merge)
+                self._conn.execute(
+                    "UPDATE tasks SET data = ?, expires_at = ? WHERE task_id = ?",
+                    (_serialize(task), time.time() + self.ttl_for(task), task_id)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return task
+
+    def delete(self, task_id: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+        return cursor.rowcount > 0
+
+    def list(self) -> List[dict]:
+        with self._lock:
+            self._purge_expired()
+            rows = self._conn.execute("SELECT data FROM tasks").fetchall()
+        return [_deserialize(row[0]) for row in rows]
+
+class RedisTaskStore(TaskStore):
+    """
+    Stockage dans Redis, partagé entre toutes les machines.
+    Accepte tout client compatible redis-py (get/set/delete/scan_iter/pipeline), l'expiration
+    étant déléguée à Redis.
+    """
+
+    def __init__(self, client, prefix: str = "avopoint:task:", **kwargs):
+        super().__init__(**kwargs)
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, task_id: str) -> str:
+        return f"{self.prefix}{task_id}"
+
+    def _expiry(self, task: dict) -> int:
+        # Redis refuse une expiration nulle
+        return max(1, self.ttl_for(task))
+
+    def create(self, task: dict) -> None:
+        self.client.set(self._key(task["task_id"]), _serialize(task), ex=self._expiry(task))
+
+    def get(self, task_id: str) -> Optional[dict]:
+        data = self.client.get(self._key(task_id))
+        return _deserialize(data) if data is not None else None
+
+    def update(self, task_id: str, fields: dict, merge: dict = None) -> Optional[dict]:
+        # Le worker qui traite la tâche et les endpoints (ré-extraction, ...) peuvent écrire
+        # en même temps : WATCH/MULTI fait échouer l'écriture si la clé a changé depuis la
+        # lecture, et la mise à jour est alors rejouée sur la nouvelle valeur
+        key = self._key(task_id)
+        for _ in range(REDIS_UPDATE_ATTEMPTS):
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    data = pipe.get(key)
+                    if data is None:
+                        pipe.unwatch()
+                        return None
+                    task = _apply_update(_deserialize(data), fields, merge)
+                    pipe.multi()
+                    pipe.set(key, _serialize(task), ex=self._expiry(task))
+                    pipe.execute()
+                    return task
+                except Exception as e:
+                    # redis.WatchError, sans importer redis (client injecté)
+                    if type(e).__name__ != "WatchError":
+                        raise
+        raise TaskStoreError(f"Mise à jour de la tâche {task_id} abandonnée après {REDIS_UPDATE_ATTEMPTS} conflits")
+
+    def delete(self, task_id: str) -> bool:
+        return bool(self.client.delete(self._key(task_id)))
+
+    def list(self) -> List[dict]:
+        tasks = []
+        for key in self.client.scan_iter(match=f"{self.prefix}*"):
+            data = self.client.get(key)
+            if data is not None:
+                tasks.append(_deserialize(data))
+        return tasks
+
+def create_task_store(url: str = TASK_STORE_URL) -> TaskStore:
+    """
+    Crée le stockage de tâches à partir d'une URL:
+    - memory://
+    - sqlite:///chemin/vers/tasks.db
+    - redis://hote:port/db (nécessite le paquet redis)
+    """
+    if url.startswith("memory://"):
+        return MemoryTaskStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteTaskStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://")):
+        try:
+            import redis
+        except ImportError:
+            raise TaskStoreError("Le paquet 'redis' est requis pour TASK_STORE_URL=redis://...")
+        return RedisTaskStore(redis.Redis.from_url(url))
+    raise TaskStoreError(f"URL de stockage des tâches non supportée: {url}")
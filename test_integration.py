@@ -205,6 +205,1453 @@ def test_data_compatibility():
         traceback.print_exc()
         return False
 
+def test_extraction_cache():
+    """Test le cache d'extraction (clé de contenu, version de prompt, éviction)"""
+    print("\n=== Test du cache d'extraction ===")
+    
+    import tempfile
+    from extraction_cache import ExtractionCache
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = ExtractionCache(Path(temp_dir) / "cache.db", ttl_seconds=3600, max_entries=2)
+        data = {"vehicule": {"immatriculation": "AB-123-CD", "marque": "PEUGEOT"}}
+        
+        cache.set("hash1", "certificat", "v1", data)
+        assert cache.get("hash1", "certificat", "v1") == data
+        assert cache.get("hash1", "certificat", "v2") is None
+        assert cache.get("hash1", "permis", "v1") is None
+        print("[OK] Cle de cache: contenu + type de document + version du prompt")
+        
+        cache.set("hash2", "certificat", "v1", data)
+        cache.set("hash3", "certificat", "v1", data)
+        assert cache.stats()["entries"] == 2
+        print("[OK] Eviction au-dela de la taille maximale")
+        
+        cache.ttl_seconds = -1
+        assert cache.get("hash3", "certificat", "v1") is None
+        print("[OK] Expiration des entrees (TTL)")
+    
+    return True
+
+class WatchError(Exception):
+    """Même nom que redis.WatchError"""
+    pass
+
+class FakePipeline:
+    """Pipeline minimal (watch/get/multi/set/execute) : execute échoue si la clé surveillée a changé"""
+    
+    def __init__(self, client):
+        self.client = client
+        self.watched = {}
+        self.commands = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.watched, self.commands = {}, []
+    
+    def watch(self, key):
+        self.watched[key] = self.client.versions.get(key, 0)
+    
+    def unwatch(self):
+        self.watched = {}
+    
+    def get(self, key):
+        return self.client.get(key)
+    
+    def multi(self):
+        self.commands = []
+    
+    def set(self, key, value, ex=None):
+        self.commands.append((key, value, ex))
+    
+    def execute(self):
+        if self.client.before_execute:
+            self.client.before_execute()
+        if any(self.client.versions.get(key, 0) != version for key, version in self.watched.items()):
+            raise WatchError()
+        for key, value, ex in self.commands:
+            self.client.set(key, value, ex=ex)
+        return [True] * len(self.commands)
+
+class FakeRedis:
+    """Client Redis minimal en mémoire (get/set/delete/ttl/scan_iter avec expiration, pipeline)"""
+    
+    def __init__(self):
+        self.data = {}
+        self.versions = {}
+        # Appelé avant chaque execute() : simule l'écriture d'un autre worker
+        self.before_execute = None
+    
+    def pipeline(self):
+        return FakePipeline(self)
+    
+    def set(self, key, value, ex=None):
+        import time
+        self.data[key] = (value, time.time() + ex if ex is not None else None)
+        self.versions[key] = self.versions.get(key, 0) + 1
+    
+    def get(self, key):
+        import time
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            del self.data[key]
+            return None
+        return value
+    
+    def ttl(self, key):
+        import time
+        _, expires_at = self.data.get(key, (None, None))
+        return -1 if expires_at is None else round(expires_at - time.time())
+    
+    def delete(self, key):
+        return 1 if self.data.pop(key, None) is not None else 0
+    
+    def scan_iter(self, match="*"):
+        import fnmatch
+        return [key for key in list(self.data) if fnmatch.fnmatch(key, match)]
+
+def test_task_stores():
+    """Test les implémentations du stockage des tâches (SQLite, Redis)"""
+    print("\n=== Test du stockage des taches ===")
+    
+    import tempfile
+    from datetime import datetime
+    from task_store import SQLiteTaskStore, RedisTaskStore
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        stores = {
+            "SQLite": SQLiteTaskStore(Path(temp_dir) / "tasks.db", finished_ttl=60, active_ttl=3600),
+            "Redis": RedisTaskStore(FakeRedis(), finished_ttl=60, active_ttl=3600),
+        }
+        for name, store in stores.items():
+            now = datetime.now()
+            store.create({"task_id": "t1", "status": "UPLOADED", "created_at": now, "updated_at": now})
+            
+            task = store.update("t1", {"status": "VALIDATING", "progress": 55})
+            assert task["progress"] == 55 and task["created_at"] == now
+            assert store.get("t1")["status"] == "VALIDATING"
+            assert [task["task_id"] for task in store.list()] == ["t1"]
+            print(f"[OK] {name}: creation, mise a jour et lecture")
+            
+            store.update("t1", {}, merge={"extracted_data": {"permis": {"nom": "DUPONT"}}})
+            task = store.update("t1", {"progress": 60}, merge={"extracted_data": {"contravention": {"nom": "Dupont"}}})
+            assert task["extracted_data"] == {"permis": {"nom": "DUPONT"}, "contravention": {"nom": "Dupont"}}
+            assert store.get("t1")["extracted_data"] == task["extracted_data"]
+            assert store.update("inconnue", {"progress": 1}) is None
+            print(f"[OK] {name}: fusion partielle des dictionnaires")
+            
+            store.finished_ttl = 0
+            store.update("t1", {"status": "COMPLETED"})
+            if name == "Redis":
+                assert store.client.ttl(store._key("t1")) <= 1
+            else:
+                assert store.get("t1") is None and store.list() == []
+            print(f"[OK] {name}: expiration des taches terminees")
+        
+        # Écriture concurrente d'un autre worker entre la lecture et l'écriture :
+        # la mise à jour est rejouée sans perdre la fusion de l'autre worker
+        store = stores["Redis"]
+        store.create({"task_id": "t3", "status": "UPLOADED", "field_checks": {}})
+        other_worker = RedisTaskStore(store.client)
+        
+        def concurrent_write():
+            store.client.before_execute = None
+            other_worker.update("t3", {}, merge={"field_checks": {"permis": {"nom": "ok"}}})
+        
+        store.client.before_execute = concurrent_write
+        task = store.update("t3", {"status": "VALIDATING"}, merge={"field_checks": {"certificat": {"nom": "ok"}}})
+        assert task["status"] == "VALIDATING"
+        assert set(store.get("t3")["field_checks"]) == {"permis", "certificat"}
+        print("[OK] Redis: mise a jour rejouee apres une ecriture concurrente (WATCH/MULTI)")
+        
+        # Le stockage SQLite survit à un redémarrage
+        SQLiteTaskStore(Path(temp_dir) / "restart.db").create({"task_id": "t2", "status": "UPLOADED"})
+        assert SQLiteTaskStore(Path(temp_dir) / "restart.db").get("t2")["status"] == "UPLOADED"
+        print("[OK] SQLite: persistance apres redemarrage")
+    
+    return True
+
+def test_job_queue():
+    """Test la file de traitement bornée (admission, position, arrêt progressif)"""
+    print("\n=== Test de la file de traitement ===")
+    
+    import asyncio
+    from job_queue import JobQueue, QueueFullError
+    
+    async def scenario():
+        done = []
+        
+        async def handler(job_id):
+            await asyncio.sleep(0.05)
+            done.append(job_id)
+        
+        queue = JobQueue(handler, workers=1, max_queue_size=2, mode="inprocess")
+        await queue.start()
+        assert queue.submit("a", "a") == 1
+        await asyncio.sleep(0)  # "a" démarre
+        assert queue.position("a") == 0
+        assert queue.submit("b", "b") == 1
+        assert queue.submit("c", "c") == 2
+        try:
+            queue.submit("d", "d")
+            raise AssertionError("La file saturée aurait dû refuser le traitement")
+        except QueueFullError:
+            pass
+        print("[OK] Controle d'admission et position dans la file")
+        
+        assert await queue.drain(timeout=5) == []
+        assert done == ["a", "b", "c"] and queue.is_full()
+        print("[OK] Arret progressif apres la fin des traitements")
+    
+    asyncio.run(scenario())
+    return True
+
+CONTRAVENTION_SAMPLE = {
+    "identité": {"nom": "Dupont", "prenom": "Jean", "adresse": "12 rue de la Paix, 75002 Paris"},
+    "infraction": {
+        "numero_avis": "1234567890", "date_heure": "15/01/2024 14h32", "format_date": "DD/MM/YYYY:HHhMM",
+        "route": "A10", "exces_vitesse_kmh": 12, "vitesse_maximale_autorisee": 110, "vitesse_mesuree": 122
+    },
+    "identification_vehicule": {"immatriculation": "AB-123-CD", "pays": "FRANCE", "marque": "PEUGEOT"},
+    "appareil_controle": {"type": "Radar fixe", "date_derniere_verification": "NONE"},
+    "agent_verbalisateur": {"agent_verbalisateur": "NONE", "service": "CNT"},
+    "réglements": {"date_15j": "20/01/2024", "adresse_demarche": "CNT, 35900 Rennes"}
+}
+
+def test_batched_scan():
+    """Test la fusion de la réponse groupée (extraction + validation en un seul appel)"""
+    print("\n=== Test du mode d'extraction groupe ===")
+    
+    from scan import _batch_result
+    
+    cached = {"permis": {"identite": {"nom": "DUPONT", "prenom": "Jean"}}}
+    response = {
+        "contravention": CONTRAVENTION_SAMPLE,
+        "certificat": {"proprietaire": {"nom": "DUPONT"}},
+        "validation": {
+            "names_consistent": True, "names_explanation": "Meme personne",
+            "names_found": ["Contravention: Dupont Jean", "Permis: DUPONT Jean"],
+            "date_valid": None, "date_explanation": None, "date_found": None,
+            "overall_status": "VALID", "summary": "OK"
+        }
+    }
+    to_send = {"contravention": "contravention.jpg", "certificat": "certificat.jpg"}
+    result = _batch_result(response, cached, to_send, {"contravention": None, "certificat": None})
+    
+    assert result["permis"] == cached["permis"]
+    assert result["contravention"] == CONTRAVENTION_SAMPLE
+    assert "certificat" not in result
+    print("[OK] Donnees extraites et donnees en cache fusionnees, document invalide laisse a l'extraction individuelle")
+    
+    checks = result["validation_result"]["checks"]
+    assert result["validation_result"]["validation_status"] == "VALID"
+    assert checks["names_consistency"]["status"] == "VALID"
+    assert checks["names_consistency"]["found_names"] == ["Contravention: Dupont Jean", "Permis: DUPONT Jean"]
+    assert checks["justificatif_date"]["status"] == "NOT_CHECKED"
+    print("[OK] Validation au format validation_result")
+    
+    return True
+
+def test_structured_extraction():
+    """Test la validation des extractions par schéma et la réparation ciblée des champs invalides"""
+    print("\n=== Test de l'extraction structuree ===")
+    
+    import copy
+    from types import SimpleNamespace
+    from schemas import TOOL_NAMES, validate_extraction, extraction_tools
+    from scan import _apply_repair, _build_repair_request
+    
+    data, errors = validate_extraction("contravention", CONTRAVENTION_SAMPLE)
+    assert data == CONTRAVENTION_SAMPLE and errors == []
+    tools = {tool["name"]: tool for tool in extraction_tools()}
+    assert "identité" in tools[TOOL_NAMES["contravention"]]["input_schema"]["properties"]
+    assert set(TOOL_NAMES.values()) <= set(tools)
+    print("[OK] Schema conforme aux cles des prompts (identité, réglements)")
+    
+    raw = copy.deepcopy(CONTRAVENTION_SAMPLE)
+    raw["infraction"]["vitesse_mesuree"] = "122 km/h"
+    raw["infraction"]["vitesse_maximale_autorisee"] = "cent dix"
+    del raw["réglements"]
+    data, errors = validate_extraction("contravention", raw)
+    assert data is None
+    assert sorted(error["path"] for error in errors) == ["infraction.vitesse_maximale_autorisee", "réglements"]
+    print("[OK] Champs invalides identifies en une passe")
+    
+    tool_use = SimpleNamespace(type="tool_use", id="toolu_1", name="extraire_contravention", input=raw)
+    request = {"model": "m", "messages": [{"role": "user", "content": "document"}]}
+    repair_request = _build_repair_request(request, SimpleNamespace(content=[tool_use]), errors)
+    assert repair_request["tool_choice"]["name"] == "corriger_champs"
+    assert "vitesse_maximale_autorisee" in repair_request["messages"][-1]["content"][0]["content"]
+    
+    repair = {"champs": [
+        {"chemin": "infraction.vitesse_maximale_autorisee", "valeur": 110},
+        {"chemin": "identité.nom", "valeur": "AUTRE"}
+    ]}
+    repaired = _apply_repair("contravention", raw, repair, errors)
+    assert repaired["infraction"]["vitesse_maximale_autorisee"] == 110
+    assert repaired["infraction"]["vitesse_mesuree"] == 122
+    assert repaired["identité"]["nom"] == "Dupont"
+    assert repaired["réglements"] == {"date_15j": "NONE", "adresse_demarche": "NONE"}
+    print("[OK] Reparation limitee aux champs signales, NONE pour les champs non corriges")
+    
+    return True
+
+def test_field_checks():
+    """Test le controle champ par champ et la re-extraction ciblee des champs en echec"""
+    print("\n=== Test du controle par champ ===")
+    
+    import asyncio
+    import copy
+    import tempfile
+    from types import SimpleNamespace
+    from PIL import Image
+    import scan
+    from field_checks import assess_extraction
+    from preprocess import crop_document
+    
+    checks = assess_extraction("contravention", CONTRAVENTION_SAMPLE)
+    assert checks["fields"]["identification_vehicule.immatriculation"]["status"] == "valid"
+    assert checks["fields"]["infraction.date_heure"]["status"] == "valid"
+    assert checks["fields"]["identité.nom"]["status"] == "present"
+    assert checks["failing"] == ["appareil_controle.date_derniere_verification", "agent_verbalisateur.agent_verbalisateur"]
+    
+    data = copy.deepcopy(CONTRAVENTION_SAMPLE)
+    data["identification_vehicule"]["immatriculation"] = "AB-12-CD"
+    data["infraction"]["exces_vitesse_kmh"] = 21
+    checks = assess_extraction("contravention", data)
+    assert checks["fields"]["identification_vehicule.immatriculation"]["status"] == "invalid"
+    assert checks["fields"]["infraction.exces_vitesse_kmh"]["status"] == "invalid"
+    assert assess_extraction("certificat", {"vehicule": {"immatriculation": "123 abc 75"}})["failing"] == []
+    print("[OK] Plaque, vitesses et dates controlees, champs NONE signales")
+    
+    requests = []
+    def fake_create_message(kind, doc_type=None, **request):
+        requests.append(request)
+        return SimpleNamespace(content=[SimpleNamespace(type="tool_use", name="corriger_champs", input={"champs": [
+            {"chemin": "identification_vehicule.immatriculation", "valeur": "AB-124-CD"},
+            {"chemin": "infraction.exces_vitesse_kmh", "valeur": "NONE"},
+            {"chemin": "identité.nom", "valeur": "AUTRE"}
+        ]})])
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_path = str(Path(temp_dir) / "contravention.png")
+        Image.new("RGB", (400, 200), "white").save(image_path)
+        assert len(crop_document(image_path, (0.5, 0.0, 1.0, 0.5))) == 1
+        
+        async def fake_create_message_async(kind, doc_type=None, **request):
+            return fake_create_message(kind, doc_type, **request)
+        
+        arguments = dict(fields=["identification_vehicule.immatriculation", "infraction.exces_vitesse_kmh"],
+                         crop=(0.5, 0.0, 1.0, 0.5), fast=True)
+        saved = scan._create_message, scan._create_message_async
+        scan._create_message, scan._create_message_async = fake_create_message, fake_create_message_async
+        try:
+            result = scan.reextract_fields("contravention", image_path, data, **arguments)
+            result_async = asyncio.run(scan.reextract_fields_async("contravention", image_path, data, **arguments))
+        finally:
+            scan._create_message, scan._create_message_async = saved
+    
+    assert result_async == result and requests[0] == requests[1]
+    assert requests[0]["model"] == scan.SCAN_FAST_MODEL
+    assert requests[0]["tool_choice"]["name"] == "corriger_champs"
+    assert result["data"]["identification_vehicule"]["immatriculation"] == "AB-124-CD"
+    assert result["data"]["infraction"]["exces_vitesse_kmh"] == 21
+    assert result["data"]["identité"]["nom"] == "Dupont"
+    assert list(result["reextracted"]) == ["identification_vehicule.immatriculation"]
+    assert result["field_checks"]["fields"]["identification_vehicule.immatriculation"]["status"] == "valid"
+    print("[OK] Re-extraction limitee aux champs demandes, valeurs moins fiables ignorees")
+    
+    return True
+
+def test_model_routing():
+    """Test le routage des modeles: modele rapide d'abord, escalade si le resultat est insuffisant"""
+    print("\n=== Test du routage des modeles ===")
+    
+    import tempfile
+    from types import SimpleNamespace
+    from PIL import Image
+    import extraction_cache
+    import scan
+    
+    assert scan.scan_route("certificat") == [scan.SCAN_FAST_MODEL, scan.SCAN_MODEL]
+    assert scan.scan_route("contravention") == [scan.SCAN_MODEL]
+    
+    answers = {
+        "certificat": {"proprietaire": {"nom": "DUPONT", "prenom": "Jean"},
+                       "vehicule": {"immatriculation": "AB-123-CD", "marque": "PEUGEOT"}},
+        "domicile": {"personne": {"nom": "DUPONT", "prenom": "Jean"},
+                     "domicile": {"adresse": "12 rue de la Paix", "date_justificatif": "le mois dernier"}},
+    }
+    calls = []
+    def fake_create_message(kind, doc_type=None, **request):
+        calls.append((doc_type, request["model"]))
+        answer = answers[doc_type]
+        if request["model"] == scan.SCAN_MODEL:
+            answer = {**answer, "domicile": {**answer["domicile"], "date_justificatif": "15/03/2024"}}
+        scan._record_call(kind, 0, SimpleNamespace(usage=SimpleNamespace(input_tokens=1000, output_tokens=100)),
+                          request["model"], doc_type)
+        return SimpleNamespace(content=[SimpleNamespace(type="tool_use", name=f"extraire_{doc_type}", input=answer)])
+    
+    saved = scan._create_message, extraction_cache.EXTRACTION_CACHE_ENABLED
+    scan._create_message, extraction_cache.EXTRACTION_CACHE_ENABLED = fake_create_message, False
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            image_path = str(Path(temp_dir) / "document.png")
+            Image.new("RGB", (200, 100), "white").save(image_path)
+            certificat = scan.scan_certificat_immatriculation(image_path)
+            domicile = scan.scan_justificatif_domicile(image_path)
+    finally:
+        scan._create_message, extraction_cache.EXTRACTION_CACHE_ENABLED = saved
+    
+    assert certificat["vehicule"]["immatriculation"] == "AB-123-CD"
+    assert domicile["domicile"]["date_justificatif"] == "15/03/2024"
+    assert calls == [("certificat", scan.SCAN_FAST_MODEL), ("domicile", scan.SCAN_FAST_MODEL), ("domicile", scan.SCAN_MODEL)]
+    print("[OK] Resultat du modele rapide accepte, escalade sur date illisible")
+    
+    # Appel du modèle rapide en échec : escalade au lieu d'échouer (variantes synchrone et asynchrone)
+    import asyncio
+    import anthropic
+    import httpx
+    
+    def failing_fast_model(kind, doc_type=None, **request):
+        if request["model"] == scan.SCAN_FAST_MODEL:
+            calls.append((doc_type, request["model"]))
+            raise anthropic.APIConnectionError(request=httpx.Request("POST", "https://api.anthropic.com/v1/messages"))
+        calls.append((doc_type, request["model"]))
+        return SimpleNamespace(content=[SimpleNamespace(type="tool_use", name=f"extraire_{doc_type}", input=answers[doc_type])])
+    
+    async def failing_fast_model_async(kind, doc_type=None, **request):
+        return failing_fast_model(kind, doc_type, **request)
+    
+    calls.clear()
+    saved = scan._create_message, scan._create_message_async, extraction_cache.EXTRACTION_CACHE_ENABLED
+    scan._create_message, scan._create_message_async = failing_fast_model, failing_fast_model_async
+    extraction_cache.EXTRACTION_CACHE_ENABLED = False
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            image_path = str(Path(temp_dir) / "document.png")
+            Image.new("RGB", (200, 100), "white").save(image_path)
+            certificat = scan.scan_certificat_immatriculation(image_path)
+            certificat_async = asyncio.run(scan.scan_certificat_immatriculation_async(image_path))
+    finally:
+        scan._create_message, scan._create_message_async, extraction_cache.EXTRACTION_CACHE_ENABLED = saved
+    
+    assert certificat == certificat_async and certificat["vehicule"]["immatriculation"] == "AB-123-CD"
+    assert calls == [("certificat", scan.SCAN_FAST_MODEL), ("certificat", scan.SCAN_MODEL)] * 2
+    assert scan.get_routing_stats()["doc_types"]["certificat"]["escalation_reasons"].get("fast_error", 0) >= 2
+    print("[OK] Escalade vers le modele principal si l'appel du modele rapide echoue")
+    
+    stats = scan.get_routing_stats()["doc_types"]
+    assert stats["certificat"]["fast_accepted"] >= 1
+    assert stats["domicile"]["escalation_reasons"].get("invalid_field", 0) >= 1
+    assert stats["domicile"]["models"][scan.SCAN_MODEL]["cost_usd"] > 0
+    assert scan.estimate_cost(scan.SCAN_FAST_MODEL, {"input_tokens": 1_000_000, "output_tokens": 0,
+                                                     "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}) == 0.8
+    print("[OK] Escalades, latence et cout par type de document")
+    
+    return True
+
+def test_local_ocr():
+    """Test l'extraction locale des formulaires imprimes (couche texte PDF, modeles regex)"""
+    print("\n=== Test de l'OCR local ===")
+    
+    import tempfile
+    from reportlab.pdfgen import canvas
+    import local_ocr
+    
+    avis = """AVIS DE CONTRAVENTION N° 1234 5678 90
+Nom : DUPONT
+Prénom : JEAN
+Adresse : 12 RUE DE LA PAIX 75002 PARIS
+Infraction constatée le 15/01/2024 à 14h32
+Lieu : A10 sens Paris-Bordeaux PR 45
+Vitesse limite autorisée : 110 km/h
+Vitesse mesurée : 122 km/h
+Véhicule
+Immatriculation : AB 123 CD
+Marque : PEUGEOT
+Pays : FRANCE
+Appareil de contrôle : Radar fixe
+Date de dernière vérification : 02/05/2023
+Service verbalisateur : CNT
+Requête en exonération à adresser à : Officier du Ministère Public, CS 41101, 35911 RENNES CEDEX 9"""
+    data = local_ocr.parse_contravention(avis)
+    assert data["infraction"]["numero_avis"] == "1234567890"
+    assert data["infraction"]["date_heure"] == "15/01/2024:14h32"
+    assert data["identité"] == {"nom": "DUPONT", "prenom": "JEAN", "adresse": "12 RUE DE LA PAIX 75002 PARIS"}
+    assert data["réglements"]["adresse_demarche"].startswith("Officier du Ministère Public, CS 41101")
+    assert data["infraction"]["route"] == "A10"
+    assert data["infraction"]["exces_vitesse_kmh"] == 12
+    assert data["identification_vehicule"]["immatriculation"] == "AB-123-CD"
+    assert data["identification_vehicule"]["marque"] == "PEUGEOT"
+    assert data["appareil_controle"]["date_derniere_verification"] == "02/05/2023"
+    
+    certificat = local_ocr.parse_certificat("A AB-123-CD\nC.1 DUPONT JEAN PIERRE\nD.1 RENAULT\nD.3 CLIO")
+    assert certificat["proprietaire"] == {"nom": "DUPONT", "prenom": "JEAN PIERRE"}
+    assert certificat["vehicule"] == {"immatriculation": "AB-123-CD", "marque": "RENAULT"}
+    print("[OK] Modeles de l'avis de contravention et du certificat d'immatriculation")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pdf_path = str(Path(temp_dir) / "contravention.pdf")
+        pdf = canvas.Canvas(pdf_path)
+        for index, line in enumerate(avis.splitlines()):
+            pdf.drawString(50, 800 - 15 * index, line)
+        pdf.save()
+        
+        assert "Vitesse mesurée" in local_ocr.pdf_text_layer(pdf_path)
+        data = local_ocr.extract_locally("contravention", pdf_path)
+        assert data is not None and data["infraction"]["vitesse_mesuree"] == 122
+        stats = local_ocr.get_local_ocr_stats()["contravention"]
+        assert stats["text_layer"] >= 1 and stats["total_seconds"] > 0
+        
+        incomplete_path = str(Path(temp_dir) / "incomplet.pdf")
+        pdf = canvas.Canvas(incomplete_path)
+        for index, line in enumerate(avis.splitlines()[:3] + ["x" * 200]):
+            pdf.drawString(50, 800 - 15 * index, line)
+        pdf.save()
+        assert local_ocr.extract_locally("contravention", incomplete_path) is None
+        
+        # Sans identite du destinataire, l'avis va au modele
+        anonymous_path = str(Path(temp_dir) / "anonyme.pdf")
+        pdf = canvas.Canvas(anonymous_path)
+        for index, line in enumerate(line for line in avis.splitlines() if not line.startswith(("Nom", "Prénom"))):
+            pdf.drawString(50, 800 - 15 * index, line)
+        pdf.save()
+        assert local_ocr.extract_locally("contravention", anonymous_path) is None
+        assert local_ocr.extract_locally("permis", pdf_path) is None
+    print("[OK] Couche texte PDF lue localement, repli sur le modele si champs obligatoires manquants")
+    
+    return True
+
+def test_pdf_text_layer():
+    """Test l'envoi de la couche texte des PDF natifs a la place des pages"""
+    print("\n=== Test de la couche texte PDF ===")
+    
+    import tempfile
+    from reportlab.pdfgen import canvas
+    from PIL import Image
+    import preprocess
+    from scan import _document_content
+    
+    facture = ["FACTURE D'ELECTRICITE", "Date de facture : 15/03/2024", "M. DUPONT Jean",
+               "12 rue de la Paix", "75002 PARIS"] + [f"Consommation du mois {index} : {index * 37} kWh" for index in range(1, 12)]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        text_path = str(Path(temp_dir) / "domicile.pdf")
+        pdf = canvas.Canvas(text_path)
+        for index, line in enumerate(facture):
+            pdf.drawString(50, 800 - 15 * index, line)
+        pdf.save()
+        
+        scanned_path = str(Path(temp_dir) / "scan.pdf")
+        image_path = str(Path(temp_dir) / "scan.png")
+        Image.new("RGB", (600, 800), "white").save(image_path)
+        pdf = canvas.Canvas(scanned_path)
+        pdf.drawImage(image_path, 0, 0, 600, 800)
+        pdf.save()
+        
+        result = preprocess.preprocess_document(text_path, "domicile")
+        assert result["documents"][0]["media_type"] == "text/plain"
+        assert "Date de facture : 15/03/2024" in result["documents"][0]["text"]
+        assert result["stats"]["estimated_tokens_after"] < result["stats"]["estimated_tokens_before"] / 3
+        
+        content = _document_content("domicile", text_path)
+        assert len(content) == 1 and content[0]["type"] == "text"
+        assert "M. DUPONT Jean" in content[0]["text"]
+        
+        assert preprocess.pdf_text_layer(scanned_path) is None
+        assert _document_content("domicile", scanned_path)[0]["type"] in ("image", "document")
+    print("[OK] Texte compact envoye pour les PDF natifs, pages envoyees pour les PDF scannes")
+    
+    return True
+
+def test_browser_pool():
+    """Test le pool de navigateurs (pret exclusif, recyclage, controle de sante)"""
+    print("\n=== Test du pool de navigateurs ===")
+    
+    import asyncio
+    from types import SimpleNamespace
+    from browser_pool import BrowserPool, BrowserPoolTimeout
+    
+    class FakeSession:
+        def __init__(self):
+            self.is_cdp_connected = False
+            self.cookies_cleared = 0
+            self.killed = False
+        async def start(self):
+            self.is_cdp_connected = True
+        async def kill(self):
+            self.killed = True
+            self.is_cdp_connected = False
+        async def get_current_page_url(self):
+            return "about:blank"
+        async def clear_cookies(self):
+            self.cookies_cleared += 1
+        async def get_tabs(self):
+            return [SimpleNamespace(target_id="1")]
+        async def close_page(self, target_id):
+            pass
+        async def navigate_to(self, url):
+            pass
+    
+    sessions = []
+    def factory():
+        sessions.append(FakeSession())
+        return sessions[-1]
+    
+    async def scenario():
+        pool = BrowserPool(size=2, max_uses=2, factory=factory)
+        await pool.start(prewarm=True)
+        assert len(sessions) == 2 and pool.stats()["idle"] == 2
+        
+        running, peak = 0, 0
+        async def fill():
+            nonlocal running, peak
+            async with pool.acquire() as session:
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+                return session
+        used = await asyncio.gather(*(fill() for _ in range(5)))
+        assert peak == 2
+        assert len({id(session) for session in used}) > 2
+        assert pool.stats()["recycled"] >= 2
+        assert all(session.cookies_cleared for session in sessions if not session.killed)
+        
+        pool._idle[-1].session.is_cdp_connected = False
+        async with pool.acquire() as session:
+            assert session.is_cdp_connected
+        assert pool.stats()["unhealthy"] == 1
+        
+        async with pool.acquire(), pool.acquire():
+            try:
+                async with pool.acquire(timeout=0.05):
+                    pass
+                assert False, "pret au-dela de la taille du pool"
+            except BrowserPoolTimeout:
+                pass
+        await pool.close()
+        assert all(session.killed for session in sessions)
+    
+    asyncio.run(scenario())
+    print("[OK] Navigateurs prets d'avance, paralleles bornes, recycles et remplaces si hors service")
+    
+    return True
+
+def test_scripted_form():
+    """Test le remplissage scripte du formulaire sur la replique locale (et le repli sur l'agent)"""
+    print("\n=== Test du remplissage scripte du formulaire ===")
+    
+    import asyncio
+    import json
+    import re
+    from html.parser import HTMLParser
+    import scripted_form
+    from scripted_form import (FORM_FIELDS, SUBMIT_SELECTOR, CONFIRMATION_SELECTOR, ERROR_SELECTOR,
+                               ScriptedFormError, form_values, run_form_script)
+    
+    class FormParser(HTMLParser):
+        def __init__(self):
+            super().__init__()
+            self.elements = {}
+        def handle_starttag(self, tag, attrs):
+            attrs = dict(attrs)
+            if "id" in attrs:
+                self.elements["#" + attrs["id"]] = {"tag": tag, **attrs}
+    
+    parser = FormParser()
+    parser.feed(scripted_form.STANDIN_FORM_PATH.read_text(encoding="utf-8"))
+    for _, selector, _ in FORM_FIELDS:
+        assert selector in parser.elements, selector
+    assert {SUBMIT_SELECTOR, CONFIRMATION_SELECTOR, ERROR_SELECTOR} <= set(parser.elements)
+    print("[OK] Selecteurs du script presents dans la replique du formulaire")
+    
+    data = {
+        "contravention": {
+            "identité": {"nom": "NONE", "prenom": "NONE", "adresse": "NONE"},
+            "infraction": {"numero_avis": "1234 5678 90", "date_heure": "15/01/2024 a 9h05"},
+            "identification_vehicule": {"immatriculation": "AB-123-CD"},
+        },
+        "permis": {"identite": {"nom": "DUPONT", "prenom": "Jean"}, "adresse": {"adresse_complete": "NONE"}},
+        "certificat": {"vehicule": {"immatriculation": "NONE"}},
+        "domicile": {"domicile": {"adresse": "12 rue de la Paix, 75002 Paris"}},
+    }
+    values = form_values(data, "avocat@example.com")
+    assert values["numero_avis"] == "1234567890"
+    assert values["date_infraction"] == "15/01/2024" and values["heure_infraction"] == "09:05"
+    assert values["immatriculation"] == "AB-123-CD" and values["nom"] == "DUPONT"
+    try:
+        form_values({**data, "domicile": {}}, "avocat@example.com")
+        assert False, "adresse manquante acceptee"
+    except ScriptedFormError as e:
+        assert "adresse" in str(e) and not e.submitted
+    print("[OK] Donnees extraites converties en valeurs du formulaire")
+    
+    class FakeElement:
+        def __init__(self, page, selector):
+            self.page, self.selector = page, selector
+        async def fill(self, value):
+            self.page.values[self.selector] = value
+        async def select_option(self, value):
+            self.page.values[self.selector] = value
+        async def check(self):
+            self.page.values[self.selector] = True
+        async def click(self):
+            self.page.submit()
+    
+    class FakePage:
+        """Reproduit la validation du script de form_standin.html"""
+        def __init__(self, elements):
+            self.elements = elements
+            self.values = {}
+            self.outcome = {"confirmation": "", "erreur": ""}
+        async def goto(self, url):
+            pass
+        async def get_elements_by_css_selector(self, selector):
+            return [FakeElement(self, selector)] if selector in self.elements else []
+        async def evaluate(self, function, *args):
+            return json.dumps(self.outcome)
+        def submit(self):
+            invalid = []
+            for selector, element in self.elements.items():
+                value = self.values.get(selector)
+                if "required" in element and not value:
+                    invalid.append(element.get("name"))
+                elif value and element.get("pattern") and not re.fullmatch(element["pattern"], str(value)):
+                    invalid.append(element.get("name"))
+            if invalid:
+                self.outcome["erreur"] = "Champs invalides: " + ", ".join(invalid)
+            else:
+                self.outcome["confirmation"] = f"Votre demande n° {self.values['#numero_avis']} a bien été enregistrée."
+    
+    async def scenario():
+        confirmation = await run_form_script(FakePage(parser.elements), values, scripted_form.STANDIN_FORM_URL)
+        assert "1234567890" in confirmation
+        
+        try:
+            await run_form_script(FakePage(parser.elements), {**values, "date_infraction": "15-01-2024"}, "")
+            assert False, "date invalide acceptee"
+        except ScriptedFormError as e:
+            assert e.submitted and "date_infraction" in str(e)
+        
+        changed = {selector: element for selector, element in parser.elements.items() if selector != "#immatriculation"}
+        try:
+            await run_form_script(FakePage(changed), values, "")
+            assert False, "selecteur manquant ignore"
+        except ScriptedFormError as e:
+            assert not e.submitted and "#immatriculation" in str(e)
+        
+        class BrokenPage(FakePage):
+            async def evaluate(self, function, *args):
+                raise RuntimeError("connexion au navigateur perdue")
+        try:
+            await run_form_script(BrokenPage(parser.elements), values, "")
+            assert False, "erreur apres l'envoi ignoree"
+        except ScriptedFormError as e:
+            assert e.submitted
+    
+    asyncio.run(scenario())
+    print("[OK] Formulaire envoye et confirme; selecteur manquant signale avant l'envoi (repli sur l'agent)")
+    print("[OK] Erreur du navigateur apres le clic: pas de repli (pas de double envoi)")
+    
+    return True
+
+def test_renderer_registry():
+    """Test le registre des moteurs de rendu (verification unique, repli et nouvelle verification apres echec)"""
+    print("\n=== Test du registre des moteurs de rendu ===")
+    
+    import time
+    from generate_letter import LetterGenerator, RendererRegistry
+    
+    calls = {"latex": 0, "reportlab": 0}
+    def probe(name, result):
+        def run():
+            calls[name] += 1
+            return result
+        return run
+    
+    registry = RendererRegistry(probes={"latex": probe("latex", True), "reportlab": probe("reportlab", True), "html": lambda: True})
+    generator = LetterGenerator(registry=registry)
+    for _ in range(3):
+        assert generator._check_latex_availability() and registry.backend() == "latex"
+    assert calls == {"latex": 1, "reportlab": 1}
+    print("[OK] Moteurs verifies une seule fois pour plusieurs lettres")
+    
+    used = []
+    def failing_latex(*args):
+        used.append("latex")
+        raise Exception("pdflatex en panne")
+    def html(*args):
+        used.append("html")
+        return "results/contestation_test.html"
+    generator._generate_with_latex = failing_latex
+    generator._generate_with_reportlab = failing_latex
+    generator._generate_with_html = html
+    assert generator.generate_final_pdf({}, False, "test") == "results/contestation_test.html"
+    assert used == ["latex", "latex", "html"]
+    assert registry.status()["failures"] == {"latex": 1, "reportlab": 1}
+    assert registry.status()["suspended"] == ["latex", "reportlab"]
+    for _ in range(3):
+        assert registry.backends() == ["html"]
+    assert calls == {"latex": 1, "reportlab": 1}
+    print("[OK] Echec d'un moteur: repli sur le suivant, moteur ecarte sans nouvelle verification a chaque lettre")
+    
+    registry = RendererRegistry(probes={"latex": probe("latex", True), "reportlab": probe("reportlab", True), "html": lambda: True},
+                                interval=0.2)
+    calls.update(latex=0, reportlab=0)
+    registry.refresh()
+    time.sleep(0.12)
+    registry.report_failure("latex")
+    time.sleep(0.12)
+    assert registry.backends() == ["reportlab", "html"]
+    assert calls == {"latex": 2, "reportlab": 2}
+    time.sleep(0.1)
+    assert registry.backends() == ["latex", "reportlab", "html"]
+    assert calls == {"latex": 3, "reportlab": 2}
+    print("[OK] Moteur en echec verifie a nouveau une fois l'intervalle ecoule, seul")
+    
+    registry.interval = 0
+    time.sleep(0.01)
+    registry.backends()
+    assert calls["latex"] == 4
+    print("[OK] Verification periodique des moteurs")
+    
+    return True
+
+def test_latex_service():
+    """Test le service de compilation LaTeX (format precompile, compilations bornees, repli sans format)"""
+    print("\n=== Test du service de compilation LaTeX ===")
+    
+    import tempfile
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from types import SimpleNamespace
+    from latex_service import LatexService, LatexServiceError
+    from generate_letter import LATEX_PREAMBLE, LetterGenerator
+    
+    state = {"running": 0, "peak": 0, "sources": [], "commands": [], "version": "pdfTeX 3.141592653-2.6-1.40.25",
+             "build_format": True, "format_ok": True, "release": None}
+    lock = threading.Lock()
+    def fake_pdflatex(command, **kwargs):
+        state["commands"].append(command)
+        if "--version" in command:
+            return SimpleNamespace(returncode=0, stdout=state["version"] + "\n", stderr="")
+        if "-ini" in command:
+            jobname = next(arg for arg in command if arg.startswith("-jobname=")).split("=", 1)[1]
+            output_dir = next(arg for arg in command if arg.startswith("-output-directory=")).split("=", 1)[1]
+            if state["build_format"]:
+                Path(output_dir, f"{jobname}.fmt").write_bytes(b"fmt")
+            return SimpleNamespace(returncode=0 if state["build_format"] else 1, stdout="", stderr="")
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        if state["release"] is not None:
+            state["release"].wait(5)
+        time.sleep(0.02)
+        tex_file = Path(command[-1])
+        state["sources"].append(tex_file.read_text(encoding="utf-8"))
+        with lock:
+            state["running"] -= 1
+        if any(arg.startswith("-fmt=") for arg in command) and not state["format_ok"]:
+            return SimpleNamespace(returncode=1, stdout="", stderr="format file ended prematurely")
+        tex_file.with_suffix(".pdf").write_bytes(b"%PDF-1.4 lettre")
+        return SimpleNamespace(returncode=0, stdout="", stderr="")
+    
+    latex_content = LetterGenerator()._generate_latex_content(
+        {"infraction": {"numero_avis": "12345678901234", "date_heure": "15/01/2024"}}, {},
+        {"identite": {"nom": "DUPONT", "prenom": "Jean"}}, {"domicile": {"adresse": "1 rue Test"}}, False
+    )
+    assert latex_content.startswith(LATEX_PREAMBLE)
+    
+    with tempfile.TemporaryDirectory() as format_dir:
+        service = LatexService(workers=2, max_queue_size=10, format_dir=format_dir, runner=fake_pdflatex)
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            pdfs = list(executor.map(lambda i: service.compile(latex_content, f"contestation_{i}", LATEX_PREAMBLE), range(6)))
+        assert all(pdf.startswith(b"%PDF") for pdf in pdfs)
+        assert sum("-ini" in command for command in state["commands"]) == 1
+        assert all("\\documentclass" not in source and "DUPONT" in source for source in state["sources"])
+        assert all(any(arg.startswith("-fmt=") for arg in command) for command in state["commands"] if "-ini" not in command and "--version" not in command)
+        assert state["peak"] <= service.capacity == 2
+        stats = service.stats()
+        assert stats["with_format"] == 6 and stats["format_builds"] == 1
+        print("[OK] Preambule precompile une fois, corps seul compile, au plus 2 compilations simultanees")
+        
+        # Version de TeX differente: autre format
+        upgraded = LatexService(workers=1, format_dir=format_dir, runner=fake_pdflatex)
+        state["version"] = "pdfTeX 3.141592653-2.6-1.40.26"
+        assert upgraded.prepare_format(LATEX_PREAMBLE) != service.prepare_format(LATEX_PREAMBLE)
+        print("[OK] Format propre a la version de pdflatex")
+        
+        # Format existant mais illisible: compilation complete et format supprime
+        state["format_ok"] = False
+        state["sources"].clear()
+        pdf = upgraded.compile(latex_content, "contestation_z", LATEX_PREAMBLE)
+        assert pdf.startswith(b"%PDF") and state["sources"][-1] == latex_content
+        assert upgraded.stats()["format_discarded"] == 1 and upgraded.prepare_format(LATEX_PREAMBLE) is None
+        assert not any(Path(format_dir).glob(f"{upgraded._format_name(LATEX_PREAMBLE)}.fmt"))
+        state["format_ok"] = True
+        print("[OK] Format incompatible abandonne apres un nouvel essai sans format")
+    
+    with tempfile.TemporaryDirectory() as format_dir:
+        state["release"] = threading.Event()
+        service = LatexService(workers=2, max_queue_size=0, format_dir=format_dir, runner=fake_pdflatex)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            busy = [executor.submit(service.compile, latex_content, f"contestation_b{i}", LATEX_PREAMBLE) for i in range(2)]
+            deadline = time.monotonic() + 5
+            while service.stats()["running"] < service.capacity and time.monotonic() < deadline:
+                time.sleep(0.01)
+            try:
+                service.compile(latex_content, "contestation_x", LATEX_PREAMBLE)
+                assert False, "file pleine acceptee"
+            except LatexServiceError:
+                pass
+            state["release"].set()
+            assert all(future.result().startswith(b"%PDF") for future in busy)
+        state["release"] = None
+        assert service.stats()["rejected"] == 1
+        print("[OK] File de compilation pleine refusee")
+    
+    with tempfile.TemporaryDirectory() as format_dir:
+        state["sources"].clear()
+        state["build_format"] = False
+        service = LatexService(workers=1, format_dir=format_dir, runner=fake_pdflatex)
+        service.compile(latex_content, "contestation_y", LATEX_PREAMBLE)
+        assert state["sources"][-1] == latex_content
+        assert service.stats()["full"] == 1 and service.stats()["format_failures"] == 1
+        print("[OK] Format impossible a construire: compilation complete")
+    
+    return True
+
+def test_letter_templates():
+    """Test les gabarits de lettre compiles (echappement par moteur, texte identique entre moteurs)"""
+    print("\n=== Test des gabarits de lettre ===")
+    
+    import re
+    from generate_letter import LetterGenerator
+    from letter_templates import get_template, get_reportlab_letterhead, get_reportlab_template, render_motifs, escape_latex
+    
+    generator = LetterGenerator()
+    contravention = {"infraction": {"numero_avis": "12345678901234", "date_heure": "15/01/2024 14h30"}}
+    certificat = {"vehicule": {"immatriculation": "NONE"}}
+    permis = {"identite": {"nom": "DUPONT & FILS", "prenom": "<Jean>"}}
+    domicile = {"domicile": {"adresse": "12 rue_du 8 mai, 100% {Paris} #2"}}
+    
+    latex = generator._generate_latex_content(contravention, certificat, permis, domicile, False)
+    assert "DUPONT \\& FILS" in latex and "rue\\_du" in latex and "100\\%" in latex and "\\{Paris\\} \\#2" in latex
+    html = generator._generate_html_content(contravention, certificat, permis, domicile, False)
+    assert "&lt;Jean&gt; DUPONT &amp; FILS" in html and "<Jean>" not in html
+    assert escape_latex("a\\b~c^d$") == "a\\textbackslash{}b\\textasciitilde{}c\\textasciicircum{}d\\$"
+    print("[OK] Donnees extraites echappees pour LaTeX et HTML")
+    
+    fields = generator._letter_fields(contravention, certificat, permis, domicile)
+    def text_of(markup):
+        markup = re.sub(r"<[^>]+>", " ", markup).replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
+        return re.sub(r"\s+", " ", markup)
+    reportlab_text = text_of(" ".join(template.render(fields) for _, template, _ in get_reportlab_letterhead() + get_reportlab_template()))
+    html_text = text_of(html)
+    for sentence in ("En qualité de représentant de <Jean> DUPONT & FILS", "supposé commis à cette occasion.",
+                     "Paris, le " + fields["date_lettre"], "Avis de contravention n° 12345678901234"):
+        assert sentence in reportlab_text and sentence in html_text, sentence
+    print("[OK] Meme texte de lettre pour ReportLab et HTML")
+    
+    assert get_template("latex") is get_template("latex") and get_reportlab_template() is get_reportlab_template()
+    assert not {"nom_client", "numero_avis"} - get_template("html").fields
+    assert len(render_motifs("latex", True)) == len(render_motifs("html", True)) == 5
+    assert render_motifs("html", False)[0].startswith("<b>Impossibilité")
+    print("[OK] Gabarits compiles une fois et motifs partages entre moteurs")
+    
+    return True
+
+def test_reportlab_letter():
+    """Test le rendu ReportLab en cache (styles uniques, blocs statiques en form XObject)"""
+    print("\n=== Test du rendu ReportLab ===")
+    
+    import io
+    from pypdf import PdfReader
+    import letter_reportlab
+    from generate_letter import LetterGenerator
+    
+    generator = LetterGenerator()
+    fields = generator._letter_fields(
+        {"infraction": {"numero_avis": "12345678901234", "date_heure": "15/01/2024 14h30"}},
+        {"vehicule": {"immatriculation": "AB-123-CD"}},
+        {"identite": {"nom": "DUPONT & FILS", "prenom": "Jean"}},
+        {"domicile": {"domicile": {"adresse": "12 rue de la Paix"}}}
+    )
+    pdfs = []
+    for _ in range(2):
+        buffer = io.BytesIO()
+        letter_reportlab.render_letter(fields, buffer)
+        pdfs.append(buffer.getvalue())
+    page = PdfReader(io.BytesIO(pdfs[-1])).pages[0]
+    text = " ".join(page.extract_text().split())
+    for expected in ("Maître Yoann LEROUGE", "Paris, le " + fields["date_lettre"], "Jean DUPONT & FILS",
+                     "supposé commis à cette occasion.", "examen attentif de la demande"):
+        assert expected in text, expected
+    forms = [name for name, xobject in page["/Resources"]["/XObject"].items() if xobject.get_object()["/Subtype"] == "/Form"]
+    assert len(forms) >= 2
+    print("[OK] En-tete et signature dessines en form XObject, champs variables mis en page")
+    
+    assert letter_reportlab.letter_styles() is letter_reportlab.letter_styles()
+    assert letter_reportlab.letterhead_layout(fields["date_lettre"]) is letter_reportlab.letterhead_layout(fields["date_lettre"])
+    assert letter_reportlab.body_layout() is letter_reportlab.body_layout()
+    print("[OK] Styles et mises en page statiques construits une fois")
+    
+    result = letter_reportlab.benchmark(letters=5)
+    assert result["before_per_second"] > 0 and result["after_per_second"] > 0
+    print(f"[OK] Mesure: {result['before_per_second']} -> {result['after_per_second']} lettres/s")
+    
+    return True
+
+def test_result_store():
+    """Test le stockage des lettres (local, S3 local) et le téléchargement par plages avec ETag"""
+    print("\n=== Test du stockage des resultats ===")
+    
+    import tempfile
+    from datetime import datetime
+    from fastapi.testclient import TestClient
+    import app
+    from generate_letter import LetterGenerator
+    from result_store import ResultStoreError, create_result_store
+    
+    document = LetterGenerator().render_document({"contravention": {"infraction": {"numero_avis": "12345678901234"}}}, False, "test")
+    assert document.data.startswith(b"%PDF") or document.extension == "html"
+    print(f"[OK] Lettre rendue en memoire ({document.extension}, {len(document.data)} octets)")
+    
+    data = bytes(range(256)) * 1000
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for url in (f"file://{temp_dir}/local", f"s3local:///{temp_dir}/objets/lettres"):
+            store = create_result_store(url)
+            info = store.put("contestation_test.pdf", data, "application/pdf")
+            assert info["size"] == len(data) and info["etag"].startswith('"')
+            assert b"".join(store.iter_range("contestation_test.pdf")) == data
+            assert b"".join(store.iter_range("contestation_test.pdf", 100, 70099)) == data[100:70100]
+            assert store.exists("contestation_test.pdf")
+            store.delete("contestation_test.pdf")
+            assert not store.exists("contestation_test.pdf")
+        try:
+            create_result_store(f"file://{temp_dir}/local").put("../evasion.pdf", data, "application/pdf")
+            assert False, "Une cle hors du repertoire doit etre refusee"
+        except ResultStoreError:
+            pass
+        print("[OK] Stockages local et S3 local (ecriture, lecture par plages, suppression)")
+        
+        store = create_result_store(f"s3local:///{temp_dir}/objets/lettres")
+        original_store = app.result_store
+        app.result_store = store
+        task_id = "test-resultat"
+        try:
+            app.create_task(task_id, {})
+            app.task_store.update(task_id, {
+                "status": "COMPLETED",
+                "result": store.put(f"contestation_{task_id}.pdf", data, "application/pdf"),
+                "updated_at": datetime.now()
+            })
+            client = TestClient(app.app)
+            url = f"/api/v1/task/{task_id}/result"
+            
+            response = client.get(url)
+            assert response.status_code == 200 and response.content == data
+            etag = response.headers["etag"]
+            assert response.headers["accept-ranges"] == "bytes"
+            assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+            print("[OK] Telechargement complet avec ETag, 304 si inchange")
+            
+            response = client.get(url, headers={"Range": "bytes=10-19"})
+            assert response.status_code == 206 and response.content == data[10:20]
+            assert response.headers["content-range"] == f"bytes 10-19/{len(data)}"
+            assert client.get(url, headers={"Range": "bytes=-5"}).content == data[-5:]
+            assert client.get(url, headers={"Range": "bytes=255990-"}).content == data[255990:]
+            assert client.get(url, headers={"Range": f"bytes={len(data)}-"}).status_code == 416
+            assert client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"autre"'}).status_code == 200
+            print("[OK] Plages d'octets (206, 416, If-Range)")
+            
+            assert client.delete(f"/api/v1/task/{task_id}").status_code == 200
+            assert not store.exists(f"contestation_{task_id}.pdf")
+            print("[OK] Lettre supprimee avec la tache")
+        finally:
+            app.task_store.delete(task_id)
+            app.result_store = original_store
+    
+    return True
+
+def test_concurrent_extraction():
+    """Test l'extraction des documents en parallele et l'echec rapide sur un document obligatoire"""
+    print("\n=== Test de l'extraction en parallele ===")
+    
+    import asyncio
+    import time
+    import app
+    
+    cancelled = []
+    def fake_scan(delay, error=None):
+        async def scan(file_path, content_hash=None):
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                cancelled.append(file_path)
+                raise
+            if error:
+                raise RuntimeError(error)
+            return {"fichier": file_path}
+        return scan
+    
+    def run(scans, required):
+        original_steps, original_required = dict(app.SCAN_STEPS), app.REQUIRED_DOCUMENTS
+        app.SCAN_STEPS.update({doc_type: (message, scans[doc_type], label)
+                               for doc_type, (message, _, label) in original_steps.items()})
+        app.REQUIRED_DOCUMENTS = required
+        task_id = f"test-extraction-{len(cancelled)}-{time.monotonic_ns()}"
+        try:
+            app.create_task(task_id, {})
+            started_at = time.monotonic()
+            result = asyncio.run(app.extract_documents(task_id, {doc_type: doc_type for doc_type in scans}))
+            return result, time.monotonic() - started_at, app.task_store.get(task_id)
+        finally:
+            app.SCAN_STEPS.update(original_steps)
+            app.REQUIRED_DOCUMENTS = original_required
+            app.task_store.delete(task_id)
+    
+    doc_types = list(app.SCAN_STEPS)
+    result, duration, task = run({doc_type: fake_scan(0.3) for doc_type in doc_types}, set(doc_types))
+    assert set(result) == set(doc_types) and duration < 0.6
+    assert set(task["documents"].values()) == {"COMPLETED"} and task["progress"] == 45
+    print(f"[OK] {len(doc_types)} documents extraits en parallele en {duration:.2f}s")
+    
+    scans = {doc_type: fake_scan(5) for doc_type in doc_types}
+    scans["contravention"] = fake_scan(0.05, error="document illisible")
+    result, duration, task = run(scans, set(doc_types))
+    assert result is None and duration < 1
+    assert task["status"] == "FAILED" and "document illisible" in task["error"]
+    assert sorted(cancelled) == sorted(doc_type for doc_type in doc_types if doc_type != "contravention")
+    assert {task["documents"][doc_type] for doc_type in doc_types if doc_type != "contravention"} == {"CANCELLED"}
+    print("[OK] Echec rapide: scans en cours annules des qu'un document obligatoire echoue")
+    
+    scans = {doc_type: fake_scan(0.05) for doc_type in doc_types}
+    scans["domicile"] = fake_scan(0.01, error="justificatif illisible")
+    result, _, task = run(scans, set(doc_types) - {"domicile"})
+    assert "domicile" not in result and set(result) == set(doc_types) - {"domicile"}
+    assert task["documents"]["domicile"] == "FAILED" and "domicile" in task["scan_errors"]
+    print("[OK] Document facultatif en echec ignore (mode degrade)")
+    
+    return True
+
+def test_task_events():
+    """Test le flux SSE de statut d'une tache"""
+    print("\n=== Test du flux SSE de statut ===")
+    
+    import json
+    import threading
+    import time
+    from fastapi.testclient import TestClient
+    import app
+    
+    client = TestClient(app.app)
+    assert client.get("/api/v1/task/inconnue/events").status_code == 404
+    
+    task_id = "test-evenements"
+    app.create_task(task_id, {})
+    def progress():
+        time.sleep(0.2)
+        app.update_task_status(task_id, "VALIDATING", "Validation en cours")
+        time.sleep(0.1)
+        app.update_task_status(task_id, "COMPLETED", "Traitement termine")
+    try:
+        updater = threading.Thread(target=progress)
+        updater.start()
+        events = []
+        with client.stream("GET", f"/api/v1/task/{task_id}/events") as response:
+            assert response.headers["content-type"].startswith("text/event-stream")
+            for line in response.iter_lines():
+                if line.startswith("data: "):
+                    events.append(json.loads(line[len("data: "):]))
+        updater.join()
+    finally:
+        app.task_store.delete(task_id)
+    statuses = [event["status"] for event in events]
+    assert statuses[0] == "UPLOADED" and statuses[-1] == "COMPLETED" and "VALIDATING" in statuses
+    assert events[-1]["progress"] == 100
+    print(f"[OK] Evenements recus dans l'ordre: {' -> '.join(statuses)}, flux ferme a la fin")
+    
+    return True
+
+def test_upload_limits():
+    """Test la sauvegarde des fichiers par blocs (empreinte) et les limites de taille (413)"""
+    print("\n=== Test des limites d'upload ===")
+    
+    import asyncio
+    import hashlib
+    import io
+    from fastapi import HTTPException
+    from fastapi.testclient import TestClient
+    from starlette.datastructures import UploadFile
+    import app
+    
+    original = (app.MAX_UPLOAD_FILE_BYTES, app.MAX_UPLOAD_REQUEST_BYTES, app.UPLOAD_CHUNK_SIZE)
+    def upload(data, name):
+        # Taille inconnue d'avance: seule la lecture par blocs peut appliquer les limites
+        return UploadFile(io.BytesIO(data), filename=name)
+    def save(task_id, files):
+        return asyncio.run(app.save_uploaded_files(task_id, files))
+    
+    try:
+        app.UPLOAD_CHUNK_SIZE = 1000
+        app.MAX_UPLOAD_FILE_BYTES, app.MAX_UPLOAD_REQUEST_BYTES = 5000, 8000
+        data = bytes(range(256)) * 16
+        
+        paths, hashes = save("test-upload-ok", {"contravention": upload(data, "avis.pdf"), "permis": upload(b"permis", "permis.jpg")})
+        assert Path(paths["contravention"]).read_bytes() == data
+        assert hashes["contravention"] == hashlib.sha256(data).hexdigest()
+        print("[OK] Fichiers ecrits par blocs avec leur empreinte SHA-256")
+        
+        for files, limit in (({"contravention": upload(b"x" * 5001, "avis.pdf")}, "Fichier contravention"),
+                             ({"contravention": upload(data, "avis.pdf"), "permis": upload(data, "permis.pdf")}, "Documents")):
+            try:
+                save("test-upload-trop-gros", files)
+                assert False, "Limite de taille ignoree"
+            except HTTPException as e:
+                assert e.status_code == 413 and e.detail.startswith(limit)
+        print("[OK] Limites par fichier et par demande appliquees pendant la copie")
+        
+        app.MAX_UPLOAD_FILE_BYTES = 10
+        uploads_before = set(app.UPLOAD_DIR.iterdir())
+        files = {doc_type: (f"{doc_type}.pdf", b"%PDF-1.4 " + b"x" * 100, "application/pdf")
+                 for doc_type in ("contravention", "certificat", "permis", "domicile")}
+        # File de traitement non demarree hors du service: admission forcee
+        app.job_queue.is_full = lambda: False
+        response = TestClient(app.app).post("/api/v1/process-documents", files=files)
+        assert response.status_code == 413
+        assert set(app.UPLOAD_DIR.iterdir()) == uploads_before
+        print("[OK] Reponse 413 de l'API, fichiers de la demande supprimes")
+    finally:
+        app.MAX_UPLOAD_FILE_BYTES, app.MAX_UPLOAD_REQUEST_BYTES, app.UPLOAD_CHUNK_SIZE = original
+        app.job_queue.__dict__.pop("is_full", None)
+        app.cleanup_files("test-upload-ok")
+        app.cleanup_files("test-upload-trop-gros")
+    
+    return True
+
+def test_image_preprocessing():
+    """Test le pretraitement des images (redimensionnement, envoi tel quel des petites images)"""
+    print("\n=== Test du pretraitement des images ===")
+    
+    import base64
+    import io
+    from PIL import Image
+    import preprocess
+    
+    def png(width, height, stripes=False):
+        image = Image.new("1", (width, height), color=1)
+        if stripes:
+            # Rayures d'un pixel: PNG noir et blanc tres compact, JPEG bien plus lourd
+            image = Image.frombytes("1", (width, height), bytes([0b10101010]) * (width // 8 * height))
+        output = io.BytesIO()
+        image.save(output, format="PNG", optimize=True)
+        return output.getvalue()
+    
+    # Le PNG d'origine est plus petit que le JPEG recompresse, mais trop grand en pixels
+    raw = png(4000, 3000, stripes=True)
+    images, tokens_before, tokens_after, size = preprocess._preprocess_image(raw)
+    assert images[0]["media_type"] == "image/jpeg"
+    with Image.open(io.BytesIO(base64.b64decode(images[0]["base64_data"]))) as image:
+        assert max(image.size) == preprocess.PREPROCESS_MAX_LONG_EDGE
+    assert tokens_after <= tokens_before
+    print("[OK] Image trop grande redimensionnee meme si le fichier d'origine est plus leger")
+    
+    raw = png(200, 100)
+    images, tokens_before, tokens_after, size = preprocess._preprocess_image(raw)
+    assert images[0]["media_type"] == "image/png" and base64.b64decode(images[0]["base64_data"]) == raw
+    assert size == len(raw) and tokens_before == tokens_after
+    print("[OK] Petite image compacte envoyee telle quelle")
+    
+    return True
+
+def test_local_validation():
+    """Test la validation locale des noms et de la date du justificatif"""
+    print("\n=== Test de la validation locale ===")
+    
+    from datetime import date
+    from validation_rules import compare_names, parse_french_date, check_documents
+    
+    assert compare_names("DUPONT Jean-François", "Dupont jean francois") is True
+    assert compare_names("DUPONT Jean", "DUPONT JEAN PIERRE MARIE") is True
+    assert compare_names("DUPONT Jean", "MARTIN Sophie") is False
+    assert compare_names("DUPONT Jean", "DUPOND Jean") is None
+    assert compare_names("DUPONT Jean", "DUPONT Jean-Marie") is None
+    assert compare_names("DUPONT Jean-Marie", "DUPONT Jean Marie Pierre") is True
+    assert compare_names("LEE Ann", "LEE Anne") is None
+    print("[OK] Comparaison des noms (accents, casse, tirets, prenoms supplementaires)")
+    
+    assert parse_french_date("15/03/2024") == date(2024, 3, 15)
+    assert parse_french_date("2024-03-15") == date(2024, 3, 15)
+    assert parse_french_date("1er févr. 2024") == date(2024, 2, 1)
+    assert parse_french_date("Facture de mars 2024") is None
+    print("[OK] Lecture des dates francaises")
+    
+    today = date(2024, 5, 31)
+    contravention = {"identité": {"nom": "DUPONT", "prenom": "Jean"}}
+    justificatif = {"personne": {"nom": "Dupont", "prenom": "Jean"}, "domicile": {"date_justificatif": "29 février 2024"}}
+    result = check_documents(contravention, justificatif_data=justificatif, today=today)
+    assert result["names_consistent"] is True and result["date_valid"] is True
+    assert result["overall_status"] == "VALID"
+    
+    justificatif["domicile"]["date_justificatif"] = "28/02/2024"
+    assert check_documents(contravention, justificatif_data=justificatif, today=today)["overall_status"] == "INVALID"
+    
+    justificatif["domicile"]["date_justificatif"] = "mars 2024"
+    assert check_documents(contravention, justificatif_data=justificatif, today=today) is None
+    print("[OK] Validation locale, repli sur le modele si ambigue")
+    
+    return True
+
+def test_prompt_registry():
+    """Test le registre de prompts (prefixe partage mis en cache, version des prompts)"""
+    print("\n=== Test du registre de prompts ===")
+    
+    import prompts
+    from scan import _prompt_version
+    
+    system = prompts.system_prompt()
+    assert system[0]["cache_control"] == {"type": "ephemeral"}
+    for doc_type, template in prompts.PROMPT_TEMPLATES.items():
+        assert template["text"] in system[0]["text"]
+    print("[OK] Prompt systeme partage avec point de mise en cache")
+    
+    before = {doc_type: _prompt_version(doc_type) for doc_type in prompts.PROMPT_TEMPLATES}
+    original = prompts.SHARED_PROMPT
+    try:
+        prompts.SHARED_PROMPT = original + "\n- Nouvelle consigne"
+        assert all(_prompt_version(doc_type) != version for doc_type, version in before.items())
+    finally:
+        prompts.SHARED_PROMPT = original
+    assert {doc_type: _prompt_version(doc_type) for doc_type in before} == before
+    print("[OK] Une modification des prompts invalide le cache d'extraction")
+    
+    return True
+
+def test_resilience():
+    """Test les reprises sur erreurs transitoires et le disjoncteur des appels au modèle"""
+    print("\n=== Test des reprises et du disjoncteur ===")
+    
+    import anthropic
+    import httpx
+    from resilience import CircuitBreaker, CircuitOpenError, call_with_retries, retry_after
+    
+    def api_error(status_code, headers=None):
+        response = httpx.Response(status_code, headers=headers or {}, request=httpx.Request("POST", "https://api.anthropic.com"))
+        return anthropic.APIStatusError("erreur", response=response, body=None)
+    
+    assert retry_after(api_error(429, {"retry-after": "2"})) == 2.0
+    assert retry_after(api_error(429, {"retry-after-ms": "250"})) == 0.25
+    
+    circuit = CircuitBreaker("Test", failure_threshold=2, reset_timeout=60)
+    calls = []
+    def flaky_create(timeout=None, **request):
+        calls.append(timeout)
+        if len(calls) == 1:
+            raise api_error(529, {"retry-after": "0"})
+        return {"ok": True, **request}
+    
+    assert call_with_retries(flaky_create, circuit=circuit, model="test") == {"ok": True, "model": "test"}
+    assert len(calls) == 2 and all(timeout > 0 for timeout in calls)
+    assert circuit.state == "closed"
+    print("[OK] Reprise apres une erreur 529 avec retry-after")
+    
+    def bad_request(timeout=None, **request):
+        raise api_error(400)
+    try:
+        call_with_retries(bad_request, circuit=circuit)
+        assert False, "Une erreur 400 ne doit pas etre reprise"
+    except anthropic.APIStatusError as e:
+        assert e.status_code == 400
+    print("[OK] Pas de reprise sur erreur client")
+    
+    def overloaded(timeout=None, **request):
+        raise api_error(529, {"retry-after": "0"})
+    try:
+        call_with_retries(overloaded, circuit=circuit)
+        assert False, "Le disjoncteur doit s'ouvrir"
+    except CircuitOpenError:
+        pass
+    assert circuit.state == "open"
+    print("[OK] Disjoncteur ouvert apres des echecs consecutifs")
+    
+    circuit = CircuitBreaker("Test", failure_threshold=2, reset_timeout=60)
+    rate_limited = []
+    def throttled(timeout=None, **request):
+        rate_limited.append(timeout)
+        if len(rate_limited) <= 3:
+            raise api_error(429, {"retry-after": "0"})
+        return {"ok": True}
+    assert call_with_retries(throttled, circuit=circuit) == {"ok": True}
+    assert len(rate_limited) == 4 and circuit.state == "closed" and circuit.consecutive_failures == 0
+    print("[OK] Erreurs 429 reprises sans ouvrir le disjoncteur")
+    
+    return True
+
+def test_rate_limiter():
+    """Test le limiteur de débit (requêtes, tokens estimés, classes de priorité)"""
+    print("\n=== Test du limiteur de debit ===")
+    
+    from rate_limiter import LocalBuckets, RateLimiter, RateLimitTimeout, estimate_request_tokens
+    
+    request = {
+        "system": [{"type": "text", "text": "x" * 350}],
+        "messages": [{"role": "user", "content": [{"type": "image", "source": {}}, {"type": "text", "text": "y" * 35}]}]
+    }
+    assert estimate_request_tokens(request) == 1533 + 110
+    print("[OK] Estimation des tokens d'une requete")
+    
+    limiter = RateLimiter(LocalBuckets(requests_per_minute=10, tokens_per_minute=60000), bulk_reserve=0.2, max_wait=0.3)
+    for _ in range(8):
+        limiter.acquire(100, priority="bulk")
+    try:
+        limiter.acquire(100, priority="bulk")
+        assert False, "La reserve interactive ne doit pas etre consommee par les traitements bulk"
+    except RateLimitTimeout:
+        pass
+    limiter.acquire(100, priority="interactive")
+    limiter.acquire(100, priority="interactive")
+    stats = limiter.stats()["priorities"]
+    assert stats["bulk"]["calls"] == 8 and stats["interactive"]["calls"] == 2
+    print("[OK] Reserve de capacite pour les traitements interactifs")
+    
+    limiter.settle(100, 5000, priority="interactive")
+    assert limiter.stats()["levels"]["tokens"] < 60000 - 5000
+    print("[OK] Correction du budget de tokens avec l'usage reel")
+    
+    import time
+    from resilience import CircuitBreaker, call_with_retries
+    
+    limiter = RateLimiter(LocalBuckets(requests_per_minute=1, tokens_per_minute=60000), max_wait=300)
+    limiter.acquire(100)
+    started_at = time.monotonic()
+    try:
+        limiter.acquire(100, max_wait=0.2)
+        assert False, "L'attente doit etre bornee par max_wait"
+    except RateLimitTimeout:
+        assert time.monotonic() - started_at < 1
+    
+    circuit = CircuitBreaker("Test", failure_threshold=1, reset_timeout=0)
+    circuit.record_failure()
+    waits = []
+    def no_capacity(request, max_wait=None):
+        waits.append(max_wait)
+        limiter.acquire(100, max_wait=max_wait)
+    try:
+        call_with_retries(lambda timeout=None, **request: {"ok": True}, deadline=0.2, circuit=circuit, before_attempt=no_capacity)
+        assert False, "L'attente de capacite doit etre bornee par l'echeance de l'appel"
+    except RateLimitTimeout:
+        pass
+    assert 0 < waits[0] <= 0.2
+    assert call_with_retries(lambda timeout=None, **request: {"ok": True}, circuit=circuit) == {"ok": True}
+    print("[OK] Attente de capacite avant le disjoncteur, bornee par l'echeance de l'appel")
+    
+    return True
+
 def main():
     """Fonction principale des tests"""
     print("Tests d'integration et de compatibilite")
@@ -224,6 +1671,102 @@ def main():
     if not test_data_compatibility():
         success = False
     
+    # Test 4: Cache d'extraction
+    if not test_extraction_cache():
+        success = False
+    
+    # Test 5: Stockage des taches
+    if not test_task_stores():
+        success = False
+    
+    # Test 6: File de traitement
+    if not test_job_queue():
+        success = False
+    
+    # Test 7: Mode d'extraction groupe
+    if not test_batched_scan():
+        success = False
+    
+    # Test 8: Validation locale
+    if not test_local_validation():
+        success = False
+    
+    # Test 9: Registre de prompts
+    if not test_prompt_registry():
+        success = False
+    
+    # Test 10: Reprises et disjoncteur
+    if not test_resilience():
+        success = False
+    
+    # Test 11: Limiteur de debit
+    if not test_rate_limiter():
+        success = False
+    
+    # Test 12: Extraction structuree
+    if not test_structured_extraction():
+        success = False
+    
+    # Test 13: Controle par champ et re-extraction ciblee
+    if not test_field_checks():
+        success = False
+    
+    # Test 14: Routage des modeles
+    if not test_model_routing():
+        success = False
+    
+    # Test 15: OCR local
+    if not test_local_ocr():
+        success = False
+    
+    # Test 16: Couche texte PDF
+    if not test_pdf_text_layer():
+        success = False
+    
+    # Test 17: Pool de navigateurs
+    if not test_browser_pool():
+        success = False
+    
+    # Test 18: Remplissage scripte du formulaire
+    if not test_scripted_form():
+        success = False
+    
+    # Test 19: Registre des moteurs de rendu
+    if not test_renderer_registry():
+        success = False
+    
+    # Test 20: Service de compilation LaTeX
+    if not test_latex_service():
+        success = False
+    
+    # Test 21: Gabarits de lettre
+    if not test_letter_templates():
+        success = False
+    
+    # Test 22: Rendu ReportLab
+    if not test_reportlab_letter():
+        success = False
+    
+    # Test 23: Stockage des résultats
+    if not test_result_store():
+        success = False
+    
+    # Test 24: Extraction en parallèle
+    if not test_concurrent_extraction():
+        success = False
+    
+    # Test 25: Flux SSE de statut
+    if not test_task_events():
+        success = False
+    
+    # Test 26: Limites d'upload
+    if not test_upload_limits():
+        success = False
+    
+    # Test 27: Prétraitement des images
+    if not test_image_preprocessing():
+        success = False
+    
     print("\n" + "=" * 50)
     if success:
         print("TOUS LES TESTS SONT PASSES!")
@@ -0,0 +1,256 @@
+"""
+Deterministic consistency checks between extracted documents.
+
+The cross-document validation only compares a handful of names and checks that the
+proof of residence is less than three months old. Both checks are done locally:
+names are normalized (accents, case, apostrophes, a missing hyphen, extra given
+names) and only accepted locally when their words match exactly; difflib only tells
+clearly different names apart. Dates are parsed from the usual French formats. The
+model is needed when a name pair is neither clearly the same nor clearly different
+(an OCR error on one letter, "Ann" / "Anne", "Jean" / "Jean-Marie") or when the
+date cannot be parsed; check_documents() returns None in that case.
+"""
+
+import calendar
+import difflib
+import logging
+import re
+import threading
+import unicodedata
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+# Similarity below which two names clearly differ; near matches are left to the model
+NAME_MISMATCH_RATIO = 0.6
+
+# Maximum age of the proof of residence, in calendar months
+JUSTIFICATIF_MAX_AGE_MONTHS = 3
+
+FRENCH_MONTHS = {
+    "janvier": 1, "janv": 1, "jan": 1,
+    "fevrier": 2, "fevr": 2, "fev": 2,
+    "mars": 3, "mar": 3,
+    "avril": 4, "avr": 4,
+    "mai": 5,
+    "juin": 6,
+    "juillet": 7, "juil": 7,
+    "aout": 8,
+    "septembre": 9, "sept": 9, "sep": 9,
+    "octobre": 10, "oct": 10,
+    "novembre": 11, "nov": 11,
+    "decembre": 12, "dec": 12,
+}
+
+NUMERIC_DATE = re.compile(r"\b(\d{1,2})\s*[/.\-]\s*(\d{1,2})\s*[/.\-]\s*(\d{4}|\d{2})\b")
+ISO_DATE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+TEXT_DATE = re.compile(r"\b(\d{1,2})(?:er)?\s+([a-z]+)\.?\s+(\d{4})\b")
+
+_stats = {"local": 0, "llm_fallback": 0}
+_stats_lock = threading.Lock()
+
+def _strip_accents(text):
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+def normalize_name(name):
+    """
+    Normalize a person name for comparison.
+
+    Args:
+        name (str): Name as extracted, e.g. "DUPONT-MARTIN Jean-François"
+
+    Returns:
+        list: Lowercase tokens without accents, hyphenated compounds kept whole,
+        e.g. ["dupont-martin", "jean-francois"]
+    """
+    text = _strip_accents(name or "").lower()
+    text = re.sub(r"-+", "-", re.sub(r"[^a-z-]+", " ", text))
+    tokens = [token.strip("-") for token in text.split()]
+    return [token for token in tokens if token and token != "none"]
+
+def _words(tokens):
+    """Tokens with hyphenated compounds split, to ignore a missing hyphen ("Jean François")"""
+    return sorted(word for token in tokens for word in token.split("-"))
+
+def compare_names(first, second):
+    """
+    Compare two names.
+
+    Returns:
+        bool | None: True if they designate the same person, False if they clearly
+        differ, None when the difference is too small to decide (OCR error, typo)
+    """
+    first_tokens, second_tokens = normalize_name(first), normalize_name(second)
+    if not first_tokens or not second_tokens:
+        return None
+    if _words(first_tokens) == _words(second_tokens):
+        return True
+
+    # Additional given names on one document only, as separate names ("Jean" / "Jean Pierre
+    # Marie"): "Jean-Marie" is a different given name from "Jean", not an extra one
+    shorter, longer = sorted((first_tokens, second_tokens), key=len)
+    longer_forms = set(longer) | {f"{a}-{b}" for a, b in zip(longer, longer[1:])}
+    if len(set(shorter)) >= 2 and set(shorter) <= longer_forms:
+        return True
+
+    # Close spellings ("Ann" / "Anne", "DUPOND" / "DUPONT") may be different people
+    ratio = difflib.SequenceMatcher(None, " ".join(_words(first_tokens)), " ".join(_words(second_tokens))).ratio()
+    if ratio <= NAME_MISMATCH_RATIO:
+        return False
+    return None
+
+def parse_french_date(text):
+    """
+    Parse a date written in a usual French format ("15/03/2024", "15-03-24",
+    "2024-03-15", "15 mars 2024", "1er févr. 2024").
+
+    Returns:
+        date | None: The parsed date, or None if no complete date was recognized
+    """
+    text = _strip_accents(text or "").lower()
+    try:
+        match = ISO_DATE.search(text)
+        if match:
+            return date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        match = NUMERIC_DATE.search(text)
+        if match:
+            year = int(match.group(3))
+            return date(year + 2000 if year < 100 else year, int(match.group(2)), int(match.group(1)))
+        match = TEXT_DATE.search(text)
+        if match and match.group(2) in FRENCH_MONTHS:
+            return date(int(match.group(3)), FRENCH_MONTHS[match.group(2)], int(match.group(1)))
+    except ValueError:
+        return None
+    return None
+
+def _months_before(day, months):
+    month_index = day.year * 12 + day.month - 1 - months
+    year, month = divmod(month_index, 12)
+    month += 1
+    # Clamp to the last day of the target month (e.g. 31/05 -> 28/02)
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+def check_justificatif_date(text, today=None):
+    """
+    Check that the proof of residence is less than three months old.
+
+    Returns:
+        tuple: (valid, explanation) where valid is None when the date cannot be parsed
+        or lies in the future
+    """
+    today = today or date.today()
+    parsed = parse_french_date(text)
+    if parsed is None:
+        return None, f"Date \"{text}\" non reconnue"
+    if parsed > today:
+        return None, f"Date {parsed.strftime('%d/%m/%Y')} postérieure à aujourd'hui"
+
+    limit = _months_before(today, JUSTIFICATIF_MAX_AGE_MONTHS)
+    if parsed >= limit:
+        return True, f"Justificatif du {parsed.strftime('%d/%m/%Y')}, moins de {JUSTIFICATIF_MAX_AGE_MONTHS} mois (limite: {limit.strftime('%d/%m/%Y')})"
+    return False, f"Justificatif du {parsed.strftime('%d/%m/%Y')}, plus de {JUSTIFICATIF_MAX_AGE_MONTHS} mois (limite: {limit.strftime('%d/%m/%Y')})"
+
+def collect_names(contravention_data, permis_data, certificat_data, justificatif_data):
+    """
+    Gather the person named on each document.
+
+    Returns:
+        tuple: ([(label, description, full_name), ...], justificatif_date)
+    """
+    sources = [
+        ("Contravention", "Contravention", contravention_data, "identité"),
+        ("Permis", "Permis de conduire", permis_data, "identite"),
+        ("Certificat", "Certificat d'immatriculation", certificat_data, "proprietaire"),
+        ("Justificatif", "Justificatif de domicile", justificatif_data, "personne"),
+    ]
+    names = []
+    justificatif_date = None
+    for label, description, data, key in sources:
+        if not data or key not in data:
+            continue
+        person = data[key]
+        if person.get("nom") and person.get("nom") != "NONE":
+            names.append((label, description, f"{person.get('nom', '')} {person.get('prenom', '')}"))
+            if label == "Justificatif":
+                justificatif_date = data.get("domicile", {}).get("date_justificatif")
+    return names, justificatif_date
+
+def check_documents(contravention_data=None, permis_data=None, certificat_data=None, justificatif_data=None, today=None):
+    """
+    Run the name and date checks locally.
+
+    Returns:
+        dict | None: The checks in the format of the model's answer (names_consistent,
+        names_explanation, names_found, date_valid, date_explanation, date_found,
+        overall_status, summary), or None when a check is ambiguous and needs the model
+    """
+    names, justificatif_date = collect_names(contravention_data, permis_data, certificat_data, justificatif_data)
+    found_names = [f"{label}: {name}" for label, _, name in names]
+
+    names_consistent = None
+    names_explanation = "Moins de 2 noms trouvés, cohérence non vérifiable"
+    if len(names) >= 2:
+        mismatches, ambiguous = [], []
+        reference_label, _, reference = names[0]
+        for label, _, name in names[1:]:
+            same = compare_names(reference, name)
+            if same is False:
+                mismatches.append(f"{label} ({name.strip()})")
+            elif same is None:
+                ambiguous.append(label)
+        if mismatches:
+            names_consistent = False
+            names_explanation = f"Nom différent de celui de {reference_label} ({reference.strip()}): {', '.join(mismatches)}"
+        elif ambiguous:
+            logger.info(f"Ambiguous name comparison for {', '.join(ambiguous)}, deferring to the model")
+            return None
+        else:
+            names_consistent = True
+            names_explanation = f"Même personne sur les {len(names)} documents (accents, casse, tirets et prénoms supplémentaires ignorés)"
+
+    date_valid, date_explanation = None, None
+    if justificatif_date and justificatif_date != "NONE":
+        date_valid, date_explanation = check_justificatif_date(justificatif_date, today)
+        if date_valid is None:
+            logger.info(f"Could not check the proof of residence date ({date_explanation}), deferring to the model")
+            return None
+
+    if names_consistent is False or date_valid is False:
+        overall_status = "INVALID"
+    elif names_consistent is True:
+        overall_status = "VALID"
+    else:
+        overall_status = "WARNING"
+
+    summary = {
+        "VALID": "✅ Documents cohérents",
+        "INVALID": "❌ Incohérence détectée",
+        "WARNING": "⚠️ Vérification partielle",
+    }[overall_status]
+    details = [names_explanation] + ([date_explanation] if date_explanation else [])
+
+    return {
+        "names_consistent": names_consistent,
+        "names_explanation": names_explanation,
+        "names_found": found_names,
+        "date_valid": date_valid,
+        "date_explanation": date_explanation,
+        "date_found": justificatif_date if justificatif_date and justificatif_date != "NONE" else None,
+        "overall_status": overall_status,
+        "summary": f"{summary}: {' - '.join(details)}",
+    }
+
+def record_validation(mode):
+    """Count a validation done locally ("local") or by the model ("llm_fallback")."""
+    with _stats_lock:
+        _stats[mode] += 1
+
+def get_validation_stats():
+    """
+    Return how many validations were done locally and how many needed the model.
+
+    Returns:
+        dict: {"local": int, "llm_fallback": int}
+    """
+    with _stats_lock:
+        return dict(_stats)